@@ -7,86 +7,14 @@ import matplotlib.pyplot as plt
 import mplhep as hep
 import ROOT as r
 plt.style.use(hep.style.CMS)
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from PyHist import PyHist
+from postfit_hists import get_hists
 import copy
 import matplotlib
 from TwoDAlphabet.plotstyle import *
 
-def get_binning_x(hLow,hSig,hHigh):
-    bins = []
-    for i in range(1,hLow.GetNbinsX()+1):
-        bins.append(hLow.GetXaxis().GetBinLowEdge(i))
-    for i in range(1,hSig.GetNbinsX()+1):
-        bins.append(hSig.GetXaxis().GetBinLowEdge(i))
-    for i in range(1,hHigh.GetNbinsX()+2):#low edge of overflow is high edge of last bin
-        bins.append(hHigh.GetXaxis().GetBinLowEdge(i))
-    bins = np.array(bins,dtype='float64')
-    return bins
-
-def get_binning_y(hLow,hSig,hHigh):
-    #histos should have same binning in Y
-    bins = []
-    for i in range(1,hLow.GetNbinsY()+2):
-        bins.append(hLow.GetYaxis().GetBinLowEdge(i))
-    bins = np.array(bins,dtype='float64')
-    return bins
-
-def get2DPostfitPlot(file, process, region, prefit=False):
-    if not r.TFile.Open(file):
-        raise FileNotFoundError(f"The file '{file}' does not exist or cannot be opened.")
-    
-    f = r.TFile.Open(file)
-    fitStatus = "prefit" if prefit else "postfit"
-    
-    hLow = f.Get(f"{region}_LOW_{fitStatus}/{process}")
-    if not hLow:
-        raise ValueError(f"Histogram '{region}_LOW_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    hSig = f.Get(f"{region}_SIG_{fitStatus}/{process}")
-    if not hSig:
-        raise ValueError(f"Histogram '{region}_SIG_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    hHigh = f.Get(f"{region}_HIGH_{fitStatus}/{process}")
-    if not hHigh:
-        raise ValueError(f"Histogram '{region}_HIGH_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    h2 = merge_low_sig_high(hLow, hSig, hHigh, hName=f"h2_{process}_{region}")
-    h2.SetDirectory(0)
-    return h2
-
-
-def merge_low_sig_high(hLow,hSig,hHigh,hName="temp"):
-    n_x_low     = hLow.GetNbinsX()
-    n_x_sig     = hSig.GetNbinsX()
-    n_x_high    = hHigh.GetNbinsX()
-    n_x         = n_x_low + n_x_sig + n_x_high
-    n_y         = hLow.GetNbinsY()#assumes Y bins are the same
-    bins_x      = get_binning_x(hLow,hSig,hHigh)
-    bins_y      = get_binning_y(hLow,hSig,hHigh)
-    h_res       = r.TH2F(hName,"",n_x,bins_x,n_y,bins_y)
-    for i in range(1,n_x_low+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+0,j,hLow.GetBinContent(i,j))
-            h_res.SetBinError(i+0,j,hLow.GetBinError(i,j))
-
-    for i in range(1,n_x_sig+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+n_x_low,j,hSig.GetBinContent(i,j))
-            h_res.SetBinError(i+n_x_low,j,hSig.GetBinError(i,j))
-
-    for i in range(1,n_x_high+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+n_x_sig+n_x_low,j,hHigh.GetBinContent(i,j))
-            h_res.SetBinError(i+n_x_sig+n_x_low,j,hHigh.GetBinError(i,j))
-    return h_res
-
-def get_hists(input_file,region,processes):
-    histos_region_dict = {}
-    for process in processes:
-        h2 = get2DPostfitPlot(input_file,process,region)
-        histos_region_dict[process]=h2
-    return histos_region_dict
-
 def calcRatio(hData,hMC,dataErrs):
     ratioVals=[]
     ratioErrs = copy.deepcopy(dataErrs)
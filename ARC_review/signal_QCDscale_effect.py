@@ -5,6 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import mplhep as hep
 import ROOT as r
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from PyHist import PyHist
 import copy
 import matplotlib
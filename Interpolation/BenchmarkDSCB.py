@@ -0,0 +1,127 @@
+'''
+Benchmark the NumPy DSCB fit (DSCB.py) against the RooFit fit (FitAllShapes.fit) over the signal grid.
+
+For every existing (mT, mPhi) of the given year the nominal histograms of the four regions are
+fitted with both engines, starting from the same default values. The fits per second of each engine
+and the largest parameter difference (in units of the RooFit uncertainty) are reported.
+
+With --synthetic, histograms of known DSCB shapes are generated on the 50x27 (mPhi, mT) grid
+instead, so that the NumPy fitter can be benchmarked (and its parameter recovery checked) without
+ROOT or the selection files.
+
+Examples:
+    python BenchmarkDSCB.py -y 16
+    python BenchmarkDSCB.py --synthetic
+'''
+import os, sys, time
+import numpy as np
+import DSCB
+from DSCB import PARAMS, xMin, xMax, yMin, yMax
+
+MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
+MPs = [75, 100, 125, 175, 200, 250, 350, 450, 500]
+REGIONS = ['SR_fail', 'SR_pass', 'ttbarCR_fail', 'ttbarCR_pass']
+
+nX = 50
+nY = 27
+
+def default_init(mT, mPhi):
+    init = {name: val for name, (val, _, _) in PARAMS.items()}
+    init['muX'] = float(mPhi)
+    init['muY'] = float(mT)
+    return init
+
+def synthetic(mT, mPhi, nEvents, rng):
+    '''Poisson-fluctuated histogram of a DSCB with mass-dependent resolution and random tails'''
+    xedges = np.linspace(xMin, xMax, nX+1)
+    yedges = np.linspace(yMin, yMax, nY+1)
+    true = {
+        'muX': 0.98*mPhi, 'wdX': 0.08*mPhi, 'a1X': rng.uniform(0.8, 2.), 'p1X': rng.uniform(2., 10.), 'a2X': rng.uniform(0.8, 2.), 'p2X': rng.uniform(2., 10.),
+        'muY': 0.99*mT,   'wdY': 0.05*mT,   'a1Y': rng.uniform(0.8, 2.), 'p1Y': rng.uniform(2., 10.), 'a2Y': rng.uniform(0.8, 2.), 'p2Y': rng.uniform(2., 10.),
+    }
+    counts = rng.poisson(DSCB.template(true, xedges, yedges, nEvents)).astype(float)
+    return counts, xedges, yedges, true
+
+def bench_synthetic(nEvents, seed):
+    rng = np.random.default_rng(seed)
+    times, pulls, nfail = [], [], 0
+    for mT in MTs:
+        for mPhi in MPs:
+            counts, xedges, yedges, true = synthetic(mT, mPhi, nEvents, rng)
+            start = time.perf_counter()
+            values, errors, info = DSCB.fit(counts, xedges, yedges, default_init(mT, mPhi))
+            times.append(time.perf_counter() - start)
+            nfail += info['status'] != 0
+            # Only the core parameters are well constrained for all shapes
+            pulls.append(max(abs(values[p] - true[p])/errors[p] for p in ['muX','wdX','muY','wdY']))
+    print(f'NumPy: {len(times)} synthetic fits, {nfail} not converged')
+    print(f'    {len(times)/sum(times):.1f} fits/s (median {1e3*np.median(times):.1f} ms per fit)')
+    print(f'    median largest pull of mu/width w.r.t. the true values: {np.nanmedian(pulls):.2f}')
+
+def bench_grid(year, mts, mps):
+    import ROOT
+    from ROOT import RooRealVar
+    from FitAllShapes import fit as roofit
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from xrdcache import fetch, selection_url
+    ROOT.gROOT.SetBatch(True)
+    ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+
+    x = RooRealVar('mPhi','mPhi',xMin,xMax)
+    y = RooRealVar('mT','mT',yMin,yMax)
+    ws = ROOT.RooWorkspace('w')
+    t_roofit, t_numpy, pulls, nfail = [], [], [], {'roofit': 0, 'numpy': 0}
+    for mT in mts:
+        for mPhi in mps:
+            try:
+                f = ROOT.TFile.Open(fetch(selection_url(f'THselection_TprimeB-{mT}-{mPhi}_{year}.root')))
+            except FileNotFoundError:
+                continue
+            for region in REGIONS:
+                histName = f'MHvsMTH_{region}__nominal'
+                init = default_init(mT, mPhi)
+                start = time.perf_counter()
+                row, _ = roofit(f, ws, x, y, year, histName, 'nominal', region, mPhi, mT, init)
+                t_roofit.append(time.perf_counter() - start)
+                # Include the histogram conversion in the NumPy timing
+                start = time.perf_counter()
+                values, errors, info = DSCB.fit(*DSCB.th2_to_numpy(f.Get(histName)), init)
+                t_numpy.append(time.perf_counter() - start)
+                nfail['roofit'] += row['status'] != 0
+                nfail['numpy']  += info['status'] != 0
+                pulls.append(np.nanmax([abs(values[p] - row[p])/row[f'{p}_err'] for p in PARAMS if row[f'{p}_err'] > 0]))
+            f.Close()
+    print(f'{len(t_roofit)} fits of the {year} signal grid')
+    print(f'{"":8}{"fits/s":>10}{"ms/fit":>10}{"failed":>8}')
+    for name, t in [('roofit', t_roofit), ('numpy', t_numpy)]:
+        print(f'{name:8}{len(t)/sum(t):10.2f}{1e3*np.median(t):10.1f}{nfail[name]:8}')
+    print(f'Speedup: {sum(t_roofit)/sum(t_numpy):.1f}x')
+    print(f'Largest parameter difference per fit (RooFit sigma): median {np.median(pulls):.2f}, max {np.max(pulls):.2f}')
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('-y', type=str, dest='year',
+                        action='store', default='16',
+                        help='Run II year')
+    parser.add_argument('--MTs', type=int, dest='MTs', nargs='+',
+                        action='store', default=MTs,
+                        help='Tprime masses to fit')
+    parser.add_argument('--MPs', type=int, dest='MPs', nargs='+',
+                        action='store', default=MPs,
+                        help='Phi masses to fit')
+    parser.add_argument('--synthetic', dest='synthetic',
+                        action='store_true',
+                        help='Benchmark the NumPy fit on synthetic histograms only (no ROOT needed)')
+    parser.add_argument('--nEvents', type=float, dest='nEvents',
+                        action='store', default=5000.,
+                        help='Number of events of the synthetic histograms')
+    parser.add_argument('--seed', type=int, dest='seed',
+                        action='store', default=1,
+                        help='Random seed of the synthetic histograms')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        bench_synthetic(args.nEvents, args.seed)
+    else:
+        bench_grid(args.year, args.MTs, args.MPs)
@@ -0,0 +1,241 @@
+'''
+NumPy/SciPy implementation of the binned 2D double-sided crystal ball (DSCB) fit used for the signal
+shapes, as a fast alternative to the RooFit fit in FitAllShapes.py/Interpolator.py.
+
+The model is the same as the RooFit one: the product of a DSCB in X (mPhi) and a DSCB in Y (mT), each
+with the parameters of RooCrystalBall(x, x0, sigma, alphaL, nL, alphaR, nR), which are called
+muX, wdX, a1X, p1X, a2X, p2X (and the same for Y). The parameter bounds (PARAMS) are shared with
+FitAllShapes.py.
+
+Differences to the RooFit fit:
+    * The expected fraction in each bin is the analytic integral of the DSCB over the bin, instead of
+      the PDF value at the bin center.
+    * Since the model is a product of a function of X and a function of Y, the binned likelihood of
+      the 2D histogram is the sum of the likelihoods of its X and Y projections. The 2D fit is
+      therefore done as two independent 6-parameter fits of the projections.
+    * The parameter uncertainties come from the numerical Hessian of the NLL at the minimum.
+
+Validate against RooFit for one signal (requires ROOT):
+    python DSCB.py -s 1800-125 -y 16
+'''
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import erf, erfc
+
+# X = mPhi
+xMin = 60
+xMax = 560
+
+# Y = mT
+yMin = 800
+yMax = 3500
+
+# DSCB parameters: (default initial value, min, max). The default initial values of muX and muY are the signal masses.
+PARAMS = {
+    'muX': (None, 60.,    560.),
+    'wdX': (20.,  0.001,  100.),
+    'a1X': (3.,   0.001,  100.),
+    'p1X': (3.,   0.1,    100.),
+    'a2X': (3.,   0.001,  100.),
+    'p2X': (3.,   0.001,  100.),
+    'muY': (None, 1.,     4000.),
+    'wdY': (140., 0.001,  500.),
+    'a1Y': (10.,  0.001,  100.),
+    'p1Y': (10.,  0.001,  100.),
+    'a2Y': (10.,  0.001,  100.),
+    'p2Y': (10.,  0.001,  100.),
+}
+
+# Order of the parameters of a 1D DSCB, as in RooCrystalBall
+SHAPE = ['mu', 'wd', 'a1', 'p1', 'a2', 'p2']
+
+def _tail_integral(u, alpha, n):
+    '''
+    Integral of the tail A*(B+s)^-n from s = alpha, where it joins the gaussian core, to s = u >= alpha.
+    With r = (B+s)/(B+alpha) the tail is exp(-alpha^2/2)*r^-n, which avoids the overflow of A for large n.
+    '''
+    logr = np.log1p((u - alpha)*alpha/n)
+    if abs(n - 1.) < 1e-6:
+        return np.exp(-0.5*alpha**2)*(n/alpha)*logr
+    return np.exp(-0.5*alpha**2)*(n/alpha)*(-np.expm1((1. - n)*logr))/(n - 1.)
+
+def integral(t0, t1, a1, p1, a2, p2):
+    '''
+    Integral of the (unnormalized) DSCB from t0 to t1, where t = (x-mu)/sigma. The gaussian core is
+    integrated with erfc on either side of the peak so that bins far in the tails keep their
+    precision, and the power-law tails are integrated analytically from where they join the core.
+    '''
+    t0, t1 = np.asarray(t0, dtype=float), np.asarray(t1, dtype=float)
+    c0 = np.minimum(np.maximum(t0, -a1), a2)/np.sqrt(2.)
+    c1 = np.minimum(np.maximum(t1, -a1), a2)/np.sqrt(2.)
+    core = np.where(c0 >= 0, erfc(c0) - erfc(c1), np.where(c1 <= 0, erfc(-c1) - erfc(-c0), erf(c1) - erf(c0)))
+    core *= np.sqrt(np.pi/2.)
+    # Left tail, t < -a1: A*(B-t)^-n, i.e. the right tail mirrored
+    left  = _tail_integral(-np.minimum(t0, -a1), a1, p1) - _tail_integral(-np.minimum(t1, -a1), a1, p1)
+    right = _tail_integral(np.maximum(t1, a2), a2, p2) - _tail_integral(np.maximum(t0, a2), a2, p2)
+    return core + left + right
+
+def shape(t, a1, p1, a2, p2):
+    '''The (unnormalized) DSCB at t = (x-mu)/sigma, with the same tails as integral()'''
+    t = np.asarray(t, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        left  = np.exp(-0.5*a1**2)*(1. + (-t - a1)*a1/p1)**-p1
+        right = np.exp(-0.5*a2**2)*(1. + (t - a2)*a2/p2)**-p2
+    return np.where(t < -a1, left, np.where(t > a2, right, np.exp(-0.5*t**2)))
+
+def bin_center_fractions(edges, mu, wd, a1, p1, a2, p2):
+    '''Fraction of the DSCB in each bin as in a RooFit binned fit: the DSCB at the bin center times the bin width, normalized over the bins'''
+    w = shape((0.5*(edges[:-1] + edges[1:]) - mu)/wd, a1, p1, a2, p2)*np.diff(edges)
+    return w/w.sum()
+
+def bin_fractions(edges, mu, wd, a1, p1, a2, p2, lo=None, hi=None):
+    '''Fraction of the DSCB (normalized over [lo, hi], by default the range of `edges`) in each bin'''
+    lo = edges[0] if lo is None else lo
+    hi = edges[-1] if hi is None else hi
+    t = (np.append(edges, [lo, hi]) - mu)/wd
+    # Integrals over all bins and over the normalization range in one go
+    I = integral(np.append(t[:-3], t[-2]), np.append(t[1:-2], t[-1]), a1, p1, a2, p2)
+    return I[:-1]/I[-1]
+
+def nll_1d(values, counts, edges, lo, hi):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = bin_fractions(edges, *values, lo=lo, hi=hi)
+    # Shapes which underflow everywhere in the range get the (large, finite) NLL of the smallest fraction
+    frac[~np.isfinite(frac)] = 0.
+    mask = counts != 0
+    return -np.dot(counts[mask], np.log(np.maximum(frac[mask], 1e-300)))
+
+def hessian(func, x, lo, hi, rel=1e-4):
+    '''Numerical Hessian with central differences, with the steps kept inside the bounds'''
+    n = len(x)
+    h = np.maximum(rel*np.abs(x), 1e-6)
+    h = np.minimum(h, 0.5*np.minimum(x - lo, hi - x).clip(min=1e-9))
+    H = np.zeros((n, n))
+    f0 = func(x)
+    for i in range(n):
+        ei = np.zeros(n); ei[i] = h[i]
+        H[i,i] = (func(x+ei) - 2*f0 + func(x-ei))/h[i]**2
+        for j in range(i+1, n):
+            ej = np.zeros(n); ej[j] = h[j]
+            H[i,j] = H[j,i] = (func(x+ei+ej) - func(x+ei-ej) - func(x-ei+ej) + func(x-ei-ej))/(4*h[i]*h[j])
+    return H
+
+def fit_1d(counts, edges, init, axis):
+    '''Fit the DSCB parameters of one axis ('X' or 'Y') to the projection `counts` with bin edges `edges`'''
+    names = [f'{p}{axis}' for p in SHAPE]
+    lo = np.array([PARAMS[n][1] for n in names])
+    hi = np.array([PARAMS[n][2] for n in names])
+    rng = (xMin, xMax) if axis == 'X' else (yMin, yMax)
+    func = lambda v: nll_1d(v, counts, edges, *rng)
+    # Minimize in the parameters scaled to [0, 1] within their bounds, since they differ by orders of magnitude
+    scaled = lambda u: func(lo + u*(hi - lo))
+    # With the tails starting far outside of the populated bins the NLL does not depend on the tail
+    # parameters at all, so also start once with the tails close to the core and keep the better minimum
+    starts = [np.array([init[n] for n in names])]
+    if min(init[f'a1{axis}'], init[f'a2{axis}']) > 2.:
+        starts.append(starts[0].copy())
+        starts[1][[2, 4]] = 1.5
+    res = None
+    for x0 in starts:
+        u0 = np.clip((x0 - lo)/(hi - lo), 0., 1.)
+        r = minimize(scaled, u0, method='L-BFGS-B', bounds=[(0., 1.)]*len(names))
+        if (res is None) or (r.fun < res.fun):
+            res = r
+    res.x = lo + res.x*(hi - lo)
+    errors = np.full(len(names), np.nan)
+    covQual = 0
+    try:
+        cov = np.linalg.inv(hessian(func, res.x, lo, hi))
+        if np.all(np.diag(cov) > 0):
+            errors = np.sqrt(np.diag(cov))
+            covQual = 3
+    except np.linalg.LinAlgError:
+        pass
+    return dict(zip(names, res.x)), dict(zip(names, errors)), res, covQual
+
+def fit(counts, xedges, yedges, init):
+    '''
+    Fit the 2D DSCB to the histogram contents `counts` (shape (nx, ny)) with bin edges `xedges`,
+    `yedges`, starting from the parameter values `init`. Bins outside of the fit range are ignored.
+    Returns (values, errors, info) where info has the status (0 = converged), covQual and minNll.
+    '''
+    xin = (xedges[:-1] >= xMin) & (xedges[1:] <= xMax)
+    yin = (yedges[:-1] >= yMin) & (yedges[1:] <= yMax)
+    counts = counts[np.ix_(xin, yin)]
+    values, errors, status, covQual, nll = {}, {}, 0, 3, 0.
+    for axis, proj, edges, inrange in [('X', counts.sum(axis=1), xedges, xin), ('Y', counts.sum(axis=0), yedges, yin)]:
+        idx = np.flatnonzero(inrange)
+        v, e, res, cq = fit_1d(proj, edges[idx[0]:idx[-1]+2], init, axis)
+        values.update(v)
+        errors.update(e)
+        status = max(status, 0 if res.success else 1)
+        covQual = min(covQual, cq)
+        nll += res.fun
+    return values, errors, {'status': status, 'covQual': covQual, 'minNll': nll}
+
+def template(values, xedges, yedges, nEvents=1., centers=False):
+    '''
+    Expected 2D histogram contents of the fitted model, normalized to nEvents within the fit range.
+    The DSCB is integrated over each bin, as in the fit of this module, or with `centers` evaluated
+    at the bin centers, as in the RooFit fit, so that parameters from either fit give their own shape.
+    '''
+    if centers:
+        px = bin_center_fractions(xedges, *[values[f'{p}X'] for p in SHAPE])
+        py = bin_center_fractions(yedges, *[values[f'{p}Y'] for p in SHAPE])
+    else:
+        px = bin_fractions(xedges, *[values[f'{p}X'] for p in SHAPE], lo=xMin, hi=xMax)
+        py = bin_fractions(yedges, *[values[f'{p}Y'] for p in SHAPE], lo=yMin, hi=yMax)
+    return nEvents*np.outer(px, py)
+
+def th2_to_numpy(h):
+    '''(contents, xedges, yedges) of a TH2, without under/overflow'''
+    nx, ny = h.GetNbinsX(), h.GetNbinsY()
+    xedges = np.array([h.GetXaxis().GetBinLowEdge(i) for i in range(1, nx+2)])
+    yedges = np.array([h.GetYaxis().GetBinLowEdge(j) for j in range(1, ny+2)])
+    counts = np.array([[h.GetBinContent(i, j) for j in range(1, ny+1)] for i in range(1, nx+1)])
+    return counts, xedges, yedges
+
+def validate(inFile, histNames, mT, mPhi, year):
+    '''Fit the histograms with both RooFit and NumPy, and print the parameter differences in units of the RooFit uncertainties'''
+    import ROOT
+    from FitAllShapes import fit as roofit, default_init
+    f = ROOT.TFile.Open(inFile)
+    x = ROOT.RooRealVar('mPhi','mPhi',xMin,xMax)
+    y = ROOT.RooRealVar('mT','mT',yMin,yMax)
+    ws = ROOT.RooWorkspace('w')
+    worst = 0.
+    for histName in histNames:
+        pf = histName.split('__')[0].replace('MHvsMTH_','')
+        init = default_init(mT, mPhi)
+        row, _ = roofit(f, ws, x, y, year, histName, histName.split('__')[-1], pf, mPhi, mT, init)
+        values, errors, info = fit(*th2_to_numpy(f.Get(histName)), init)
+        print(f'{histName}: RooFit status {row["status"]}, NumPy status {info["status"]}')
+        print(f'    {"param":6}{"RooFit":>14}{"NumPy":>14}{"pull":>10}')
+        for name in PARAMS:
+            pull = (values[name] - row[name])/row[f'{name}_err'] if row[f'{name}_err'] > 0 else np.nan
+            worst = np.nanmax([worst, abs(pull)])
+            print(f'    {name:6}{row[name]:14.4g}{values[name]:14.4g}{pull:10.2f}')
+    print(f'Largest difference: {worst:.2f} sigma')
+    f.Close()
+    return worst
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from xrdcache import fetch, selection_url
+    parser = ArgumentParser()
+    parser.add_argument('-s', type=str, dest='signal',
+                        action='store', required=True,
+                        help='Signal name in form mT-mPhi')
+    parser.add_argument('-y', type=str, dest='year',
+                        action='store', required=True,
+                        help='Run II year')
+    parser.add_argument('--hists', type=str, dest='hists', nargs='+',
+                        action='store', default=[f'MHvsMTH_{r}__nominal' for r in ['SR_fail','SR_pass','ttbarCR_fail','ttbarCR_pass']],
+                        help='Histograms to compare')
+    args = parser.parse_args()
+
+    mT, mPhi = args.signal.split('-')
+    inFile = fetch(selection_url(f'THselection_TprimeB-{args.signal}_{args.year}.root'))
+    validate(inFile, args.hists, mT, mPhi, args.year)
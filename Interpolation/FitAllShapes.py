@@ -1,8 +1,35 @@
 '''
 Script to fit the signal shapes with a double-sided crystal ball function and record the fit function parameters for later linear interpolation.
+
+The fits are run in a process pool, one task per (MT, MP, year). Within a task the nominal
+histogram of each region is fitted first and all systematic variations of that region are seeded
+from the converged nominal parameters. The nominal fits are seeded from the converged nominal fit of
+the neighbouring (lower) MT at the same MP, so the tasks of each (MP, year) run as a chain along MT
+(pass --no-chain to start every nominal fit from the default values instead).
+
+Outputs:
+    params/AllFitShapes_<year>.root   RooWorkspace `w` with the DSCB models and yields, as before
+    params/AllFitShapes_<years>.csv   one row per fit with the parameter values/errors, the fit
+                                      status, covariance quality, EDM, NLL, seed and wall time
+                                      (written as Parquet if --table ends with .parquet)
+
+With --engine numpy the fits are done with the NumPy/SciPy implementation in DSCB.py, and the fitted
+models are written to the same workspace.
+
+Plots of the fit results are optional (--plot nominal/all) and are made after all fits are done.
+
+Example:
+    python FitAllShapes.py -y 16 16APV 17 18 -j 16 --plot nominal
 '''
 import ROOT
 from ROOT import TFile, RooRealVar, RooArgList, RooDataHist, RooHistPdf, RooFit, RooArgSet, RooMomentMorphFuncND, RooBinning, RooWrapperPdf
+import os, sys, time, traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xrdcache import fetch, selection_url
+import DSCB
+from DSCB import PARAMS
 
 ROOT.gROOT.SetBatch(True)
 
@@ -16,6 +43,31 @@ yMin = 800
 yMax = 3500
 nY   = 27
 
+MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
+MPs = [75, 100, 125, 175, 200, 250, 350, 450, 500]
+
+REGIONS = ['SR_fail', 'SR_pass', 'ttbarCR_fail', 'ttbarCR_pass']
+
+def default_init(mT, mPhi):
+    '''Fixed initial values used when no converged fit is available to seed from'''
+    init = {name: val for name, (val, _, _) in PARAMS.items()}
+    init['muX'] = float(mPhi)
+    init['muY'] = float(mT)
+    return init
+
+def seed_from(params, mT, mPhi, mT_ref, mPhi_ref):
+    '''Initial values from the converged fit of another mass point, with the peak positions and widths scaled to the new masses'''
+    init = dict(params)
+    for p in ['muX', 'wdX']:
+        init[p] *= float(mPhi)/float(mPhi_ref)
+    for p in ['muY', 'wdY']:
+        init[p] *= float(mT)/float(mT_ref)
+    # Keep the seed strictly inside the bounds so that MINUIT does not start on a limit
+    for name, (_, lo, hi) in PARAMS.items():
+        eps = 1e-3*(hi - lo)
+        init[name] = min(max(init[name], lo + eps), hi - eps)
+    return init
+
 def create_RDH_PDF(h):
     '''Create a RooDataHist and RooHistPdf from a TH2'''
     xvar = RooRealVar('mPhi','mPhi',xMin,xMax)
@@ -32,7 +84,7 @@ def getBin(binning, val):
         return binning.numBins()
     else:
         return binning.binNumber(val)
-    
+
 def plot(frameX, frameY, RDH, model, mPhi, mT, year, pf, syst):
     RDH.plotOn(frameX, RooFit.LineColor(ROOT.kBlue))
     RDH.plotOn(frameY, RooFit.LineColor(ROOT.kBlue))
@@ -46,67 +98,192 @@ def plot(frameX, frameY, RDH, model, mPhi, mT, year, pf, syst):
     frameY.Draw()
     c.Print(f'plots/{mT}-{mPhi}-{pf}__{syst}_{year}_fitResult.pdf')
 
-def fit(inFile, ws, outFile, x, y, year, histName, syst, pf, mPhi, mT):
-    # Load the file, get histogram, convert to RooHistPdf
-    try:
-        f = TFile.Open(inFile)
-    except:
-        print(f'File {inFile} does not exist, skipping...')
-        return
+def build_model(x, y, tag, init):
+    '''The 2D DSCB model (product of the DSCBs in X and Y) with its parameters set to `init`'''
+    pars = {name: RooRealVar(f'{name}-{tag}', name, init[name], lo, hi) for name, (_, lo, hi) in PARAMS.items()}
+    cbX = ROOT.RooCrystalBall(f"DSCBX-{tag}","DSCBX",x,*[pars[f'{p}X'] for p in ['mu','wd','a1','p1','a2','p2']])
+    cbY = ROOT.RooCrystalBall(f"DSCBY-{tag}","DSCBY",y,*[pars[f'{p}Y'] for p in ['mu','wd','a1','p1','a2','p2']])
+    model = ROOT.RooProdPdf(f"model-{tag}","model", RooArgList(cbX, cbY))
+    return pars, cbX, cbY, model
+
+def fit(f, ws, x, y, year, histName, syst, pf, mPhi, mT, init, engine='roofit'):
+    '''
+    Fit one histogram with the 2D DSCB, starting from `init`, and import the result into `ws`.
+    With engine='numpy' the fit is done with DSCB.py instead of RooFit.
+    Returns the row of the results table and the fitted parameter values.
+    '''
+    start = time.time()
+    tag = f'{mT}-{mPhi}-{pf}__{syst}_{year}'
     h = f.Get(histName)
     nEvents = h.Integral()
-    RDH, RHP = create_RDH_PDF(h)
-    f.Close()
-    # Set up the DSCB objects in X and Y. Unfortunately, these parameters are mostly not known a-priori and hard to estimate initial values for.
-    muX = RooRealVar(f"muX-{mT}-{mPhi}-{pf}__{syst}_{year}","muX",float(mPhi), 60. ,560.)
-    wdX = RooRealVar(f"wdX-{mT}-{mPhi}-{pf}__{syst}_{year}","wdX",20., 0.001 ,100.)
-    a1X = RooRealVar(f"a1X-{mT}-{mPhi}-{pf}__{syst}_{year}","a1X",3. ,0.001 ,100.)
-    p1X = RooRealVar(f"p1X-{mT}-{mPhi}-{pf}__{syst}_{year}","p1X",3. ,0.1 ,100.)
-    a2X = RooRealVar(f"a2X-{mT}-{mPhi}-{pf}__{syst}_{year}","a2X",3. ,0.001 ,100.)
-    p2X = RooRealVar(f"p2X-{mT}-{mPhi}-{pf}__{syst}_{year}","p2X",3. ,0.001 ,100.)
-    muY = RooRealVar(f"muY-{mT}-{mPhi}-{pf}__{syst}_{year}","muY",float(mT), 1. ,4000.)
-    wdY = RooRealVar(f"wdY-{mT}-{mPhi}-{pf}__{syst}_{year}","wdY",140. ,0.001 ,500.)
-    a1Y = RooRealVar(f"a1Y-{mT}-{mPhi}-{pf}__{syst}_{year}","a1Y",10. ,0.001 ,100.)
-    p1Y = RooRealVar(f"p1Y-{mT}-{mPhi}-{pf}__{syst}_{year}","p1Y",10. ,0.001 ,100.)
-    a2Y = RooRealVar(f"a2Y-{mT}-{mPhi}-{pf}__{syst}_{year}","a2Y",10. ,0.001 ,100.)
-    p2Y = RooRealVar(f"p2Y-{mT}-{mPhi}-{pf}__{syst}_{year}","p2Y",10. ,0.001 ,100.)
-    cbX = ROOT.RooCrystalBall(f"DSCBX-{mT}-{mPhi}-{pf}__{syst}_{year}","DSCBX",x,muX,wdX,a1X,p1X,a2X,p2X)
-    cbY = ROOT.RooCrystalBall(f"DSCBY-{mT}-{mPhi}-{pf}__{syst}_{year}","DSCBY",y,muY,wdY,a1Y,p1Y,a2Y,p2Y)
-    # Create the model as a product of the two DSCBs
-    model = ROOT.RooProdPdf(f"model-{mT}-{mPhi}-{pf}__{syst}_{year}","model", RooArgList(cbX, cbY))
-    # Fit the model to the RooDataHist for the given signal
-    fitResult = model.fitTo(RDH,ROOT.RooFit.Save())
-    # Plot the fit result
-    plot(x.frame(), y.frame(), RDH, model, mPhi, mT, year, pf, syst)
-
-    # Save out all the information to a CSV
-    # out = open(f'params/{mT}-{mPhi}-{pf}__{syst}_{year}_fitResult.csv','w')
-    # parNames = ['mT','mPhi']
-    # parVals  = [str(mT),str(mPhi)]
-    # parErrs  = []
-    # pars = fitResult.floatParsFinal()
-    # for i in range(len(pars)):
-    #     par  = pars.at(i)
-    #     name = str(par.getTitle())
-    #     val  = str(par.getVal())
-    #     err  = par.getError()
-    #     parNames.append(name)
-    #     parVals.append(val)
-    # parNames.append('nEvents')
-    # parVals.append(str(nEvents))
-    # out.write(','.join(parNames)+'\n')
-    # out.write(','.join(parVals))
-    n = ROOT.RooConstVar(f'nEvents-{mT}-{mPhi}-{pf}__{syst}_{year}',f'nEvents-{mT}-{mPhi}-{pf}__{syst}_{year}',nEvents)
-    ws.Import(n, ROOT.RooFit.Silence(True))
-
+    if engine == 'numpy':
+        values, errors, info = DSCB.fit(*DSCB.th2_to_numpy(h), init)
+        pars, cbX, cbY, model = build_model(x, y, tag, values)
+        for name, par in pars.items():
+            par.setError(errors[name])
+        info['edm'] = float('nan')
+    else:
+        RDH, RHP = create_RDH_PDF(h)
+        pars, cbX, cbY, model = build_model(x, y, tag, init)
+        # Fit the model to the RooDataHist for the given signal
+        fitResult = model.fitTo(RDH, RooFit.Save(), RooFit.PrintLevel(-1))
+        info = {'status': fitResult.status(), 'covQual': fitResult.covQual(), 'edm': fitResult.edm(), 'minNll': fitResult.minNll()}
 
-    # The RooWorkspace::import function can't be used in PyROOT because import is a reserved python keyword. For this reason, an alternative with a capitalized name is provided: 
+    n = ROOT.RooConstVar(f'nEvents-{tag}',f'nEvents-{tag}',nEvents)
+    ws.Import(n, ROOT.RooFit.Silence(True))
+    # The RooWorkspace::import function can't be used in PyROOT because import is a reserved python keyword. For this reason, an alternative with a capitalized name is provided:
     ws.Import(cbX,   ROOT.RooFit.Silence(True))
     ws.Import(cbY,   ROOT.RooFit.Silence(True))
     ws.Import(model, ROOT.RooFit.Silence(True), ROOT.RooFit.RenameConflictNodes('_copy'))
-    # ws.Import(x, ROOT.RooFit.Silence(True))
-    # ws.Import(y, ROOT.RooFit.Silence(True))
+
+    params = {name: par.getVal() for name, par in pars.items()}
+    row = {'year': year, 'mT': int(mT), 'mPhi': int(mPhi), 'region': pf, 'syst': syst, 'histName': histName, 'nEvents': nEvents}
+    for name, par in pars.items():
+        row[name] = par.getVal()
+        row[f'{name}_err'] = par.getError()
+    row.update(info)
+    row.update({'engine': engine, 'time': time.time() - start})
+    return row, params
+
+def fit_mass_point(mT, mPhi, year, seed=None, engine='roofit', shard_dir='params/shards'):
+    '''
+    Fit all histograms of one (MT, MP, year) and write them to a workspace shard.
+    `seed` is (mT_ref, mPhi_ref, {region: nominal parameters}) of a neighbouring converged mass point.
+    '''
+    eosFile = selection_url(f'THselection_TprimeB-{mT}-{mPhi}_{year}.root')
+    try:
+        inFile = fetch(eosFile)
+    except FileNotFoundError:
+        print(f'File {eosFile} does not exist, skipping...')
+        return None
+    f = TFile.Open(inFile)
+    allHists = [i.GetName() for i in f.GetListOfKeys()]
+
+    # RooRealVars for X and Y
+    x = RooRealVar('mPhi','mPhi',xMin,xMax)
+    y = RooRealVar('mT','mT',yMin,yMax)
+    ws = ROOT.RooWorkspace('w')
+
+    rows, nominal = [], {}
+    for pf_name in REGIONS:
+        region_hists = [i for i in allHists if pf_name in i]
+        # Nominal first, so that the systematic variations can start from its result
+        region_hists.sort(key=lambda h: h.split('__')[-1] != 'nominal')
+        for histName in region_hists:
+            syst = histName.split('__')[-1]
+            if pf_name in nominal:
+                init, source = nominal[pf_name], 'nominal'
+            elif seed and (pf_name in seed[2]):
+                init, source = seed_from(seed[2][pf_name], mT, mPhi, seed[0], seed[1]), f'{seed[0]}-{seed[1]}'
+            else:
+                init, source = default_init(mT, mPhi), 'default'
+            row, params = fit(f, ws, x, y, year, histName, syst, pf_name, mPhi, mT, init, engine)
+            row['seed'] = source
+            rows.append(row)
+            if (syst == 'nominal') and (row['status'] == 0):
+                nominal[pf_name] = params
+    f.Close()
+
+    shard = f'{shard_dir}/{mT}-{mPhi}_{year}.root'
+    outFile = TFile.Open(shard, 'RECREATE')
+    ws.Write()
+    outFile.Close()
+    return {'rows': rows, 'nominal': nominal, 'shard': shard}
+
+def plot_mass_point(mT, mPhi, year, rows):
+    '''Deferred plotting: rebuild the fitted models of one mass point from the results table and plot them'''
+    f = TFile.Open(fetch(selection_url(f'THselection_TprimeB-{mT}-{mPhi}_{year}.root')))
+    x = RooRealVar('mPhi','mPhi',xMin,xMax)
+    y = RooRealVar('mT','mT',yMin,yMax)
+    for row in rows:
+        RDH, RHP = create_RDH_PDF(f.Get(row['histName']))
+        pars, cbX, cbY, model = build_model(x, y, f"{mT}-{mPhi}-{row['region']}__{row['syst']}_{year}", row)
+        plot(x.frame(), y.frame(), RDH, model, mPhi, mT, year, row['region'], row['syst'])
+    f.Close()
+
+def merge_shards(shards, outName):
+    '''Merge the per-mass-point workspaces into a single workspace `w`'''
+    outFile = TFile.Open(outName, 'RECREATE')
+    ws = ROOT.RooWorkspace('w')
+    for shard in shards:
+        f = TFile.Open(shard)
+        w = f.Get('w')
+        for arg in w.allFunctions():
+            if arg.GetName().startswith('nEvents-'):
+                ws.Import(arg, RooFit.Silence(True))
+        for arg in w.allPdfs():
+            if arg.GetName().startswith('model-'):
+                # The model brings its DSCBs and parameters with it, mPhi/mT are shared by all models
+                ws.Import(arg, RooFit.Silence(True), RooFit.RecycleConflictNodes())
+        f.Close()
     outFile.cd()
+    ws.Write()
+    outFile.Close()
+
+def write_table(rows, table):
+    import pandas as pd
+    df = pd.DataFrame(rows).sort_values(['year','mT','mPhi','region','syst'])
+    tmp = f'{table}.tmp'
+    if table.endswith('.parquet'):
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, table)
+    return df
+
+def run(years, mts=MTs, mps=MPs, workers=1, chain=True, plots='none', table=None, engine='roofit'):
+    os.makedirs('params/shards', exist_ok=True)
+    ctx = multiprocessing.get_context('spawn')
+    rows, shards = [], {year: [] for year in years}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {}
+        def submit(year, iMT, MP, seed):
+            fut = pool.submit(fit_mass_point, mts[iMT], MP, year, seed, engine)
+            futures[fut] = (year, iMT, MP, seed)
+        for year in years:
+            for MP in mps:
+                if chain:
+                    submit(year, 0, MP, None)
+                else:
+                    for iMT in range(len(mts)):
+                        submit(year, iMT, MP, None)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                year, iMT, MP, seed = futures.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception:
+                    print(f'ERROR: fits of {mts[iMT]}-{MP} ({year}) failed:\n{traceback.format_exc()}')
+                    result = None
+                if result:
+                    rows.extend(result['rows'])
+                    shards[year].append(result['shard'])
+                    nfail = sum(r['status'] != 0 for r in result['rows'])
+                    print(f"{mts[iMT]}-{MP} ({year}): {len(result['rows'])} fits, {nfail} not converged, {sum(r['time'] for r in result['rows']):.1f} s")
+                    if result['nominal']:
+                        seed = (mts[iMT], MP, result['nominal'])
+                # Seed the next MT of the chain, carrying the last converged seed over missing mass points
+                if chain and (iMT+1 < len(mts)):
+                    submit(year, iMT+1, MP, seed)
+
+        if plots != 'none':
+            os.makedirs('plots', exist_ok=True)
+            groups = {}
+            for row in rows:
+                if (plots == 'all') or (row['syst'] == 'nominal'):
+                    groups.setdefault((row['mT'], row['mPhi'], row['year']), []).append(row)
+            for fut in [pool.submit(plot_mass_point, *key, grp) for key, grp in groups.items()]:
+                fut.result()
+
+    for year in years:
+        merge_shards(sorted(shards[year]), f'params/AllFitShapes_{year}.root')
+    if table is None:
+        table = f'params/AllFitShapes_{"_".join(years)}.csv'
+    if rows:
+        write_table(rows, table)
+        nfail = sum(r['status'] != 0 for r in rows)
+        print(f'{len(rows)} fits written to {table}, {nfail} not converged')
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
@@ -114,51 +291,30 @@ if __name__ == '__main__':
     # parser.add_argument('-s', type=str, dest='signal',
     #                     action='store', required=True,
     #                     help='Signal name in form mT-mPhi')
-    parser.add_argument('-y', type=str, dest='year',
+    parser.add_argument('-y', type=str, dest='year', nargs='+',
                         action='store', required=True,
-                        help='Run II year')
+                        help='Run II year(s)')
+    parser.add_argument('--MTs', type=int, dest='MTs', nargs='+',
+                        action='store', default=MTs,
+                        help='Tprime masses to fit')
+    parser.add_argument('--MPs', type=int, dest='MPs', nargs='+',
+                        action='store', default=MPs,
+                        help='Phi masses to fit')
+    parser.add_argument('-j', type=int, dest='workers',
+                        action='store', default=os.cpu_count(),
+                        help='Number of parallel worker processes')
+    parser.add_argument('--no-chain', dest='chain',
+                        action='store_false',
+                        help='Do not seed the nominal fits from the neighbouring MT, run all mass points independently')
+    parser.add_argument('--engine', type=str, dest='engine',
+                        action='store', default='roofit', choices=['roofit','numpy'],
+                        help='Fit with RooFit or with the NumPy implementation in DSCB.py')
+    parser.add_argument('--plot', type=str, dest='plot',
+                        action='store', default='none', choices=['none','nominal','all'],
+                        help='Which fit results to plot after all fits are done')
+    parser.add_argument('--table', type=str, dest='table',
+                        action='store', default=None,
+                        help='Output table of fit results (.csv or .parquet). Default: params/AllFitShapes_<years>.csv')
     args = parser.parse_args()
 
-
-    MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
-    MPs = [75, 100, 125, 175, 200, 250, 350, 450, 500]
-
-    # RooRealVars for X and Y
-    x = RooRealVar('mPhi','mPhi',xMin,xMax)
-    y = RooRealVar('mT','mT',yMin,yMax)
-
-
-    for year in [args.year]:
-        outFile = ROOT.TFile.Open(f'params/AllFitShapes_{year}.root','RECREATE')
-        ws = ROOT.RooWorkspace('w')
-        outFile.cd()
-        for MT in MTs:
-            for MP in MPs:
-                signal = f'{MT}-{MP}'
-                #eosFile = f'root://cmsxrootd.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{signal}_{year}.root'
-                eosFile = f'root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{signal}_{year}.root'
-                inFile = eosFile
-
-                try:
-                    testFile = TFile.Open(inFile)
-                except:
-                    print(f'File {inFile} does not exist, skipping...')
-                    continue
-
-                allHists = [i.GetName() for i in testFile.GetListOfKeys()]
-                for region in ['SR','ttbarCR']:
-                        for pf in ['fail','pass']:
-                            pf_name = f'{region}_{pf}'
-
-                            #histName = f'MHvsMTH_{pf_name}__nominal'
-                            #fit(inFile, ws, outFile, x, y, year, histName, pf_name, MP, MT)
-                            
-
-                            region_hists = [i for i in allHists if pf_name in i]
-                            for histName in region_hists:
-                                #histName = f'MHvsMTH_{pf_name}__nominal'
-                                syst = histName.split('__')[-1]
-                                fit(inFile, ws, outFile, x, y, year, histName, syst, pf_name, MP, MT)
-                            
-        ws.Write()
-        outFile.Close()
+    run(args.year, sorted(args.MTs), args.MPs, workers=args.workers, chain=args.chain, plots=args.plot, table=args.table, engine=args.engine)
@@ -3,6 +3,9 @@ Script to fit the signal shapes with a double-sided crystal ball function and re
 '''
 import ROOT
 from ROOT import TFile, RooRealVar, RooArgList, RooDataHist, RooHistPdf, RooFit, RooArgSet, RooMomentMorphFuncND, RooBinning, RooWrapperPdf
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xrdcache import fetch, selection_url
 
 # X = mPhi
 xMin = 60
@@ -116,9 +119,9 @@ if __name__ == '__main__':
                         help='Run II year')
     args = parser.parse_args()
 
-    eosFile = f'root://cmsxrootd.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{args.signal}_{args.year}.root'
+    eosFile = selection_url(f'THselection_TprimeB-{args.signal}_{args.year}.root')
 
-    inFile = eosFile
+    inFile = fetch(eosFile)
     histName = 'MHvsMTH_SR_pass__nominal'
     mT   = args.signal.split('-')[0]
     mPhi = args.signal.split('-')[-1]
@@ -1,7 +1,20 @@
 '''
 Class to handle interpolation between two existing signal mass points.
+
+By default both neighbouring signals are fitted for every histogram and the shapes are morphed with
+RooIntegralMorph. If a table of DSCB fit parameters from FitAllShapes.py is given (`params`), the
+parameters are instead interpolated in mPhi at fixed mT (linearly or with a cubic spline through all
+existing mPhi) and the 2D template is evaluated directly on the 50x27 grid, without any fit. The
+parameters are interpolated for all MPs_generated of an mT at once (see interpolated_params).
 '''
 import ROOT
+import os, sys, json, hashlib
+from contextlib import contextmanager
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xrdcache import open_root, selection_url, file_id
+from PyHist import array2hist, hist2array, hist2sumw2
+import DSCB
 
 
 MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
@@ -18,8 +31,105 @@ yMin = 800
 yMax = 3500
 nY   = 27
 
+# Parameters of the DSCB fits: (initial value, min, max). The initial values of muX and muY are the masses of the fitted signal.
+FIT_PARAMS = {
+    'muX': (None, 60.,    560.),
+    'wdX': (20.,  0.001,  100.),
+    'a1X': (5.,   0.001,  100.),
+    'p1X': (15.,  2.,     100.),
+    'a2X': (5.,   0.001,  100.),
+    'p2X': (5.,   0.001,  100.),
+    'muY': (None, 0.001,  4000.),
+    'wdY': (140., 0.001,  500.),
+    'a1Y': (10.,  0.001,  100.),
+    'p1Y': (10.,  0.001,  100.),
+    'a2Y': (10.,  0.001,  100.),
+    'p2Y': (10.,  0.001,  100.),
+}
+# Bump when the fit itself changes, to invalidate the fit cache
+FIT_VERSION = 1
+# Only fits with this status and at least this covariance quality are kept in the fit cache
+FIT_OK_STATUS  = 0
+FIT_OK_COVQUAL = 2
+# Directory of the persistent fit cache, shared by all Interpolator instances
+FIT_CACHE_DIR = os.environ.get('TPRIME_FIT_CACHE', 'fitcache')
+
+_tables = {}
+_interpolated = {}
+
+def rss_mb():
+    '''Current resident set size of this process in MB'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024**2
+    except OSError:
+        # No /proc (e.g. macOS): fall back to the peak RSS
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024**2
+
+def load_params(table):
+    '''Load (once per process) the table of fit parameters written by FitAllShapes.py'''
+    if table not in _tables:
+        import pandas as pd
+        if table.endswith('.parquet'):
+            df = pd.read_parquet(table)
+        else:
+            df = pd.read_csv(table, dtype={'year': str})
+        # Only converged fits are used for the interpolation
+        _tables[table] = df[df['status'] == 0]
+    return _tables[table]
+
+def _fits(table, year, region, syst, mT):
+    df = load_params(table)
+    df = df[(df['year'] == year) & (df['region'] == region) & (df['syst'] == syst) & (df['mT'] == int(mT))]
+    return df.sort_values('mPhi').drop_duplicates('mPhi')
+
+def interpolate_params(table, year, region, syst, mT, mPhis, method='linear'):
+    '''
+    DSCB parameters at each of `mPhis` (for a given mT), interpolated from the fits of the existing
+    signals. Returns an array of shape (len(mPhis), len(DSCB.PARAMS)), or None if fewer than two
+    converged fits are available.
+    '''
+    df = _fits(table, year, region, syst, mT)
+    if len(df) < 2:
+        return None
+    mp = df['mPhi'].to_numpy(dtype=float)
+    vals = df[list(DSCB.PARAMS)].to_numpy(dtype=float)
+    mPhis = np.asarray(mPhis, dtype=float)
+    if (method == 'spline') and (len(df) >= 4):
+        from scipy.interpolate import make_interp_spline
+        out = make_interp_spline(mp, vals, k=3, axis=0)(mPhis)
+    else:
+        out = np.stack([np.interp(mPhis, mp, vals[:,i]) for i in range(vals.shape[1])], axis=1)
+    # Keep the parameters within the bounds of the fit
+    lo = np.array([b[1] for b in DSCB.PARAMS.values()])
+    hi = np.array([b[2] for b in DSCB.PARAMS.values()])
+    return np.clip(out, lo, hi)
+
+def interpolated_params(table, year, region, syst, mT, mPhi, method='linear'):
+    '''
+    ({parameter: value} at mPhi, fit engine of the table), or None if fewer than two converged fits
+    are available. The parameters are interpolated for all MPs_generated of this mT in one go and kept
+    (once per process), so that the other mass points of the same mT are a lookup. The engine tells
+    how the template has to be evaluated: at the bin centers for RooFit, integrated over the bins for
+    the NumPy fit (see DSCB.template).
+    '''
+    key = (table, year, region, syst, int(mT), method)
+    if key not in _interpolated:
+        df = _fits(table, year, region, syst, mT)
+        engine = df['engine'].mode()[0] if ('engine' in df.columns) and len(df) else 'roofit'
+        _interpolated[key] = (engine, {})
+    engine, points = _interpolated[key]
+    if mPhi not in points:
+        mPhis = sorted(set(MPs_generated) - set(points) | {mPhi})
+        pars = interpolate_params(table, year, region, syst, mT, mPhis, method)
+        if pars is None:
+            return None
+        points.update({m: dict(zip(DSCB.PARAMS, p)) for m, p in zip(mPhis, pars)})
+    return points[mPhi], engine
+
 class Interpolator:
-    def __init__(self, mT, mPhi, year):
+    def __init__(self, mT, mPhi, year, params=None, method='linear', fitCache=FIT_CACHE_DIR, memLog=False):
         self.m1, self.m2 = self._get_interp_pairs(mPhi)
         self.mT = mT
         self.mPhi = mPhi
@@ -28,10 +138,35 @@ class Interpolator:
         self.x = ROOT.RooRealVar('mPhi','mPhi',xMin,xMax)
         self.y = ROOT.RooRealVar('mT','mT',yMin,yMax)
         self.year = year
-        self.histos = self._get_histos()
         self.f1, self.f2 = self._get_file_pairs()
-        # memory management
+        self.histos = self._get_histos()
+        # table of DSCB fit parameters for the parameter interpolation mode
+        self.params = params
+        self.method = method
+        # persistent cache of the fits of the existing signals (None to always refit)
+        self.fitCache = fitCache
+        self.fitStats = {'fitted': 0, 'cached': 0}
+        # memory management: RooFit objects of the histo being interpolated, see _scope()
+        self.allVars = []
+        # log the RSS after every histo
+        self.memLog = memLog
+        self.memTrace = []
+
+    @contextmanager
+    def _scope(self):
+        '''
+        Scope owning all RooFit objects created for one histo (collected in self.allVars). They are deleted
+        when leaving the scope, dependents first, so that memory does not grow with the number of histos.
+        '''
         self.allVars = []
+        try:
+            yield self.allVars
+        finally:
+            # Objects were appended after their servers, so deleting from the back never leaves a dangling client
+            while self.allVars:
+                obj = self.allVars.pop()
+                ROOT.SetOwnership(obj, True)
+                del obj
 
     def _get_interp_pairs(self, mPhi):
         '''Determines the two existing signals between which to interpolate'''
@@ -52,29 +187,24 @@ class Interpolator:
             h = f.Get(hist)
             y = h.Integral()
             yields.append(y)
+            # Do not keep the histogram attached to the input file
+            h.SetDirectory(0)
+            ROOT.SetOwnership(h, True)
+            del h
         return yields
     
     def _get_file_pairs(self):
         files = []
         for m in [self.m1, self.m2]:
             sig = f'{self.mT}-{m}'
-            eosFile = f'root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{sig}_{self.year}.root'
-            try:
-                f = ROOT.TFile.Open(eosFile)
-            except:
-                raise FileNotFoundError(f'ERROR: file {eosFile} not found...')
+            # Files are read through the local cache, so each one is only fetched from EOS once
+            f = open_root(selection_url(f'THselection_TprimeB-{sig}_{self.year}.root'))
             files.append(f)
         return files          
 
     def _get_histos(self):
-        '''Gets all histograms for a given year'''
-        sig = f'{self.mT}-{self.m1}'
-        eosFile = f'root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{sig}_{self.year}.root'
-        try:
-            f = ROOT.TFile.Open(eosFile)
-        except:
-            raise FileNotFoundError(f'ERROR: file {eosFile} not found...')
-        allHists = [i.GetName() for i in f.GetListOfKeys() if ('cutflow' not in i.GetName() and '_CR_' not in i.GetName())]
+        '''Gets all histograms for a given year, from the already opened m1 file'''
+        allHists = [i.GetName() for i in self.f1.GetListOfKeys() if ('cutflow' not in i.GetName() and '_CR_' not in i.GetName())]
         return allHists
     
     def _create_RDH_PDF(self, h):
@@ -97,68 +227,224 @@ class Interpolator:
     def _linearInterpolate(self, x, x1, y1, x2, y2):
         return y1 + ( (x - x1) * (y2 - y1) ) / (x2 - x1)
 
-    def FitShape(self, f, histName):
-        '''Fit a given histogram with a 2D DSCB function. Return the PDFs along x and y'''
+    def _fit_key(self, f, histName, mPhi):
+        '''Key of a fit in the fit cache: identity of the input file (see xrdcache.file_id), histogram and fit configuration'''
+        config = json.dumps({'file': file_id(f.GetName()), 'version': FIT_VERSION, 'params': FIT_PARAMS, 'mT': self.mT, 'mPhi': mPhi}, sort_keys=True)
+        return hashlib.sha256(f'{histName}\0{config}'.encode()).hexdigest()
+
+    def FitShape(self, f, histName, mPhi):
+        '''
+        Fit a given histogram of the existing signal with mass `mPhi` with a 2D DSCB function. Return the PDFs along x and y.
+        The fitted parameters are kept in the fit cache, so that the fits of an existing signal are shared by all the
+        mass points interpolated from it. Only converged fits are cached, a failed one is redone on the next call.
+        '''
+        cached = None
+        if self.fitCache:
+            cacheFile = os.path.join(self.fitCache, self._fit_key(f, histName, mPhi) + '.json')
+            if os.path.exists(cacheFile):
+                with open(cacheFile) as fc:
+                    cached = json.load(fc)
+                if not _fit_ok(cached):
+                    cached = None
+        # Set up the DSCB objects in X and Y. Unfortunately, these parameters are mostly not known a-priori and hard to estimate initial values for.
+        # The initial value of muX is the mass of the existing signal being fitted.
+        init = {name: (float(mPhi) if name == 'muX' else float(self.mT) if name == 'muY' else val) for name, (val, lo, hi) in FIT_PARAMS.items()}
+        if cached:
+            init = cached['values']
+        pars = {name: ROOT.RooRealVar(f"{name}-{self.mT}-{self.mPhi}", name, init[name], lo, hi) for name, (val, lo, hi) in FIT_PARAMS.items()}
+        cbX = ROOT.RooCrystalBall(f"DSCBX-{self.mT}-{self.mPhi}","DSCBX",self.x,*[pars[f'{p}X'] for p in ['mu','wd','a1','p1','a2','p2']])
+        cbY = ROOT.RooCrystalBall(f"DSCBY-{self.mT}-{self.mPhi}","DSCBY",self.y,*[pars[f'{p}Y'] for p in ['mu','wd','a1','p1','a2','p2']])
+        if cached:
+            self.fitStats['cached'] += 1
+            for name, par in pars.items():
+                par.setError(cached['errors'][name])
+            for v in list(pars.values()) + [cbX, cbY]:
+                self.allVars.append(v)
+            return cbX, cbY
         h = f.Get(histName)
+        h.SetDirectory(0)
         RDH, RHP = self._create_RDH_PDF(h)
+        self.allVars.extend([h, RDH, RHP])
         print('fitting shape...')
-        # Set up the DSCB objects in X and Y. Unfortunately, these parameters are mostly not known a-priori and hard to estimate initial values for.
-        muX = ROOT.RooRealVar(f"muX-{self.mT}-{self.mPhi}","muX",float(self.mPhi), 60. ,560.)
-        wdX = ROOT.RooRealVar(f"wdX-{self.mT}-{self.mPhi}","wdX",20., 0.001 ,100.)
-        a1X = ROOT.RooRealVar(f"a1X-{self.mT}-{self.mPhi}","a1X",5., 0.001, 100.)
-        p1X = ROOT.RooRealVar(f"p1X-{self.mT}-{self.mPhi}","p1X",15., 2., 100.)
-        a2X = ROOT.RooRealVar(f"a2X-{self.mT}-{self.mPhi}","a2X",5., 0.001, 100.)
-        p2X = ROOT.RooRealVar(f"p2X-{self.mT}-{self.mPhi}","p2X",5., 0.001, 100.)
-        muY = ROOT.RooRealVar(f"muY-{self.mT}-{self.mPhi}","muY",float(self.mT), 0.001 ,4000.)
-        wdY = ROOT.RooRealVar(f"wdY-{self.mT}-{self.mPhi}","wdY",140., 0.001, 500.)
-        a1Y = ROOT.RooRealVar(f"a1Y-{self.mT}-{self.mPhi}","a1Y",10., 0.001 ,100.)
-        p1Y = ROOT.RooRealVar(f"p1Y-{self.mT}-{self.mPhi}","p1Y",10., 0.001 ,100.)
-        a2Y = ROOT.RooRealVar(f"a2Y-{self.mT}-{self.mPhi}","a2Y",10., 0.001 ,100.)
-        p2Y = ROOT.RooRealVar(f"p2Y-{self.mT}-{self.mPhi}","p2Y",10., 0.001 ,100.)
-        cbX = ROOT.RooCrystalBall(f"DSCBX-{self.mT}-{self.mPhi}","DSCBX",self.x,muX,wdX,a1X,p1X,a2X,p2X)
-        cbY = ROOT.RooCrystalBall(f"DSCBY-{self.mT}-{self.mPhi}","DSCBY",self.y,muY,wdY,a1Y,p1Y,a2Y,p2Y)
         # Create the model as a product of the two DSCBs
         model = ROOT.RooProdPdf(f"model","model", ROOT.RooArgList(cbX, cbY))
         # Fit the model to the RooDataHist for the given signal
         fitResult = model.fitTo(RDH,ROOT.RooFit.Save())
-        for v in [muX, wdX, a1X, p1X, a2X, p2X, muY, wdY, a1Y, p1Y, a2Y, p2Y, cbX, cbY, model, fitResult]:
+        self.fitStats['fitted'] += 1
+        if not _fit_ok({'status': fitResult.status(), 'covQual': fitResult.covQual()}):
+            print(f'WARNING: fit of {histName} for mPhi={mPhi} failed (status {fitResult.status()}, covQual {fitResult.covQual()}), not cached')
+        elif self.fitCache:
+            os.makedirs(self.fitCache, exist_ok=True)
+            tmp = f'{cacheFile}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as fc:
+                json.dump({
+                    'file': f.GetName(), 'histName': histName, 'mT': self.mT, 'mPhi': mPhi,
+                    'status': fitResult.status(), 'covQual': fitResult.covQual(), 'minNll': fitResult.minNll(),
+                    'values': {name: par.getVal() for name, par in pars.items()},
+                    'errors': {name: par.getError() for name, par in pars.items()},
+                }, fc)
+            os.replace(tmp, cacheFile)
+        for v in list(pars.values()) + [cbX, cbY, model, fitResult]:
             self.allVars.append(v)
         return cbX, cbY
     
     def Interpolate(self, histName):
         '''Interpolate between the two signal shapes for a given histo'''
         print('interpolating')
-        # Get the PDFs for the existing signals
-        pdf1x, pdf1y = self.FitShape(self.f1, histName)
-        pdf2x, pdf2y = self.FitShape(self.f2, histName)
-        print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
-        # Get the alpha parameter to morph the pdf
-        alpha = 1.-(float(self.mPhi) - float(self.m1)/float(self.m2) - float(self.m1))
-        rmass = ROOT.RooRealVar(f'rmass-{self.mT}-{self.mPhi}', "rmass", alpha, 0., 1.)
-        # Perform the morph
-        print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
-        pdf_mx = ROOT.RooIntegralMorph(f'morph_{self.mT}-{self.mPhi}-{histName}_X', f'morph_{self.mT}-{self.mPhi}-{histName}_X', pdf1x, pdf2x, self.x, rmass)
-        print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
-        pdf_my = ROOT.RooIntegralMorph(f'morph_{self.mT}-{self.mPhi}-{histName}_Y', f'morph_{self.mT}-{self.mPhi}-{histName}_Y', pdf1y, pdf2y, self.y, rmass)
-        print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
-        # Create the product of the two PDFs to get the 2D shape 
-        pdf_out = ROOT.RooProdPdf(f"{self.mT}-{self.mPhi}-{histName}",f"{self.mT}-{self.mPhi}-{histName} INTERPOLATED", ROOT.RooArgList(pdf_mx, pdf_my))
-
-        hist = pdf_out.createHistogram(histName, self.x, ROOT.RooFit.Binning(50,60.,560.), ROOT.RooFit.YVar(self.y,ROOT.RooFit.Binning(27,800.,3500.)))
+        # Everything but the output histogram is deleted at the end of the scope
+        with self._scope() as owned:
+            # Get the PDFs for the existing signals
+            pdf1x, pdf1y = self.FitShape(self.f1, histName, self.m1)
+            pdf2x, pdf2y = self.FitShape(self.f2, histName, self.m2)
+            print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
+            # Get the alpha parameter to morph the pdf
+            alpha = 1.-(float(self.mPhi) - float(self.m1)/float(self.m2) - float(self.m1))
+            rmass = ROOT.RooRealVar(f'rmass-{self.mT}-{self.mPhi}', "rmass", alpha, 0., 1.)
+            # Perform the morph
+            print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
+            pdf_mx = ROOT.RooIntegralMorph(f'morph_{self.mT}-{self.mPhi}-{histName}_X', f'morph_{self.mT}-{self.mPhi}-{histName}_X', pdf1x, pdf2x, self.x, rmass)
+            print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
+            pdf_my = ROOT.RooIntegralMorph(f'morph_{self.mT}-{self.mPhi}-{histName}_Y', f'morph_{self.mT}-{self.mPhi}-{histName}_Y', pdf1y, pdf2y, self.y, rmass)
+            print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
+            # Create the product of the two PDFs to get the 2D shape 
+            pdf_out = ROOT.RooProdPdf(f"{self.mT}-{self.mPhi}-{histName}",f"{self.mT}-{self.mPhi}-{histName} INTERPOLATED", ROOT.RooArgList(pdf_mx, pdf_my))
+            owned.extend([rmass, pdf_mx, pdf_my, pdf_out])
+            del pdf1x, pdf1y, pdf2x, pdf2y, rmass, pdf_mx, pdf_my
+
+            hist = pdf_out.createHistogram(histName, self.x, ROOT.RooFit.Binning(50,60.,560.), ROOT.RooFit.YVar(self.y,ROOT.RooFit.Binning(27,800.,3500.)))
+            del pdf_out
         # Now get the yields for m1 and m2 for this region so we can interpolate between
         n1, n2 = self._get_yield_pairs(histName)
         m_n = self._linearInterpolate(float(self.mPhi), float(self.m1), n1, float(self.m2), n2)
         hist.Scale(m_n)
         return hist
 
-    def InterpolateAllHists(self):
-        fOut = ROOT.TFile.Open(f'rootfiles/THselection_TprimeB-{self.mT}-{self.mPhi}_{self.year}.root', 'RECREATE')
+    def InterpolateParams(self, histName):
+        '''
+        Interpolate the DSCB parameters from the table of fits for a given histo and evaluate the 2D
+        template on the 50x27 grid. Returns None if the table has no fits for this histo.
+        '''
+        region, syst = histName.replace('MHvsMTH_','').split('__')
+        pars = interpolated_params(self.params, self.year, region, syst, self.mT, self.mPhi, self.method)
+        if pars is None:
+            return None
+        values, engine = pars
+        # The yields are interpolated in the same way as for the morphing
+        n1, n2 = self._get_yield_pairs(histName)
+        m_n = self._linearInterpolate(float(self.mPhi), float(self.m1), n1, float(self.m2), n2)
+        xedges = np.linspace(xMin, xMax, nX+1)
+        yedges = np.linspace(yMin, yMax, nY+1)
+        # Same convention as the fit the parameters come from, bin centers for RooFit
+        content = DSCB.template(values, xedges, yedges, m_n, centers=(engine != 'numpy'))
+        # TH2F, as the histograms made by the morphing
+        hist = ROOT.TH2F(histName, histName, nX, xMin, xMax, nY, yMin, yMax)
+        array2hist(content.T, hist)
+        hist.SetEntries(nX*nY)
+        return hist
+
+    def InterpolateHist(self, histName):
+        '''Interpolated histogram for a given histo, from the parameter table if given, otherwise by morphing'''
+        hOut = self.InterpolateParams(histName) if self.params else None
+        if hOut is None:
+            if self.params:
+                print(f'WARNING: no fitted parameters for {histName} at mT={self.mT}, falling back to the morphing')
+            hOut = self.Interpolate(histName)
+        hOut.SetName(hOut.GetName().replace('__mPhi_mT',''))
+        # The caller owns the output histogram
+        ROOT.SetOwnership(hOut, True)
+        if self.memLog:
+            rss = rss_mb()
+            self.memTrace.append(rss)
+            print(f'[mem] {histName}: RSS {rss:.1f} MB')
+        return hOut
+
+    def _print_mem(self):
+        if self.memTrace:
+            print(f'[mem] RSS over {len(self.memTrace)} histos: first {self.memTrace[0]:.1f} MB, last {self.memTrace[-1]:.1f} MB, max {max(self.memTrace):.1f} MB')
+
+    def InterpolateAllHists(self, workers=1):
+        '''
+        Interpolate all histos and write them to rootfiles/. With workers > 1 the histos are distributed over
+        that many processes (each with its own ROOT state), which return the binned results to be written here.
+        '''
+        outName = f'rootfiles/THselection_TprimeB-{self.mT}-{self.mPhi}_{self.year}.root'
+        if workers > 1:
+            self._interpolate_parallel(outName, workers)
+            return
+        fOut = ROOT.TFile.Open(outName, 'RECREATE')
         fOut.cd()
         with ROOT.TDirectory.TContext(fOut):
             for histName in self._get_histos():
-                hOut = self.Interpolate(histName)
+                hOut = self.InterpolateHist(histName)
                 hOut.SetDirectory(fOut)
                 fOut.cd()
-                hOut.SetName(hOut.GetName().replace('__mPhi_mT',''))
                 hOut.Write()
-        fOut.Close()
\ No newline at end of file
+                # Written out, no need to keep it in memory until the file is closed
+                hOut.SetDirectory(0)
+                del hOut
+        fOut.Close()
+        print(f"{self.fitStats['fitted']} shapes fitted, {self.fitStats['cached']} taken from the fit cache")
+        self._print_mem()
+
+    def _interpolate_parallel(self, outName, workers):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        histos = self._get_histos()
+        # One chunk of histos per worker, so that each worker opens the input files only once
+        chunks = [histos[i::workers] for i in range(workers) if histos[i::workers]]
+        opts = {'params': self.params, 'method': self.method, 'fitCache': self.fitCache, 'memLog': self.memLog}
+        results = {}
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(chunks), mp_context=ctx) as pool:
+            futures = [pool.submit(_interpolate_hists, self.mT, self.mPhi, self.year, chunk, opts) for chunk in chunks]
+            for fut in futures:
+                hists, stats = fut.result()
+                results.update(hists)
+                for k in stats:
+                    self.fitStats[k] += stats[k]
+        # Single writer, with the histos in the same order as in the input file
+        tmpName = f'{outName}.tmp.root'
+        fOut = ROOT.TFile.Open(tmpName, 'RECREATE')
+        with ROOT.TDirectory.TContext(fOut):
+            for histName in histos:
+                hOut = _arrays_to_hist(*results[histName])
+                hOut.SetDirectory(fOut)
+                hOut.Write()
+                hOut.SetDirectory(0)
+                del hOut
+        fOut.Close()
+        os.replace(tmpName, outName)
+        print(f"{self.fitStats['fitted']} shapes fitted, {self.fitStats['cached']} taken from the fit cache")
+
+def _fit_ok(entry):
+    return (entry.get('status') == FIT_OK_STATUS) and (entry.get('covQual', -1) >= FIT_OK_COVQUAL)
+
+def _hist_to_arrays(h):
+    '''
+    Binned content of a TH2 (including under/overflow) as NumPy arrays, to send it between processes.
+    The sums of weights squared are only sent if the histogram has Sumw2, so that the copy is identical to the original.
+    '''
+    content = hist2array(h, include_overflow=True)
+    sumw2 = hist2sumw2(h, include_overflow=True)
+    xaxis, yaxis = h.GetXaxis(), h.GetYaxis()
+    binning = (h.GetNbinsX(), xaxis.GetXmin(), xaxis.GetXmax(), h.GetNbinsY(), yaxis.GetXmin(), yaxis.GetXmax())
+    return h.GetName(), h.GetTitle(), h.ClassName(), binning, content, sumw2, h.GetEntries()
+
+def _arrays_to_hist(name, title, className, binning, content, sumw2, entries):
+    h = getattr(ROOT, className)(name, title, *binning)
+    array2hist(content, h, sumw2=sumw2, include_overflow=True)
+    h.SetEntries(entries)
+    return h
+
+def _interpolate_hists(mT, mPhi, year, histNames, opts):
+    '''Worker for InterpolateAllHists: interpolate the given histos and return them as arrays'''
+    ROOT.gROOT.SetBatch(True)
+    interp = Interpolator(mT, mPhi, year, **opts)
+    out = {}
+    for histName in histNames:
+        hOut = interp.InterpolateHist(histName)
+        hOut.SetDirectory(0)
+        out[histName] = _hist_to_arrays(hOut)
+        del hOut
+    interp._print_mem()
+    return out, interp.fitStats
@@ -9,6 +9,9 @@ import mplhep as hep
 import matplotlib.ticker as mticker
 import numpy as np
 import uproot
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xrdcache import fetch, selection_url
 
 MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
 MPs_existing  = [75, 100, 125, 175, 200, 250, 350, 450, 500]
@@ -22,7 +25,7 @@ for MT in MTs:
         year = 18
         print(f'Generating 3x3 plot for {MT}-{MP}, 20{year}')
         try:
-            f = uproot.open(f'root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{MT}-{MP}_{year}.root')
+            f = uproot.open(fetch(selection_url(f'THselection_TprimeB-{MT}-{MP}_{year}.root')))
         except:
             print(f'File for {MT}-{MP}, 20{year} not found..')
         hist = f['MHvsMTH_SR_pass__nominal']
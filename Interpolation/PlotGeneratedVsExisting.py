@@ -5,11 +5,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 import mplhep as hep
 import ROOT as r
-from PyHist import PyHist
 import copy
 import matplotlib
 import ROOT
 from matplotlib.lines import Line2D
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PyHist import PyHist
+from xrdcache import fetch, selection_url
 
 
 MTs = [800,  900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000]
@@ -56,7 +59,7 @@ def plot(mT, proj):
 
         for year in ['16','16APV','17','18']:
             if existing:
-                fName = f'root://cmsxrootd.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_TprimeB-{mT}-{mP}_{year}.root'
+                fName = fetch(selection_url(f'THselection_TprimeB-{mT}-{mP}_{year}.root'))
                 hName = 'MHvsMTH_SR_pass__nominal'
             else:
                 fName = f'backup_10June2025_working_but_not_good/rootfiles/THselection_TprimeB-{mT}-{mP}_{year}_INTERPOLATED.root'
@@ -14,7 +14,7 @@ for mt in mts:
         if os.path.exists(f'rootfiles/THselection_TprimeB-{mt}-{mp}_16APV.root'): continue
         i = Interpolator(mt, mp, '16APV')
         #h = i.Interpolate(i.histos[0])
-        i.InterpolateAllHists()
+        i.InterpolateAllHists(workers=args.workers)
 '''
 if __name__ == "__main__":
     from argparse import ArgumentParser
@@ -25,10 +25,25 @@ if __name__ == "__main__":
     parser.add_argument('-s', type=str, dest='sigmass',
                         action='store', default='1800-125',
                         help='mass of Tprime and Phi cand')
+    parser.add_argument('--params', type=str, dest='params',
+                        action='store', default=None,
+                        help='Table of DSCB fit parameters from FitAllShapes.py. If given, interpolate the parameters instead of morphing the fitted shapes')
+    parser.add_argument('--method', type=str, dest='method',
+                        action='store', default='linear', choices=['linear','spline'],
+                        help='Interpolation of the parameters in mPhi (with --params)')
+    parser.add_argument('--no-fit-cache', dest='fitCache',
+                        action='store_const', const=None, default=FIT_CACHE_DIR,
+                        help='Always refit the existing signals instead of using the fit cache')
+    parser.add_argument('-j', type=int, dest='workers',
+                        action='store', default=1,
+                        help='Number of processes to interpolate the histograms with')
+    parser.add_argument('--mem', dest='memLog',
+                        action='store_true',
+                        help='Log the RSS of the process after every histogram')
     args = parser.parse_args()
 
     mt = int(args.sigmass.split('-')[0])
     mp = int(args.sigmass.split('-')[-1])
 
-    i = Interpolator(mt, mp, args.year)
-    i.InterpolateAllHists()
\ No newline at end of file
+    i = Interpolator(mt, mp, args.year, params=args.params, method=args.method, fitCache=args.fitCache, memLog=args.memLog)
+    i.InterpolateAllHists(workers=args.workers)
\ No newline at end of file
@@ -0,0 +1,176 @@
+'''
+NumPy views of ROOT histograms, shared by all plotting scripts.
+
+The bin contents and sums of weights squared are read directly from the histogram's memory
+(TH1::GetArray() and TH1::GetSumw2()), instead of with one GetBinContent()/GetBinError() call per bin.
+ROOT is only imported when converting a histogram, so PyHist objects (which only hold NumPy arrays)
+can be pickled and used without ROOT.
+
+Usage (from a script in a subdirectory):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from PyHist import PyHist, hist2array
+'''
+import numpy as np
+
+# Base array class of the histogram -> dtype of its bin contents (e.g. TH1F is a TArrayF)
+_DTYPES = [('TArrayD', np.float64), ('TArrayF', np.float32), ('TArrayI', np.int32), ('TArrayS', np.int16), ('TArrayC', np.int8)]
+
+def _shape(hist):
+    '''Shape of the bin array including under/overflow, in ROOT's global bin order'''
+    import ROOT
+    if isinstance(hist, ROOT.TH3):
+        return (hist.GetNbinsZ() + 2, hist.GetNbinsY() + 2, hist.GetNbinsX() + 2)
+    elif isinstance(hist, ROOT.TH2):
+        return (hist.GetNbinsY() + 2, hist.GetNbinsX() + 2)
+    elif isinstance(hist, ROOT.TH1):
+        return (hist.GetNbinsX() + 2,)
+    raise TypeError(f'hist must be an instance of ROOT.TH1, ROOT.TH2, or ROOT.TH3')
+
+def _dtype(hist):
+    import ROOT
+    for base, dtype in _DTYPES:
+        if isinstance(hist, getattr(ROOT, base)):
+            return dtype
+    raise TypeError(f'Unsupported histogram type {type(hist).__name__}')
+
+def _trim(arr, include_overflow):
+    return arr if include_overflow else arr[tuple([slice(1, -1) for idim in range(arr.ndim)])]
+
+def hist2array(hist, include_overflow=False, return_errors=False, copy=True):
+    '''Create a numpy array from a ROOT histogram without external tools like root_numpy.
+
+    Args:
+        hist (TH1): Input ROOT histogram (TH1, TH2 or TH3, of any bin type)
+        include_overflow (bool, optional): Whether or not to include the under/overflow bins. Defaults to False.
+        return_errors (bool, optional): Whether or not to also return the bin errors. Defaults to False.
+        copy (bool, optional): If False, the contents are a view of the histogram's memory, only valid as long as the histogram exists. Defaults to True.
+
+    Returns:
+        arr (np.ndarray): Array representing the ROOT histogram, indexed [(z,) (y,) x]
+        errors (np.ndarray): Array containing the sqrt of the sum of weights squared
+    '''
+    hist.BufferEmpty()
+    shape = _shape(hist)
+    arr = np.ndarray(shape, dtype=_dtype(hist), buffer=hist.GetArray(), order='C')
+    if return_errors:
+        errors = _trim(bin_errors(hist, arr), include_overflow)
+    arr = _trim(arr, include_overflow)
+    if copy:
+        arr = arr.copy()
+    if return_errors:
+        return arr, errors
+    return arr
+
+def hist2sumw2(hist, include_overflow=False):
+    '''Copy of the sums of weights squared of a ROOT histogram, indexed as by hist2array, None if it has no Sumw2'''
+    if not hist.GetSumw2N():
+        return None
+    return _trim(np.ndarray(_shape(hist), dtype=np.float64, buffer=hist.GetSumw2().GetArray(), order='C'), include_overflow).copy()
+
+def array2hist(arr, hist, errors=None, include_overflow=False, sumw2=None):
+    '''Fill a ROOT histogram from a numpy array indexed as by hist2array, writing directly into the histogram's memory.
+
+    Args:
+        arr (np.ndarray): Bin contents, indexed [(z,) (y,) x]
+        hist (TH1): Histogram to fill, with the binning of `arr`
+        errors (np.ndarray, optional): Bin errors. The histogram only gets Sumw2 if they (or `sumw2`) are given. Defaults to None.
+        sumw2 (np.ndarray, optional): Sums of weights squared instead of the errors, e.g. from hist2sumw2 for an exact copy. Defaults to None.
+        include_overflow (bool, optional): Whether `arr` (and `errors`) include the under/overflow bins. Defaults to False.
+
+    Returns:
+        hist (TH1): The filled histogram. Its number of entries is not changed.
+    '''
+    inner = Ellipsis if include_overflow else tuple([slice(1, -1) for idim in range(len(_shape(hist)))])
+    np.ndarray(_shape(hist), dtype=_dtype(hist), buffer=hist.GetArray(), order='C')[inner] = arr
+    if (errors is not None) and (sumw2 is None):
+        sumw2 = np.square(errors)
+    if sumw2 is not None:
+        if not hist.GetSumw2N():
+            hist.Sumw2()
+        np.ndarray(_shape(hist), dtype=np.float64, buffer=hist.GetSumw2().GetArray(), order='C')[inner] = sumw2
+    return hist
+
+def bin_errors(hist, contents=None):
+    '''sqrt(sum of weights squared) of all bins including under/overflow, or sqrt(|content|) for a histogram without Sumw2, as TH1::GetBinError'''
+    if hist.GetSumw2N():
+        return np.sqrt(np.ndarray(_shape(hist), dtype=np.float64, buffer=hist.GetSumw2().GetArray(), order='C'))
+    if contents is None:
+        contents = hist2array(hist, include_overflow=True, copy=False)
+    return np.sqrt(np.abs(contents.astype(np.float64)))
+
+def asymmetric_errors(hist, contents, errors):
+    '''
+    (low, up) errors of the bins with `contents` and symmetric `errors`, as TH1::GetBinErrorLow/Up:
+    the symmetric errors for the default error option or a weighted histogram, otherwise the
+    central Poisson (Garwood) interval, at 68.3% CL (kPoisson) or 95% CL (kPoisson2), and the
+    symmetric error again for bins with negative content.
+    '''
+    import ROOT
+    option = hist.GetBinErrorOption()
+    if option == ROOT.TH1.kNormal:
+        return errors, errors
+    stats = np.zeros(13)
+    hist.GetStats(stats)
+    if hist.GetSumw2N() and stats[0] != stats[1]:
+        print(f'WARNING: {hist.GetName()} is weighted, using the symmetric errors instead of the Poisson intervals')
+        return errors, errors
+    from scipy.stats import gamma
+    alpha = 0.05 if option == ROOT.TH1.kPoisson2 else 1. - 0.682689492
+    c = np.asarray(contents, dtype=np.float64)
+    n = np.trunc(np.maximum(c, 0.))
+    with np.errstate(invalid='ignore'):
+        low = np.where(n > 0, c - gamma.ppf(alpha/2, np.maximum(n, 1)), 0.)
+    up = gamma.isf(alpha/2, n + 1) - c
+    # ROOT falls back to the symmetric error for bins with negative content
+    return np.where(c < 0, errors, low), np.where(c < 0, errors, up)
+
+def axis_edges(axis):
+    '''Bin edges of a TAxis, for fixed or variable binning'''
+    xbins = axis.GetXbins()
+    if xbins.GetSize():
+        return np.ndarray((xbins.GetSize(),), dtype=np.float64, buffer=xbins.GetArray()).copy()
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins() + 1)
+
+class PyHist:
+    def __init__(self, histo):
+        """
+        Initializes the class PyHist object.
+        Parameters:
+        - histo (TH1): The input ROOT histogram
+        """
+        self.histo_name = histo.GetName()
+        values, error = hist2array(histo, return_errors=True)
+        self.bin_values = values.astype(np.float64)
+        self.bin_error = error
+        self.bin_error_low, self.bin_error_hi = asymmetric_errors(histo, self.bin_values, self.bin_error)
+        self.bin_edges = axis_edges(histo.GetXaxis())
+        self.bin_widths = np.diff(self.bin_edges)
+        self.is_normalized_by_width = False
+
+    def divide_by_bin_width(self):
+        """
+        Divides the bin values and errors by the bin widths.
+        New arrays are made, so arrays taken from the object beforehand keep the undivided values.
+        """
+        if not self.is_normalized_by_width:
+            self.bin_values = self.bin_values / self.bin_widths
+            self.bin_error_low = self.bin_error_low / self.bin_widths
+            self.bin_error_hi = self.bin_error_hi / self.bin_widths
+            self.bin_error = self.bin_error / self.bin_widths
+            self.is_normalized_by_width = True
+        else:
+            print("Already normalized by bin width.")
+
+    def get_error_pairs(self):
+        """
+        For use with pyplot.errorbar.
+        """
+        return np.array([self.bin_error_low, self.bin_error_hi])
+
+    def get_bin_centers(self):
+        """
+        Calculates the bin centers for the histogram.
+        Returns:
+        - Array of bin centers.
+        """
+        return 0.5 * (self.bin_edges[:-1] + self.bin_edges[1:])
@@ -22,56 +22,75 @@ Then the 2DAlphabet format would be
     },
     ...
 }
+
+Only the templates of the nuisances which end up in the JSON are written (SR_pass bins with
+0 < nom <= 20 in any year, and all ttbarCR_pass bins). For every one of them 2DAlphabet needs a
+template in all four regions: in the region of the nuisance the bin is varied up/down by sqrt(nom),
+in the other (dummy) regions the bin is set to zero. The nuisances are selected for all years first,
+then every year is written in a single pass over the union, varying a single working histogram in
+place instead of cloning the nominal for every template.
 '''
 import ROOT
 import numpy as np
 
 regions = ['SR_fail','SR_pass','ttbarCR_fail','ttbarCR_pass']
+years = ['16','16APV','17','18']
 organized_hists = ROOT.TFile.Open('organized_hists.root','READ')
 
-syst_names = []
+def get_nominal(process, year, region):
+    '''Nominal histogram and its bin contents as an (nx, ny) array'''
+    h = organized_hists.Get(f'{process}_{year}_{region}_FULL')
+    nx = h.GetNbinsX()
+    ny = h.GetNbinsY()
+    nom = np.array([[h.GetBinContent(i,j) for j in range(1,ny+1)] for i in range(1,nx+1)])
+    return h, nom
+
+def select(region, nom):
+    '''Mask of the bins of `region` for which a nuisance is made'''
+    if 'pass' not in region:
+        return np.zeros(nom.shape, dtype=bool)
+    if ('SR' in region):
+        # Only make an entry in the JSON for this nuisance if the nominal value is less than 20 events (in the SR, where we have lower stats) and greater than zero 
+        return (nom <= 20.0) & (nom > 0.0)
+    # make CR nuisances for all bins in pass, b/c the statistcs are much higher
+    return np.ones(nom.shape, dtype=bool)
 
 for process in ['ttbar']:
-    for year in ['16','16APV','17','18']:
+    # First pass: select the nuisances of all years, in the order (year, region, i, j)
+    syst_names = []
+    for year in years:
+        for region in regions:
+            h, nom = get_nominal(process, year, region)
+            for i, j in zip(*np.nonzero(select(region, nom))):
+                syst_names.append((region, i+1, j+1))
+    syst_names = list(dict.fromkeys(syst_names))
+
+    # Second pass: write the templates of the selected nuisances only
+    for year in years:
         f = ROOT.TFile.Open(f'{process}_{year}_MCstats.root','RECREATE')
         f.cd()
         for region in regions:
-            # Have to do some nonsense and make dummy histograms for 2DAlphabet. It needs a histogram for all regions.
-            for rDummy in regions:
-                h = organized_hists.Get(f'{process}_{year}_{region}_FULL')
-                print(f'Generating MC stats templates for region {region}, 20{year}  [rDummy = {rDummy}]')
-                hNom = h.Clone(f'MHvsMTH_{region}__nominal')
-                hNom.Write()
-                nx = h.GetNbinsX()
-                ny = h.GetNbinsY()
-                for i in range(1,nx+1):
-                    for j in range(1,ny+1):
-                        nom = h.GetBinContent(i,j)
-                        unc = np.sqrt(nom)
-                        for var in ['up','down']:
-                            hBinVar = hNom.Clone(f'MHvsMTH_{region}__{rDummy}_mcstats_{i}_{j}_{var}')
-                            if rDummy == region:
-                                if var == 'up':
-                                    hBinVar.SetBinContent(i,j, nom+unc)
-                                else:
-                                    new = nom-unc 
-                                    if new < 0: new = 0.0
-                                    hBinVar.SetBinContent(i,j, new)
-                                syst_name = f'{region}_mcstats_{i}_{j}'
-                                # Only make an entry in the JSON for this nuisance if the nominal value is less than 20 events (in the SR, where we have lower stats) and greater than zero 
-                                if ('SR' in region):
-                                    if (nom <= 20.0) and (nom > 0.0):
-                                        if 'pass' in syst_name:
-                                            #print(f'\t{syst_name} = {nom}')
-                                            syst_names.append(syst_name)
-                                else:
-                                    # make CR nuisances for all bins in pass, b/c the statistcs are much higher
-                                    if 'pass' in syst_name:
-                                        syst_names.append(syst_name)
-                            else:
-                                # Dummy histogram, all zeros 
-                                hBinVar.SetBinContent(i,j,0.0)
-                            hBinVar.Write()
+            print(f'Generating MC stats templates for region {region}, 20{year}')
+            h, nom = get_nominal(process, year, region)
+            hNom = h.Clone(f'MHvsMTH_{region}__nominal')
+            hNom.SetDirectory(0)
+            hNom.Write()
+            with np.errstate(invalid='ignore'):
+                unc = np.sqrt(nom)
+            down = nom - unc
+            down[down < 0] = 0.0
+            variations = {'up': nom + unc, 'down': down}
+            # A single working copy of the nominal, of which one bin at a time is changed, written and restored
+            hWork = h.Clone('work')
+            hWork.SetDirectory(0)
+            for rDummy, i, j in syst_names:
+                for var in ['up','down']:
+                    # Dummy templates (nuisances of the other regions) have the bin set to zero
+                    hWork.SetBinContent(i, j, variations[var][i-1,j-1] if rDummy == region else 0.0)
+                    hWork.SetName(f'MHvsMTH_{region}__{rDummy}_mcstats_{i}_{j}_{var}')
+                    hWork.Write()
+                hWork.SetBinContent(i, j, nom[i-1,j-1])
+        f.Close()
 
 base_syst_str = '''
         "%s": {
@@ -82,11 +101,11 @@ base_syst_str = '''
 '''
 out = open('mcstat_systs.txt','w')
 print('Writing MCstat systematics to file...')
-all_systs = list(dict.fromkeys(syst_names))
+all_systs = [f'{region}_mcstats_{i}_{j}' for region, i, j in syst_names]
 #print('"'+'","'.join(all_systs)+'"')
 out.write('"'+'","'.join(all_systs)+'"')
 out.write('\n')
 for syst in all_systs:
     #print(base_syst_str%(syst))
     out.write(base_syst_str%(syst)+'\n')
-out.close()
\ No newline at end of file
+out.close()
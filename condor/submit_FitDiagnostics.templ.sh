@@ -41,8 +41,38 @@ ls -lh
 # Modify the card to point to the current directory instead of one above (this is a 2DAlphabet remnant)
 echo "sed -i 's-../base.root-./base.root-g' card.txt"
 sed -i 's-../base.root-./base.root-g' card.txt
-# Run the fit
-(set -x; combine -M FitDiagnostics card.txt --text2workspace "--channel-masks" --saveWorkspace --cminDefaultMinimizerStrategy $strat --rMin $rMin --rMax $rMax -v $v --robustFit 0 --cminDefaultMinimizerTolerance $tol --freezeParameters rgx{.*mcstat.*})
+# Compile the card once, all rungs of the fit ladder use the same workspace
+(set -x; text2workspace.py card.txt -o workspace.root --channel-masks)
+# Run the fit ladder: one rung ("name strat tol robustHesse setParams") per line, stopping at the
+# first one which converges (see fit_ladder.py)
+rung_ok="none"
+while read -r rung strat tol robustHesse setParams; do
+    params=""
+    if [ "$$setParams" = "1" ]; then
+        params=$$(python3 fit_ladder.py params fitDiagnosticsTest.root 2>/dev/null < /dev/null)
+        if [ -z "$$params" ]; then
+            echo "Skipping rung $$rung: no fit_b to start from"
+            continue
+        fi
+        params="--setParameters $$params"
+    fi
+    if [ "$$robustHesse" = "1" ]; then
+        algo="--robustHesse 1"
+    else
+        algo="--robustFit 0"
+    fi
+    rm -f fitDiagnosticsTest.root
+    echo "Fit ladder rung: $$rung"
+    (set -x; combine -M FitDiagnostics -d workspace.root --saveWorkspace --cminDefaultMinimizerStrategy $$strat --rMin $rMin --rMax $rMax -v $v $$algo --cminDefaultMinimizerTolerance $$tol --freezeParameters rgx{.*mcstat.*} $$params < /dev/null)
+    if python3 fit_ladder.py check fitDiagnosticsTest.root < /dev/null; then
+        rung_ok=$$rung
+        break
+    fi
+done <<RUNGS
+$rungs
+RUNGS
+echo "Fit ladder: converged rung $$rung_ok"
+echo "$$rung_ok" > fit_rung_"${sig}".txt
 # Rename output 
 mv fitDiagnosticsTest.root fitDiagnosticsTest_"${sig}".root
 mv card.txt card_"${sig}".txt
@@ -1,11 +1,14 @@
 '''
 NOTE: This script does not require that the RooWorkspace exists, only that the combined card exists locally
 '''
-import os 
+import os, sys
 from pathlib import Path
 import argparse
 from string import Template
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fit_ladder import condor_rungs, get_ladder
+
 def setup():
     t2_local_prefix = "/eos/uscms/"
     t2_prefix = "root://cmseos.fnal.gov"
@@ -61,9 +64,13 @@ def main(args):
 
     # Arguments for condor shell script
     localsh = f"{local_dir}/{prefix}.sh"
+    # Without --ladder, a single rung with the given strategy and tolerance
+    if args.ladder is None:
+        rungs = f"single {args.strat} {args.tol} 0 0"
+    else:
+        rungs = condor_rungs(get_ladder(args.ladder))
     sh_args = {
-        "tol": args.tol,
-        "strat": args.strat,
+        "rungs": rungs,
         "sig": args.sig,
         "rMin": args.rMin,
         "rMax": args.rMax,
@@ -88,6 +95,7 @@ if __name__ == "__main__":
     parser.add_argument("--verbosity", default=2, help="verbosity", type=int)
     parser.add_argument("--tol", default=0.1, help="minimizer tolerance", type=float)
     parser.add_argument("--strat", default=2, help='minimizer strategy', type=int)
+    parser.add_argument("--ladder", nargs='*', default=None, help='try the rungs of the fit ladder (all, or only those given) until one converges, instead of a single fit with --strat/--tol (see fit_ladder.py)', type=str)
     parser.add_argument("--rMin", default='-1', help='rMin in fit', type=str)
     parser.add_argument("--rMax", default='2', help='rMax in fit', type=str)
     args = parser.parse_args()
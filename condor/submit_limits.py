@@ -6,11 +6,14 @@ Then run: python scripts/handle_FitDiagnostics_CondorOutput.py
 
 Then you can run this script for the given signal mass point.
 '''
-import os 
+import os, sys
 from pathlib import Path
 import argparse
 from string import Template
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from workspace_cache import compiled_workspace
+
 def setup():
     t2_local_prefix = "/eos/uscms/"
     t2_prefix = "root://cmseos.fnal.gov"
@@ -55,12 +58,17 @@ def main(args):
     local_jdl = Path(f'{local_dir}/{prefix}.jdl')
     local_log = Path(f'{local_dir}/{prefix}.log')
 
+    # The job runs on the compiled workspace of the card (made here only if the card changed since
+    # it was last compiled, see workspace_cache.py), instead of running text2workspace on the card
+    workspace = compiled_workspace(str(base_root_dir / f'TprimeB-{args.sig}-SR0x0-CR0x0_area'))
+
     # Arguments for jdl 
     jdl_args = {
         "dir": local_dir,
         "base_root_dir": base_root_dir,
         "prefix": prefix,
-        "sig": args.sig
+        "sig": args.sig,
+        "workspace": workspace
     }
     write_template(jdl_templ, local_jdl, jdl_args)
 
@@ -73,6 +81,7 @@ def main(args):
     localsh = f"{local_dir}/{prefix}.sh"
     sh_args = {
         "sig": args.sig,
+        "workspace": workspace,
         "seed": args.seed,
         "strat": args.strat,
         "tol": args.tol,
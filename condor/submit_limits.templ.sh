@@ -39,11 +39,10 @@ echo "ls -lh"
 ls -lh 
 
 ##############################################################
-#                   First run limits on the card             #
+#        First run limits on the compiled card               #
 ##############################################################
-# Modify the card to point to the current directory instead of one above (this is a 2DAlphabet remnant)
-echo "sed -i 's-../base.root-./base.root-g' card.txt"
-sed -i 's-../base.root-./base.root-g' card.txt
+# ${workspace} is the text2workspace output of the card (with channel masks), compiled once at
+# submission (see workspace_cache.py), so the card and base.root are not needed here
 
 # Run the limits on the card
 #(set -x; combine -M AsymptoticLimits -d "card_${sig}.txt" --saveWorkspace -v 2 -n "_${sig}_card" -s $seed)
@@ -59,7 +58,7 @@ sed -i 's-../base.root-./base.root-g' card.txt
 
 #(set -x; combine -M AsymptoticLimits -d "initialFitWorkspace_${sig}.root" --snapshotName initialFit --saveWorkspace -v 4 -n "_${sig}_noCR_workspace" -s $seed --setParameters "${maskCRargs},${setCRparams}" --freezeParameters "${freezeCRparams}" --cminDefaultMinimizerTolerance $tol --cminDefaultMinimizerStrategy $strat --X-rtd MINIMIZER_MaxCalls=400000 --rMin -1 --rMax $rmax)
 
-(set -x; combine -M AsymptoticLimits -d card.txt --saveWorkspace -v 4 -n "_${sig}_noCR_workspace" -s $seed --setParameters "${maskCRargs},${setCRparams}" --freezeParameters "${freezeCRparams}" --cminDefaultMinimizerTolerance $tol --cminDefaultMinimizerStrategy $strat --X-rtd MINIMIZER_MaxCalls=400000 --rMin -1 --rMax $rmax)
+(set -x; combine -M AsymptoticLimits -d ${workspace} --saveWorkspace -v 4 -n "_${sig}_noCR_workspace" -s $seed --setParameters "${maskCRargs},${setCRparams}" --freezeParameters "${freezeCRparams}" --cminDefaultMinimizerTolerance $tol --cminDefaultMinimizerStrategy $strat --X-rtd MINIMIZER_MaxCalls=400000 --rMin -1 --rMax $rmax)
 
 
 echo "ls -lh"
@@ -0,0 +1,143 @@
+'''
+Escalation ladder for the FitDiagnostics fits: the rungs (minimizer strategy, tolerance, algorithm,
+starting values) are tried in order until one converges, so that failed fits no longer have to be
+found and resubmitted by hand.
+
+The default ladder is
+    strat0              --cminDefaultMinimizerStrategy 0, tolerance 0.1
+    strat1              strategy 1
+    strat2_robustHesse  strategy 2 with --robustHesse 1
+    setParams           strategy 2 with --robustHesse 1, starting from the fit_b parameters of the
+                        previous rung (skipped if there is no fit_b to start from)
+A fit has converged if the b-only and the s+b fit have status 0. Combine does not write fit_s at
+all when the s+b fit fails, so a missing fit_s is a failure, unless the fit was run with
+--skipSBFit. The rung which succeeded, and the outcome of every rung tried, are recorded in
+fit_ladder.json in the area.
+
+Locally, with `jointSRttbarCR.py --fit --ladder` or `run_grid.py --fit --ladder`. On Condor, the
+same rungs are run by the job (see condor/submit_fits.py --ladder), using this file as a script:
+    python fit_ladder.py check fitDiagnosticsTest.root    # exit code 0 if converged (--skipSBFit: b-only)
+    python fit_ladder.py params fitDiagnosticsTest.root   # fit_b values, for --setParameters
+'''
+import os, sys, json, time, traceback
+
+FIT_LADDER = [
+    {'name': 'strat0',             'strat': 0, 'tol': 0.1, 'robustHesse': False, 'setParams': False},
+    {'name': 'strat1',             'strat': 1, 'tol': 0.1, 'robustHesse': False, 'setParams': False},
+    {'name': 'strat2_robustHesse', 'strat': 2, 'tol': 0.1, 'robustHesse': True,  'setParams': False},
+    {'name': 'setParams',          'strat': 2, 'tol': 0.1, 'robustHesse': True,  'setParams': True},
+]
+
+def get_ladder(names=None):
+    '''The rungs of FIT_LADDER with the given names (all by default), in ladder order'''
+    if not names:
+        return list(FIT_LADDER)
+    unknown = set(names) - {rung['name'] for rung in FIT_LADDER}
+    if unknown:
+        raise ValueError(f'Unknown fit ladder rungs {sorted(unknown)}, choose from {[rung["name"] for rung in FIT_LADDER]}')
+    return [rung for rung in FIT_LADDER if rung['name'] in names]
+
+def fit_status(fitfile):
+    '''Status of the b-only and s+b fits, None for a fit result which does not exist'''
+    import ROOT
+    f = ROOT.TFile.Open(fitfile)
+    if (not f) or f.IsZombie():
+        return {'fit_b_status': None, 'fit_b_covQual': None, 'fit_s_status': None}
+    fit_b = f.Get('fit_b')
+    fit_s = f.Get('fit_s')
+    out = {
+        'fit_b_status':  fit_b.status() if fit_b else None,
+        'fit_b_covQual': fit_b.covQual() if fit_b else None,
+        'fit_s_status':  fit_s.status() if fit_s else None,
+    }
+    f.Close()
+    return out
+
+def converged(status, skip_sb=False):
+    '''Whether the fits converged, only the b-only fit if the s+b fit was skipped (--skipSBFit)'''
+    if skip_sb:
+        return (status['fit_b_status'] == 0) and (status['fit_s_status'] in (0, None))
+    return (status['fit_b_status'] == 0) and (status['fit_s_status'] == 0)
+
+def fit_b_params(fitfile):
+    '''{parameter: postfit value} of the b-only fit, empty if there is none'''
+    import ROOT
+    f = ROOT.TFile.Open(fitfile)
+    fit_b = f.Get('fit_b') if (f and not f.IsZombie()) else None
+    params = {par.getTitle(): f'{par.getVal()}' for par in fit_b.floatParsFinal()} if fit_b else {}
+    if f:
+        f.Close()
+    return params
+
+def _mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def _write_record(record, out):
+    if record:
+        with open(record+'.tmp', 'w') as f:
+            json.dump(out, f, indent=2)
+        os.replace(record+'.tmp', record)
+
+def run_ladder(fit, fitfile, ladder=FIT_LADDER, record=None, skip_sb=False, fatal=()):
+    '''
+    Call fit(rung) for the rungs of `ladder` in order, until the fit result written to `fitfile`
+    has converged. A rung which raises, or does not (re)write `fitfile`, counts as not converged.
+    Returns {'rung': name of the rung which converged or None, 'attempts': [...]}, which is also
+    written to the JSON file `record` if given. With `skip_sb`, the fits are run with --skipSBFit and
+    only the b-only fit has to converge. An exception of the types `fatal`, which no other rung can
+    fix, is recorded and raised again.
+    '''
+    out = {'rung': None, 'attempts': []}
+    for rung in ladder:
+        attempt = {'rung': rung['name'], 'status': 'failed'}
+        if rung['setParams'] and not fit_b_params(fitfile):
+            attempt['status'] = 'skipped'
+            attempt['error'] = 'no fit_b to start from'
+            out['attempts'].append(attempt)
+            continue
+        print(f'===== fit ladder: {rung["name"]} =====')
+        before = _mtime(fitfile)
+        start = time.time()
+        try:
+            fit(rung)
+            if _mtime(fitfile) in (None, before):
+                attempt['error'] = f'{fitfile} was not written'
+            else:
+                attempt.update(fit_status(fitfile))
+                if converged(attempt, skip_sb):
+                    attempt['status'] = 'converged'
+        except Exception as e:
+            traceback.print_exc()
+            attempt['error'] = repr(e)
+            if isinstance(e, fatal):
+                out['attempts'].append(attempt)
+                _write_record(record, out)
+                raise
+        attempt['time'] = time.time() - start
+        out['attempts'].append(attempt)
+        if attempt['status'] == 'converged':
+            out['rung'] = rung['name']
+            break
+    print(f'fit ladder: {"converged at "+out["rung"] if out["rung"] else "no rung converged"}')
+    _write_record(record, out)
+    return out
+
+def condor_rungs(ladder=FIT_LADDER):
+    '''The ladder as "name strat tol robustHesse setParams" lines, for the Condor fit script'''
+    return '\n'.join(f'{rung["name"]} {rung["strat"]} {rung["tol"]} {int(rung["robustHesse"])} {int(rung["setParams"])}' for rung in ladder)
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('mode', choices=['check', 'params'],
+                        help='check: exit code 0 if the fit converged, params: print the fit_b values as name=value,...')
+    parser.add_argument('fitfile', type=str,
+                        help='FitDiagnostics output')
+    parser.add_argument('--skipSBFit', dest='skipSBFit',
+                        action='store_true',
+                        help='With check, the fit was run with --skipSBFit: only the b-only fit has to converge')
+    args = parser.parse_args()
+
+    if args.mode == 'check':
+        sys.exit(0 if converged(fit_status(args.fitfile), args.skipSBFit) else 1)
+    print(','.join(f'{k}={v}' for k, v in fit_b_params(args.fitfile).items()))
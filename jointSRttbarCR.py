@@ -5,8 +5,11 @@ from TwoDAlphabet.twoDalphabet import MakeCard, TwoDAlphabet
 from TwoDAlphabet.alphawrap import BinnedDistribution, ParametricFunction
 from TwoDAlphabet.helpers import make_env_tarball, cd, execute_cmd
 from TwoDAlphabet.ftest import FstatCalc
-import os
+import os, re, fcntl, hashlib
+import json as jsonlib
 import numpy as np
+from fit_ladder import FIT_LADDER, fit_b_params, get_ladder, run_ladder
+from workspace_cache import compiled_workspace
 
 def _get_other_region_names(pass_reg_name):
     return pass_reg_name, pass_reg_name.replace('SR_fail','ttbarCR_pass')
@@ -16,7 +19,9 @@ def _select_signal(row, args):
     poly_order = args[1]
     tt_poly_order = args[2]
     if row.process_type == 'SIGNAL':
-        if signame in row.process:
+        # Signal processes are named <signame>_<year>. Match the name exactly, since a workspace may
+        # hold several signals and e.g. TprimeB-800-75 is a substring of TprimeB-1800-75
+        if row.process.rsplit('_',1)[0] == signame:
             return True
         else:
             return False
@@ -39,48 +44,168 @@ def _select_signal(row, args):
         return True
 
 def _generate_constraints(nparams):
-    out = {}
-    for i in range(nparams):
-        if i == 0:
-            out[i] = {"MIN":-500,"MAX":500}
-        else:
-            out[i] = {"MIN":-500,"MAX":500}
-    return out
+    '''Fixed constraints, used when the data-driven ones (see rpf_bounds.py) are disabled or unavailable'''
+    return {i: {"MIN":-500,"MAX":500} for i in range(nparams)}
 
+# 'x'/'y': indices of the coefficients of the x and y polynomials of each form, in increasing power
+# (a form without a y polynomial has 'y': []). 2x2 has none, since its y factor (@3+@4*y*@5*y**2) is
+# not a polynomial extending the lower orders, and 3x2 is in fact cubic in x and linear in y.
 _rpf_options = {
     '0x0': {
         'form': '(@0)',
-        'constraints': _generate_constraints(1)
+        'constraints': _generate_constraints(1),
+        'x': [0], 'y': []
     },
     '1x0': {
         'form': '(@0+@1*x)',
-        'constraints': _generate_constraints(2)
+        'constraints': _generate_constraints(2),
+        'x': [0,1], 'y': []
     },
     '0x1': {
         'form': '(@0+@1*y)',
-        'constraints': _generate_constraints(2)
+        'constraints': _generate_constraints(2),
+        'x': [], 'y': [0,1]
     },
     '1x1': {
         'form': '(@0+@1*x)*(@2+@3*y)',
-        'constraints': _generate_constraints(4)
+        'constraints': _generate_constraints(4),
+        'x': [0,1], 'y': [2,3]
     },
     '2x1': {
         'form': '(@0+@1*x+@2*x**2)*(@3+@4*y)',
-        'constraints': _generate_constraints(5)
+        'constraints': _generate_constraints(5),
+        'x': [0,1,2], 'y': [3,4]
     },
     '2x2': {
         'form': '(@0+@1*x+@2*x**2)*(@3+@4*y*@5*y**2)',
-        'constraints': _generate_constraints(6)
+        'constraints': _generate_constraints(6),
+        'x': None, 'y': None
     },
     '3x2': {
         'form': '(@0+@1*x+@2*x**2+@3*x**3)*(@4+@5*y)',
-        'constraints': _generate_constraints(6)
+        'constraints': _generate_constraints(6),
+        'x': [0,1,2,3], 'y': [4,5]
     }
 }
 
-def test_make(SRorCR='',fr={}, json=''):
+def _rpf_orders(opt_name):
+    '''(x, y) polynomial degrees of a TF, None if it is not a product of polynomials'''
+    opt = _rpf_options[opt_name]
+    if opt['x'] is None:
+        return None
+    return max(len(opt['x'])-1, 0), max(len(opt['y'])-1, 0)
+
+def _rpf_nested(lower, higher):
+    '''Whether the TF `lower` is a special case of the TF `higher`'''
+    lo, hi = _rpf_orders(lower), _rpf_orders(higher)
+    if (lower == higher) or (lo is None) or (hi is None):
+        return False
+    return (lo[0] <= hi[0]) and (lo[1] <= hi[1])
+
+def _rpf_polys(opt_name, values):
+    '''(x, y) polynomial coefficients of a TF with parameter values {index: value}, [1.] for a missing polynomial'''
+    opt = _rpf_options[opt_name]
+    return [values[i] for i in opt['x']] or [1.], [values[i] for i in opt['y']] or [1.]
+
+def map_rpf_params(lower, higher, values):
+    '''
+    Parameter values {index: value} of the TF `higher` giving the same function as the nested TF 
+    `lower` with parameter values `values`: the coefficients of the higher powers are set to zero, 
+    and the constant of a polynomial which `lower` does not have is set to one. As in rpf_bounds.py,
+    the overall normalization of a TF with both polynomials is carried by the x polynomial, i.e. the
+    constant of its y polynomial is one.
+    '''
+    if not _rpf_nested(lower, higher):
+        raise ValueError(f'TF {lower} is not nested in TF {higher}')
+    xs, ys = _rpf_polys(lower, values)
+    opt = _rpf_options[higher]
+    # A polynomial missing in `higher` can only be a constant in `lower`, fold it into the other one
+    if not opt['x']:
+        xs, ys = [1.], [xs[0]*c for c in ys]
+    if not opt['y']:
+        xs, ys = [ys[0]*c for c in xs], [1.]
+    if opt['x'] and opt['y'] and ys[0] != 0:
+        xs, ys = [ys[0]*c for c in xs], [c/ys[0] for c in ys]
+    out = {}
+    for indices, coeffs in [(opt['x'], xs), (opt['y'], ys)]:
+        for power, i in enumerate(indices):
+            out[i] = coeffs[power] if power < len(coeffs) else 0.
+    return out
+
+def warm_start_params(working_area, signal, SRtf, CRtf, fromSRtf, fromCRtf):
+    '''
+    setParams values starting the fit with TFs (SRtf, CRtf) from the converged b-only fit with the 
+    nested TFs (fromSRtf, fromCRtf), e.g. 2x1 from 1x1, see map_rpf_params.
+    '''
+    fitfile = f'{working_area}/TprimeB-{signal}-SR{fromSRtf}-CR{fromCRtf}_area/fitDiagnosticsTest.root'
+    f = ROOT.TFile.Open(fitfile, 'READ')
+    fit_b = f.Get('fit_b') if f else None
+    if not fit_b:
+        raise ValueError(f'No b-only fit result to warm-start from in {fitfile}')
+    fitted = {par.GetName(): par.getVal() for par in fit_b.floatParsFinal()}
+    f.Close()
+    setParams = {}
+    for region, lower, higher in [('SR', fromSRtf, SRtf), ('ttbarCR', fromCRtf, CRtf)]:
+        pattern = re.compile(rf'^Background_{region}_rpf_{lower}_par(\d+)$')
+        values = {}
+        for name, val in fitted.items():
+            m = pattern.match(name)
+            if m:
+                values[int(m.group(1))] = val
+        if len(values) != len(_rpf_options[lower]['constraints']):
+            raise ValueError(f'Found {len(values)} parameters of the {region} TF {lower} in {fitfile}')
+        mapped = values if lower == higher else map_rpf_params(lower, higher, values)
+        for i, val in mapped.items():
+            setParams[f'Background_{region}_rpf_{higher}_par{i}'] = f'{val}'
+    print(f'Warm start from SR{fromSRtf}-CR{fromCRtf}: {setParams}')
+    return setParams
+
+def minimizer_algo(robustFit=False, robustHesse=False):
+    '''Combine option for the robustFit/robustHesse algorithms'''
+    if (robustFit) and (robustHesse):
+        raise ValueError('Cannot use both robustFit and robustHesse algorithms simultaneously')
+    elif robustFit:
+        return '--robustFit 1'
+    elif robustHesse:
+        return '--robustHesse 1'
+    return ''
+
+def rpf_constraints(qcd_hists, nsigma=None):
+    '''
+    {region: {TF name: constraints}} of the SR and ttbarCR TFs. The starting values (NOM) are fitted
+    to the pass/fail ratio of the initial QCD estimates (see rpf_bounds.py) and the fixed bounds of
+    _rpf_options are kept, unless nsigma is given: the bounds are then +/- nsigma around the fitted
+    values, widened to contain every nested TF. With nsigma=0 the fixed constraints are used as is.
+    TFs which cannot be estimated keep the fixed constraints.
+    '''
+    from rpf_bounds import rpf_constraints as estimate
+    fixed = {opt_name: opt['constraints'] for opt_name, opt in _rpf_options.items()}
+    if nsigma == 0:
+        return {'SR': fixed, 'ttbarCR': fixed}
+    try:
+        estimated = estimate(qcd_hists, _rpf_options, nsigma=nsigma or 5., nested=_rpf_nested, map_params=map_rpf_params)
+    except (ValueError, np.linalg.LinAlgError) as e:
+        print(f'WARNING: could not estimate the RPF constraints ({e}), using the fixed ones')
+        return {'SR': fixed, 'ttbarCR': fixed}
+    out = {}
+    for region, tfs in estimated.items():
+        out[region] = {}
+        for opt_name, c in tfs.items():
+            if c is None:
+                out[region][opt_name] = fixed[opt_name]
+            elif nsigma is None:
+                out[region][opt_name] = {i: dict(fixed[opt_name][i], NOM=c[i]['NOM']) for i in c}
+            else:
+                out[region][opt_name] = c
+    return out
+
+def test_make(SRorCR='',fr={}, json='', cache=False, rpf_nsigma=None):
+    if cache:
+        from xrdcache import cache_config
+        fr = dict(fr, **cache_config(json, fr))
     twoD = TwoDAlphabet('{}fits'.format(SRorCR),json,loadPrevious=False,findreplace=fr)
     qcd_hists = twoD.InitQCDHists()
+    constraints = rpf_constraints(qcd_hists, rpf_nsigma)
 
     binning, _ = twoD.GetBinningFor('SR_fail')
 
@@ -99,12 +224,12 @@ def test_make(SRorCR='',fr={}, json=''):
         # TF for SR_fail -> SR_pass
         qcd_rpf_SR = ParametricFunction(
             'Background_SR_rpf_%s'%opt_name, binning, opt['form'],
-            constraints = opt['constraints']
+            constraints = constraints['SR'][opt_name]
         )
         # TF for ttbarCR_fail -> ttbarCR_pass
         qcd_rpf_ttbarCR = ParametricFunction(
             'Background_ttbarCR_rpf_%s'%opt_name, binning, opt['form'],
-            constraints = opt['constraints']
+            constraints = constraints['ttbarCR'][opt_name]
         )
 
         # QCD estimate in SR pass
@@ -115,23 +240,139 @@ def test_make(SRorCR='',fr={}, json=''):
         twoD.AddAlphaObj('Background_ttbarCR_pass_%s'%opt_name, 'ttbarCR_pass', qcd_ptt, title='QCD')
 
     twoD.Save()
+    with open('{}/rpf_constraints.json'.format(twoD.tag), 'w') as f:
+        jsonlib.dump(constraints, f, indent=4)
+
+def test_make_shared(SRorCR='', signals=[], json='', cache=False, rpf_nsigma=None):
+    '''
+    Build a single workspace for a group of signals. The signal-independent part of the model (data,
+    ttbar/W/Z+jets templates, QCD estimate, binning and all RPFs) is built only once for the group,
+    together with the templates of the given signals (MT-MPHI) via the SIGNAME list. The cards
+    and fits for each signal are then made from this area with makeCard/test_fit as usual, which
+    select the requested signal from the ledger. All templates end up in the same base.root, which
+    every card and fit of the group loads, so the groups should be small, e.g. one per Tprime mass.
+    '''
+    with open(json) as f:
+        config = jsonlib.load(f)
+    config['GLOBAL']['SIGNAME'] = [f'TprimeB-{signal}' for signal in signals]
+    shared_json = '{}shared.json'.format(SRorCR)
+    with open(shared_json, 'w') as f:
+        jsonlib.dump(config, f, indent=4)
+    print(f'Building shared workspace {SRorCR}fits for {len(signals)} signals')
+    if len({signal.split('-')[0] for signal in signals}) > 1:
+        print(f'WARNING: {SRorCR}fits holds the signals of several Tprime masses, every card and fit will load all {len(signals)} of them')
+    test_make(SRorCR, json=shared_json, cache=cache, rpf_nsigma=rpf_nsigma)
+
+def _card_options(working_area, autoMCStats=None):
+    '''
+    Extra parse_card options. With an autoMCStats threshold (combine's event threshold), the explicit
+    ttbar mcstats nuisances are replaced by combine autoMCStats lines in the SR_pass/ttbarCR_pass
+    channels which had explicit nuisances, derived from the ttbar yields in the workspace's
+    organized_hists.root (see parse_card_SRCR_mcstats.automcstats_channels).
+    '''
+    if autoMCStats is None:
+        return {}
+    from parse_card_SRCR_mcstats import automcstats_channels
+    channels = automcstats_channels(f'{working_area}/organized_hists.root')
+    print(f'Using autoMCStats (event threshold {autoMCStats:g}) in channels {list(channels)}')
+    return {'automcstats': autoMCStats, 'channels': list(channels)}
+
+def _file_id(path):
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+def _card_key(working_area, subset, SRtf, CRtf, autoMCStats=None):
+    '''
+    Hash of everything the card of an area depends on: the workspace configuration, the ledger 
+    subset selected for the signal, the TFs, the parse_card rules and options.
+    '''
+    from parse_card_SRCR_mcstats import PARSE_CARD_VERSION
+    with open(f'{working_area}/runConfig.json','rb') as f:
+        config = f.read()
+    ledger = subset.df.to_csv(index=False)
+    # The alpha objects themselves are not hashable, their names/regions identify them
+    alphaObjs = subset.alphaObjs.drop(columns=['obj'], errors='ignore').to_csv(index=False)
+    inputs = {
+        'runConfig': hashlib.sha256(config).hexdigest(),
+        'ledger':    hashlib.sha256((ledger+alphaObjs).encode()).hexdigest(),
+        'SRtf':      SRtf,
+        'CRtf':      CRtf,
+        'parse_card_version': PARSE_CARD_VERSION,
+        'autoMCStats': autoMCStats,
+    }
+    if autoMCStats is not None:
+        inputs['organized_hists'] = _file_id(f'{working_area}/organized_hists.root')
+    return hashlib.sha256(jsonlib.dumps(inputs, sort_keys=True).encode()).hexdigest(), inputs
+
+def build_card(twoD, subset, signal, SRtf, CRtf, autoMCStats=None, force=False):
+    '''
+    Make the 2DAlphabet card of the area for this signal and TFs and rewrite it with parse_card, 
+    unless the card already present was built from the same inputs (see _card_key). The card is 
+    built under a lock on the area, so concurrent runs in the same directory wait for each other, 
+    and every output is put in place atomically. Returns True if the card was rebuilt.
+    '''
+    from parse_card_SRCR_mcstats import parse_card
+    working_area = twoD.tag
+    area_name = 'TprimeB-{}-SR{}-CR{}_area'.format(signal, SRtf, CRtf)
+    area = f'{working_area}/{area_name}'
+    key, inputs = _card_key(working_area, subset, SRtf, CRtf, autoMCStats)
+    with open(f'{working_area}/.{area_name}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stamp = f'{area}/card_inputs.json'
+        if (not force) and os.path.exists(f'{area}/card.txt') and os.path.exists(stamp):
+            with open(stamp) as f:
+                if jsonlib.load(f).get('key') == key:
+                    print(f'Card in {area} is up to date, not remaking it')
+                    return False
+            os.remove(stamp)
+        print('Making 2DAlphabet card')
+        twoD.MakeCard(subset, area_name)
+        # rename the 2DAlphabet-produced card
+        print('Creating new card with automcstats for ttbar only in ttbarCR and SR pass')
+        os.replace(f'{area}/card.txt', f'{area}/card_original_2DAlphabet.txt')
+        # create the new card with mcstats only in ttbarCR pass
+        parse_card(
+            f'{area}/card_original_2DAlphabet.txt',
+            out=f'{area}/card.txt',
+            debug=f'{area}/DEBUG_card.txt',
+            **_card_options(working_area, autoMCStats)
+        )
+        # The stamp is written last, an interrupted build is redone on the next call
+        with open(stamp+'.tmp', 'w') as f:
+            jsonlib.dump({'key': key, 'inputs': inputs}, f, indent=4)
+        os.replace(stamp+'.tmp', stamp)
+    return True
 
-def makeCard(SRorCR='', signal='', SRtf='', CRtf=''):
+def makeCard(SRorCR='', signal='', SRtf='', CRtf='', autoMCStats=None, force=False):
     working_area = '{}fits'.format(SRorCR)
     twoD = TwoDAlphabet(working_area, '{}/runConfig.json'.format(working_area), loadPrevious=True)
     subset = twoD.ledger.select(_select_signal, 'TprimeB-{}'.format(signal), SRtf, CRtf)
-    from parse_card_SRCR_mcstats import parse_card
-    print('Making 2DAlphabet card')
-    twoD.MakeCard(subset, 'TprimeB-{}-SR{}-CR{}_area'.format(signal, SRtf, CRtf))
-    # rename the 2DAlphabet-produced card
-    print('Creating new card with automcstats for ttbar only in ttbarCR and SR pass')
-    execute_cmd(f'mv {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card_original_2DAlphabet.txt')
-    # create the new card with mcstats only in ttbarCR pass
-    parse_card(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card_original_2DAlphabet.txt')
-    execute_cmd(f'mv card_new.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card.txt')
-    execute_cmd(f'mv DEBUG.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/DEBUG_card.txt')
-
-def test_fit(SRorCR='', signal='', SRtf='', CRtf='', defMinStrat=0, extra='--robustHesse 1', rMin=-1, rMax=10, verbosity=2, set_params=False):
+    build_card(twoD, subset, signal, SRtf, CRtf, autoMCStats=autoMCStats, force=force)
+
+class AutoMCStatsError(RuntimeError):
+    pass
+
+def check_automcstats(workspace):
+    '''
+    Raise AutoMCStatsError if the compiled workspace (text2workspace output) has no prop_bin*
+    parameters, i.e. combine did not apply the autoMCStats lines to the (RooDataHist) templates and
+    a fit would have no MC statistical uncertainty. Checked before fitting, so that it fails fast.
+    '''
+    f = ROOT.TFile.Open(workspace)
+    if (not f) or f.IsZombie():
+        raise FileNotFoundError(f'ERROR: file {workspace} could not be opened...')
+    try:
+        w = f.Get('w')
+        if not w:
+            raise KeyError(f'No workspace "w" in {workspace}')
+        nprop = sum(p.GetName().startswith('prop_bin') for p in w.allVars())
+    finally:
+        f.Close()
+    if nprop == 0:
+        raise AutoMCStatsError(f'No prop_bin* parameters in {workspace}: combine did not apply autoMCStats to these templates, so the fit would have no MC statistical uncertainty. Run without --autoMCStats')
+    print(f'autoMCStats: {nprop} prop_bin parameters in the workspace')
+
+def test_fit(SRorCR='', signal='', SRtf='', CRtf='', defMinStrat=0, extra='--robustHesse 1', rMin=-1, rMax=10, verbosity=2, set_params=False, autoMCStats=None, force_card=False, warm_start=None):
     working_area = '{}fits'.format(SRorCR)
     twoD = TwoDAlphabet(working_area, '{}/runConfig.json'.format(working_area), loadPrevious=True)
 
@@ -148,32 +389,52 @@ def test_fit(SRorCR='', signal='', SRtf='', CRtf='', defMinStrat=0, extra='--rob
     # parameter is specific to the CR. So these params are fixed in the parse_card 
     # routine. 
     ###############################################################################
-    from parse_card_SRCR_mcstats import parse_card
-    print('Making 2DAlphabet card')
-    twoD.MakeCard(subset, 'TprimeB-{}-SR{}-CR{}_area'.format(signal, SRtf, CRtf))
-    # rename the 2DAlphabet-produced card
-    print('Creating new card with automcstats for ttbar only in ttbarCR and SR pass')
-    execute_cmd(f'mv {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card_original_2DAlphabet.txt')
-    # create the new card with mcstats only in ttbarCR pass
-    parse_card(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card_original_2DAlphabet.txt')
-    execute_cmd(f'mv card_new.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/card.txt')
-    execute_cmd(f'mv DEBUG.txt {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/DEBUG_card.txt')
+    build_card(twoD, subset, signal, SRtf, CRtf, autoMCStats=autoMCStats, force=force_card)
 
     # Use postfit b-only results as starting point for s+b fits (helps the s+b fits converge for some signal mass pts...)
     if set_params:
         print('Obtaining postfit b-only parameter values...')
-        setParams = {}
-        f = ROOT.TFile.Open(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/fitDiagnosticsTest.root','READ')
-        fit_b = f.Get('fit_b')
-        fit_b_pars = fit_b.floatParsFinal()
-        for par in fit_b_pars:
-            setParams[f'{par.getTitle()}'] = f'{par.getVal()}'
-        f.Close()
+        setParams = fit_b_params(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/fitDiagnosticsTest.root')
+        if not setParams:
+            raise ValueError(f'No b-only fit result to take the parameter values from in {working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area')
     else:
         setParams={}
 
+    # Start the TF parameters from the b-only fit with lower-order (nested) TFs
+    if warm_start:
+        setParams = dict(warm_start_params(working_area, signal, SRtf, CRtf, *warm_start), **setParams)
+
+    # text2workspace only runs if the card changed since the last fit
+    workspace = compiled_workspace(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area')
+
+    # The explicit mcstats nuisances were dropped from the card, so make sure combine did apply autoMCStats
+    if autoMCStats is not None:
+        check_automcstats(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area/{workspace}')
+
     # now we can run the ML fit for this signal
-    twoD.MLfit('TprimeB-{}-SR{}-CR{}_area'.format(signal,SRtf,CRtf),rMin=rMin,rMax=rMax,setParams=setParams,verbosity=verbosity,defMinStrat=defMinStrat,extra=extra)
+    twoD.MLfit('TprimeB-{}-SR{}-CR{}_area'.format(signal,SRtf,CRtf),cardOrW=workspace,rMin=rMin,rMax=rMax,setParams=setParams,verbosity=verbosity,defMinStrat=defMinStrat,extra=extra)
+
+def fit_ladder(SRorCR='', signal='', SRtf='', CRtf='', ladder=FIT_LADDER, rMin=-1, rMax=10, verbosity=2, autoMCStats=None, force_card=False, warm_start=None, extra=''):
+    '''
+    test_fit with the rungs of the fit ladder (see fit_ladder.py) in turn, until one converges.
+    `extra` combine options are added to those of every rung. Returns the record of the rungs
+    tried, also written to fit_ladder.json in the area.
+    '''
+    area = '{}fits/TprimeB-{}-SR{}-CR{}_area'.format(SRorCR, signal, SRtf, CRtf)
+    def fit(rung):
+        # the card only needs to be (re)made once
+        first = rung is ladder[0]
+        test_fit(
+            SRorCR, signal, SRtf=SRtf, CRtf=CRtf,
+            defMinStrat=rung['strat'],
+            extra=f'{minimizer_algo(robustHesse=rung["robustHesse"])} --cminDefaultMinimizerTolerance {rung["tol"]} {extra}',
+            rMin=rMin, rMax=rMax, verbosity=verbosity,
+            set_params=rung['setParams'],
+            autoMCStats=autoMCStats,
+            force_card=force_card and first,
+            warm_start=warm_start
+        )
+    return run_ladder(fit, f'{area}/fitDiagnosticsTest.root', ladder, record=f'{area}/fit_ladder.json', skip_sb='--skipSBFit' in extra, fatal=(AutoMCStatsError,))
 
 def test_plot(SRorCR='', signal='', SRtf='', CRtf=''):
     working_area = '{}fits'.format(SRorCR)
@@ -292,8 +553,10 @@ def test_Impacts(SRorCR,signal='1800-125',SRtf='',CRtf='', rMin=-1, rMax=10, str
 def test_limits(SRorCR, signal, SRtf, CRtf):
     working_area = '{}fits'.format(SRorCR)
     twoD = TwoDAlphabet(working_area, '{}/runConfig.json'.format(working_area), loadPrevious=True)
+    workspace = compiled_workspace(f'{working_area}/TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area')
     twoD.Limit(
         subtag='TprimeB-{}-SR{}-CR{}_area'.format(signal, SRtf, CRtf),
+        card_or_w=workspace,
         blindData=False,        # BE SURE TO CHANGE THIS IF YOU NEED TO BLIND YOUR DATA
         verbosity=2,
         condor=False
@@ -309,7 +572,7 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('-w', type=str, dest='workspace',
                         action='store', default='jointSRttbarCR',
-                        help='workspace name')
+                        help='workspace name, "{sig}", "{MT}" and "{MPHI}" are replaced by the signal masses (e.g. shared_{MT}_)')
     parser.add_argument('-s', type=str, dest='sigmass',
                         action='store', default='1800-125',
                         help='mass of Tprime and Phi cand')
@@ -328,15 +591,36 @@ if __name__ == "__main__":
     parser.add_argument('--make', dest='make',
                         action='store_true', 
                         help='If passed as argument, create 2DAlphabet workspace')
+    parser.add_argument('--sharedSignals', type=str, dest='sharedSignals',
+                        action='store', default=None,
+                        help='With --make, build one shared workspace per distinct workspace name (see -w, e.g. shared_{MT}_) for the signals listed (one MT-MPHI per line) in this file')
+    parser.add_argument('--cache', dest='cache',
+                        action='store_true',
+                        help='With --make, read the selection files through the local xrootd cache (see xrdcache.py)')
+    parser.add_argument('--rpfBounds', type=float, dest='rpfBounds',
+                        action='store', default=None,
+                        help='With --make, bound the RPF parameters to +/- this many sigma of a fit to the initial pass/fail ratio, widened to contain the nested TFs (default: only start from the fitted values, with the fixed +/-500 bounds; 0: fixed constraints only)')
     parser.add_argument('--makeCard',dest='makeCard',
                         action='store_true',
                         help='Create and modify the combined SR+CR datacard')
+    parser.add_argument('--autoMCStats', type=float, dest='autoMCStats',
+                        action='store', default=None,
+                        help='With --makeCard/--fit, replace the explicit ttbar mcstats nuisances by combine autoMCStats lines with this event threshold (e.g. 10)')
+    parser.add_argument('--forceCard', dest='forceCard',
+                        action='store_true',
+                        help='Remake the card even if its inputs did not change')
     parser.add_argument('--fit', dest='fit',
                         action='store_true',
                         help='If passed as argument, fit with the given TFs')
     parser.add_argument('--setParams', dest='setParams',
                         action='store_true',
                         help='Uses the b-only parameter values in s+b fit (helps some signal s+b fits converge)')
+    parser.add_argument('--warmStart', type=str, nargs=2, dest='warmStart',
+                        action='store', default=None, metavar=('SRTF', 'CRTF'),
+                        help='Start the TF parameters of the fit from the b-only fit with these lower-order TFs, e.g. --warmStart 1x1 0x0')
+    parser.add_argument('--ladder', type=str, nargs='*', dest='ladder',
+                        action='store', default=None, metavar='RUNG',
+                        help='With --fit, try the rungs of the fit ladder (all, or only those given) until one converges, instead of a single fit with --strat/--tol (see fit_ladder.py)')
     parser.add_argument('--plot', dest='plot',
                         action='store_true',
                         help='If passed as argument, plot the result of the fit with the given TFs')
@@ -390,23 +674,39 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if args.make:
+    from run_grid import workspace_name
+    if args.make and args.sharedSignals:
+        with open(args.sharedSignals) as f:
+            signals = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        groups = {}
+        for sig in signals:
+            groups.setdefault(workspace_name(args.workspace, sig), []).append(sig)
+        for workspace, group in groups.items():
+            test_make_shared(workspace, group, json=args.json, cache=args.cache, rpf_nsigma=args.rpfBounds)
+    args.workspace = workspace_name(args.workspace, args.sigmass)
+    if args.make and not args.sharedSignals:
         MT   = args.sigmass.split('-')[0]
         MPHI = args.sigmass.split('-')[-1]
         fr = {'TprimeB-MT-MPHI':f'TprimeB-{MT}-{MPHI}'}
-        test_make(args.workspace, fr=fr, json=args.json)
+        test_make(args.workspace, fr=fr, json=args.json, cache=args.cache, rpf_nsigma=args.rpfBounds)
     if args.makeCard:
-        makeCard(SRorCR=args.workspace, signal=args.sigmass, SRtf=args.SRtf, CRtf=args.CRtf)
-    if args.fit:
-        if (args.robustFit) and (args.robustHesse):
-            raise ValueError('Cannot use both robustFit and robustHesse algorithms simultaneously') 
-        elif (args.robustFit) or (args.robustHesse):
-            if args.robustFit:
-                algo = f'--robustFit 1'
-            else:
-                algo = f'--robustHesse 1'
-        else:
-            algo = ''
+        makeCard(SRorCR=args.workspace, signal=args.sigmass, SRtf=args.SRtf, CRtf=args.CRtf, autoMCStats=args.autoMCStats, force=args.forceCard)
+    if args.fit and (args.ladder is not None):
+        fit_ladder(
+            args.workspace,
+            args.sigmass,
+            SRtf=args.SRtf,
+            CRtf=args.CRtf,
+            ladder=get_ladder(args.ladder),
+            rMin=args.rMin,
+            rMax=args.rMax,
+            verbosity=args.verbosity,
+            autoMCStats=args.autoMCStats,
+            force_card=args.forceCard,
+            warm_start=args.warmStart
+        )
+    elif args.fit:
+        algo = minimizer_algo(args.robustFit, args.robustHesse)
         test_fit(
             args.workspace, 
             args.sigmass, 
@@ -417,7 +717,10 @@ if __name__ == "__main__":
             rMin=args.rMin,
             rMax=args.rMax,
             verbosity=args.verbosity,
-            set_params=args.setParams
+            set_params=args.setParams,
+            autoMCStats=args.autoMCStats,
+            force_card=args.forceCard,
+            warm_start=args.warmStart
         )
     if args.plot:
         test_plot(args.workspace, args.sigmass, SRtf=args.SRtf, CRtf=args.CRtf)
@@ -446,27 +749,11 @@ if __name__ == "__main__":
         # )
         test_GoF_plot(args.workspace, args.sigmass, SRtf=args.SRtf, CRtf=args.CRtf, condor=args.condor)
     if args.inject:
-        if (args.robustFit) and (args.robustHesse):
-            raise ValueError('Cannot use both robustFit and robustHesse algorithms simultaneously')
-        elif (args.robustFit) or (args.robustHesse):
-            if args.robustFit:
-                algo = f'--robustFit 1'
-            else:
-                algo = f'--robustHesse 1'
-        else:
-            algo = ''
+        algo = minimizer_algo(args.robustFit, args.robustHesse)
         #test_SigInj(args.workspace, args.rinj, args.sigmass, args.SRtf, args.CRtf, condor=args.condor, rMin=args.rMin, rMax=args.rMax, strat=int(args.strat), extra=f'{algo} --cminDefaultMinimizerTolerance {args.tol}',set_params=args.setParams,scale_rpf=args.scaleRPF)
         test_SigInj_plot(args.workspace, args.rinj, args.sigmass, args.SRtf, args.CRtf, condor=args.condor)
     if args.impacts:
-        if (args.robustFit) and (args.robustHesse):
-            raise ValueError('Cannot use both robustFit and robustHesse algorithms simultaneously')
-        elif (args.robustFit) or (args.robustHesse):
-            if args.robustFit:
-                algo = f'--robustFit 1'
-            else:
-                algo = f'--robustHesse 1'
-        else:
-            algo = ''
+        algo = minimizer_algo(args.robustFit, args.robustHesse)
         test_Impacts(args.workspace, args.sigmass, args.SRtf, args.CRtf, rMin=args.rMin, rMax=args.rMax, strat=int(args.strat), extra=f'{algo} --cminDefaultMinimizerTolerance {args.tol}',blind=args.blind)
     if args.limit:
         test_limits(args.workspace, args.sigmass, args.SRtf, args.CRtf)
@@ -0,0 +1,205 @@
+'''
+Columnar store of the AsymptoticLimits results of all signals.
+
+The `limit` trees of all higgsCombine*AsymptoticLimits* files are read in parallel (with uproot if
+it is installed, otherwise with ROOT) into a single Parquet table, limits/limits.parquet, with one
+row per (MT, MPhi, quantile, withCR, scaling):
+    MT, MPhi    signal masses
+    quantile    combine's quantileExpected (0.025, 0.16, 0.5, 0.84, 0.975, and -1 for the observed limit)
+    entry       index of the entry in the limit tree (0-4: -2 to +2 sigma expected, 5: observed)
+    withCR      whether the limit was computed with the ttbar CR (otherwise the CR is masked, "noCR")
+    scaling     "raw": limit on sigma*B in fb, "tbqq": raw limit scaled by 1/B(t->bqq)
+    limit       limit in fb
+    r           limit on the signal strength, as stored by combine
+The rows are sorted by the key, so that reads filtered on it (see load()) only touch the row
+groups they need.
+
+Build the table from the current directory:
+    python limitstore.py [-j 16]
+'''
+import os, glob, hashlib
+import numpy as np
+import pandas as pd
+
+from run_grid import spawn_pool
+
+STORE = 'limits/limits.parquet'
+GRID_CACHE = 'limits/cache'
+PATTERN = '*_fits/higgsCombine*workspace*.AsymptoticLimits.*'
+
+# Entry of the limit tree -> label used in the file names and the summary tables
+LABELS  = {0: 'Minus2', 1: 'Minus1', 2: 'Expected', 3: 'Plus1', 4: 'Plus2', 5: 'Observed'}
+SUMMARY = {0: 'limit_m2', 1: 'limit_m1', 2: 'exp', 3: 'limit_p1', 4: 'limit_p2', 5: 'obs'}
+KEY     = ['withCR', 'scaling', 'entry', 'MT', 'MPhi']
+
+TBQQ_BR = 0.991 * 0.6732 # Wqq taken from https://arxiv.org/pdf/2201.07861
+
+def signal_norm(mx):
+    '''The input normalization is all in picobarns (1pb = 1000fb), so the limits are multiplied by the input cross section in fb'''
+    return 0.1 * (1000.) if mx < 1400 else 0.01 * (1000.)
+
+def mxmy(sample):
+    # Example input: 1000-100_unblind_fits/higgsCombine_1000-100_noCR_workspace.AsymptoticLimits.mH120.root
+    mX, mY = os.path.basename(sample).split('_')[1].split('-')
+    return (float(mX), float(mY))
+
+def _read_tree(sample):
+    '''(limit, quantileExpected) arrays of the limit tree, None if there is no such tree'''
+    try:
+        import uproot
+    except ImportError:
+        uproot = None
+    if uproot is not None:
+        with uproot.open(sample) as f:
+            if 'limit' not in f:
+                return None
+            arrays = f['limit'].arrays(['limit', 'quantileExpected'], library='np')
+            return arrays['limit'], arrays['quantileExpected']
+    import ROOT
+    f = ROOT.TFile.Open(sample, 'READ')
+    limTree = f.Get('limit') if f else None
+    if not limTree:
+        return None
+    limit, quantile = [], []
+    for i in range(limTree.GetEntries()):
+        limTree.GetEntry(i)
+        limit.append(limTree.limit)
+        quantile.append(limTree.quantileExpected)
+    f.Close()
+    return np.array(limit), np.array(quantile)
+
+def read_limits(sample):
+    '''Rows of the table for one limit file, and the list of problems found in it'''
+    mx, my = mxmy(sample)
+    withCR = 'noCR' not in sample
+    tree = _read_tree(sample)
+    if tree is None:
+        return [], [f'{mx}-{my}\t- No limit TTree']
+    limit, quantile = tree
+    rows, failed = [], []
+    for i in LABELS:
+        # Check if the limit exists
+        if i >= len(limit):
+            failed.append(f'{mx}-{my}\t- Missing limit entry {i}')
+            continue
+        raw = limit[i] * signal_norm(mx)
+        for scaling, value in [('raw', raw), ('tbqq', raw / TBQQ_BR)]:
+            rows.append({
+                'MT': mx, 'MPhi': my, 'quantile': float(quantile[i]), 'entry': i,
+                'withCR': withCR, 'scaling': scaling, 'limit': value, 'r': float(limit[i])
+            })
+    return rows, failed
+
+def harvest(pattern=PATTERN, out=STORE, workers=os.cpu_count(), failed_file='failed_limits.txt'):
+    '''Read all limit files matching `pattern` into the table `out`. Returns the table.'''
+    files = sorted(f for f in glob.glob(pattern) if 'workspace' in f)
+    print(f'Reading {len(files)} limit files')
+    with spawn_pool(workers, fresh=False) as pool:
+        results = list(pool.map(read_limits, files, chunksize=max(1, len(files)//(4*workers))))
+    rows, failed = [], []
+    for (r, fl) in results:
+        rows += r
+        failed += fl
+    with open(failed_file, 'w') as f:
+        for line in failed:
+            print(f'ERROR: {line}')
+            f.write(f'{line}\n')
+    df = pd.DataFrame(rows, columns=['MT', 'MPhi', 'quantile', 'entry', 'withCR', 'scaling', 'limit', 'r'])
+    df = df.sort_values(KEY).reset_index(drop=True)
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    tmp = out + '.tmp'
+    df.to_parquet(tmp, index=False, row_group_size=1024)
+    os.replace(tmp, out)
+    print(f'Wrote {len(df)} limits of {df[["MT","MPhi"]].drop_duplicates().shape[0]} signals to {out}')
+    return df
+
+def load(store=STORE, columns=None, **selection):
+    '''
+    Read the rows of the table matching `selection`, e.g. load(withCR=False, scaling='raw', MPhi=125.).
+    A list value selects any of its elements. The selection is pushed down to the Parquet reader.
+    '''
+    filters = [(k, 'in', list(v)) if isinstance(v, (list, tuple, set)) else (k, '==', v) for k, v in selection.items()]
+    return pd.read_parquet(store, columns=columns, filters=filters or None)
+
+def load_entries(store=STORE, withCR=False, scaling='raw', **selection):
+    '''
+    {entry: DataFrame with columns MTprime, MPhi, "Limit (fb)"} sorted by (MTprime, MPhi), i.e. the
+    contents of the former limits/limits_<label>_<withCR|noCR>.csv files.
+    '''
+    df = load(store, columns=['MT', 'MPhi', 'entry', 'limit'], withCR=withCR, scaling=scaling, **selection)
+    df = df.rename(columns={'MT': 'MTprime', 'limit': 'Limit (fb)'})
+    return {i: df[df['entry'] == i].drop(columns='entry').sort_values(by=['MTprime','MPhi']).reset_index(drop=True) for i in LABELS}
+
+def summary(store=STORE, withCR=False, factor=1.0):
+    '''One row per signal with the six raw limits (times `factor`), as in limits/summary_limits_B2G-22-001*.csv'''
+    df = load(store, columns=['MT', 'MPhi', 'entry', 'limit'], withCR=withCR, scaling='raw')
+    df = df.pivot_table(index=['MT', 'MPhi'], columns='entry', values='limit').reset_index()
+    df = df.rename(columns=dict(SUMMARY, MT='MTprime'))
+    df.columns.name = None
+    for col in SUMMARY.values():
+        df[col] = df[col] * factor
+    return df[['MTprime', 'MPhi'] + [SUMMARY[k] for k in [3,4,1,0,2,5]]]
+
+def _sha(*arrays):
+    h = hashlib.sha256()
+    for a in arrays:
+        h.update(a if isinstance(a, bytes) else np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+def interpolate_grids(xx, yy, store=STORE, withCR=False, scalings=('raw','tbqq'), cache_dir=GRID_CACHE):
+    '''
+    Limits interpolated (linearly in log(limit)) on the (MT, MPhi) grid `xx`, `yy`, as
+    {scaling: {entry: grid}}. The Delaunay triangulation of the signal points is built once and all
+    columns (entries and scalings) are interpolated in one call, only columns with a different set
+    of available signals get their own triangulation. The grids are cached in `cache_dir`, keyed on
+    the contents of the table and the grid, so re-plotting does not recompute them.
+    '''
+    from scipy.spatial import Delaunay
+    from scipy.interpolate import LinearNDInterpolator
+    with open(store, 'rb') as f:
+        table = hashlib.sha256(f.read()).hexdigest()
+    key = _sha(table.encode(), repr((withCR, list(scalings))).encode(), xx, yy, np.array(xx.shape))
+    cache = os.path.join(cache_dir, f'grids_{key[:16]}.npz')
+    names = [(scaling, entry) for scaling in scalings for entry in LABELS]
+    if os.path.exists(cache):
+        with np.load(cache) as f:
+            return {scaling: {entry: f[f'{scaling}_{entry}'] for entry in LABELS} for scaling in scalings}
+
+    df = load(store, columns=['MT', 'MPhi', 'entry', 'scaling', 'limit'], withCR=withCR, scaling=list(scalings))
+    wide = df.pivot(index=['MT', 'MPhi'], columns=['scaling', 'entry'], values='limit').reindex(columns=names)
+    points = wide.index.to_frame().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.log(wide.values)
+    available = ~np.isnan(wide.values)
+    out = {}
+    # One triangulation per distinct set of available signals, normally a single one for all columns
+    patterns = {}
+    for col in range(len(names)):
+        patterns.setdefault(available[:, col].tobytes(), []).append(col)
+    for pattern, cols in patterns.items():
+        rows = np.frombuffer(pattern, dtype=bool)
+        tri = Delaunay(points[rows])
+        grids = np.exp(LinearNDInterpolator(tri, logs[np.ix_(rows, cols)])(xx, yy))
+        for k, col in enumerate(cols):
+            out[names[col]] = grids[..., k]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = cache.replace('.npz', '.tmp.npz')
+    np.savez(tmp, **{f'{scaling}_{entry}': grid for (scaling, entry), grid in out.items()})
+    os.replace(tmp, cache)
+    return {scaling: {entry: out[(scaling, entry)] for entry in LABELS} for scaling in scalings}
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--pattern', type=str, dest='pattern',
+                        action='store', default=PATTERN,
+                        help='Glob pattern of the limit files')
+    parser.add_argument('-o', type=str, dest='out',
+                        action='store', default=STORE,
+                        help='Output Parquet file')
+    parser.add_argument('-j', type=int, dest='workers',
+                        action='store', default=os.cpu_count(),
+                        help='Number of worker processes')
+    args = parser.parse_args()
+    harvest(args.pattern, args.out, args.workers)
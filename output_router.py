@@ -0,0 +1,79 @@
+'''
+In-process routing of output files to their destinations, replacing one `mv` subprocess per file.
+
+Moves are queued with add() and done in one go by run(): the destination directories are created
+once each, every file is moved with os.replace (shutil.move across filesystems), and missing
+sources or failed moves are collected instead of stopping the whole batch.
+
+Usage:
+    from output_router import OutputRouter
+    router = OutputRouter(dry_run=False)
+    router.add('card_1800-125.txt', '1800-125_unblind_fits/')
+    router.run()
+    router.summary()
+'''
+import os, shutil, errno
+
+class OutputRouter:
+    def __init__(self, dry_run=False, verbose=False):
+        self.dry_run = dry_run
+        self.verbose = verbose
+        self.queue   = []
+        self.moved   = []
+        self.failed  = []
+        self.missing = []
+
+    def add(self, src, dest):
+        '''
+        Queue moving `src` to `dest`. A `dest` ending in "/" (or an existing directory) is a
+        directory which keeps the file name, as with `mv`.
+        '''
+        if dest.endswith('/') or os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        self.queue.append((src, dest))
+
+    def _move(self, src, dest):
+        try:
+            os.replace(src, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(src, dest)
+
+    def run(self):
+        '''Do all queued moves. Returns the (src, dest) pairs which were moved.'''
+        queue, self.queue = self.queue, []
+        present = []
+        for src, dest in queue:
+            if os.path.exists(src):
+                present.append((src, dest))
+            else:
+                self.missing.append(src)
+        dirs = {os.path.dirname(dest) for _, dest in present} - {''}
+        if not self.dry_run:
+            for d in dirs:
+                os.makedirs(d, exist_ok=True)
+        moved = []
+        for src, dest in present:
+            if self.dry_run or self.verbose:
+                print(f'{"(dry run) " if self.dry_run else ""}{src} -> {dest}')
+            if self.dry_run:
+                moved.append((src, dest))
+                continue
+            try:
+                self._move(src, dest)
+                moved.append((src, dest))
+            except OSError as e:
+                print(f'ERROR: could not move {src} to {dest} ({e})')
+                self.failed.append(src)
+        self.moved += moved
+        return moved
+
+    def summary(self):
+        '''Print and return the number of moved, failed and missing files'''
+        counts = {'moved': len(self.moved), 'failed': len(self.failed), 'missing': len(self.missing)}
+        print(f'{"Would move" if self.dry_run else "Moved"} {counts["moved"]} files, {counts["failed"]} failed, {counts["missing"]} missing')
+        for name in ['failed', 'missing']:
+            for src in getattr(self, name):
+                print(f'    {name}: {src}')
+        return counts
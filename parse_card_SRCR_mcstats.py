@@ -2,8 +2,250 @@
 Script to parse a Combine data card and remove systematics from certain regions for certain processes.
 '''
 from collections import OrderedDict 
+import os
+from itertools import chain
+import numpy as np
 
-def parse_card(card):
+# Bump whenever the rules below change the output, so that existing cards get remade (see jointSRttbarCR.build_card)
+PARSE_CARD_VERSION = 3
+
+# 2DAlphabet uses 120-character-long strings of "-" to delineate regions of the card.
+DELIMITER = '-'*120
+
+# Regions and channels in which ttbar gets MC statistical uncertainties, and the years of the ttbar processes
+MCSTATS_REGIONS  = ['SR_pass', 'ttbarCR_pass']
+MCSTATS_CHANNELS = ['LOW', 'SIG', 'HIGH']
+YEARS = ['16', '16APV', '17', '18']
+# SR_pass bins with a ttbar sum of weights 0 < nom <= this got explicit mcstats nuisances (autoMCstats/generate_autoMCstats.py)
+MCSTATS_NOM_MAX = 20.
+
+def _is_modified(line):
+    '''Nuisance lines which need to be restricted to certain regions'''
+    return ('mcstats' in line) or ('DAK8Top_tag' in line) or ('PNetXbb_mistag' in line)
+
+class CardColumns:
+    '''
+    Column-indexed view of the bin/process header of a 2DAlphabet card.
+
+    The header is parsed once into boolean masks over the columns, and every nuisance line is 
+    rewritten with whole-array operations on those masks. Column 0 holds the "bin"/"process" 
+    labels, so column i of the header corresponds to token i+1 of a nuisance line (the extra 
+    token being the nuisance type, e.g. "shape").
+    '''
+    def __init__(self, bins, procs):
+        self.bins  = bins
+        self.procs = procs
+        b = np.array(bins.split())
+        p = np.array(procs.split())
+        if len(p) < len(b):
+            raise IndexError(f'Card header has {len(b)} bins but only {len(p)} processes')
+        p = p[:len(b)]
+        # Background columns are just the QCD estimate and are never touched
+        self.ttbar   = (np.arange(len(b)) > 0) & self._has(p, 'ttbar_') & ~self._has(p, 'Background')
+        self.SR_pass = self._has(b, 'SR_pass')
+        self.CR_pass = self._has(b, 'CR_pass')
+        self.SR      = self._has(b, 'SR')
+        self.CR      = self._has(b, 'CR')
+        self._rules  = {}
+
+    @staticmethod
+    def _has(arr, s):
+        return np.char.find(arr, s) >= 0
+
+    def kind(self, line, name):
+        '''Which masking rule applies to a nuisance line. Rules only depend on the nuisance name.'''
+        if 'mcstats' in line:
+            return ('mcstats', 'SR_pass' in name, 'CR_pass' in name)
+        elif 'DAK8' in line:
+            return ('DAK8',)
+        elif 'Xbb' in line:
+            return ('Xbb',)
+        return (None,)
+
+    def rule(self, kind):
+        '''
+        Returns the indices (into the tokens following the nuisance name) which must be "1.0", the 
+        indices to set to "-", and the number of "1.0" entries expected in the rewritten line. 
+        Built once per kind of nuisance.
+        '''
+        if kind not in self._rules:
+            if kind[0] == 'mcstats':
+                # SR-specific mcstats params stay in SR_pass only and CR-specific ones in ttbarCR_pass only.
+                # Should be 12 left over (SR or CR_pass_LOW/SIG/HIGH * 4 years)
+                keep = (self.SR_pass & kind[1]) | (~self.SR_pass & self.CR_pass & kind[2])
+                checked, dropped, expected = self.ttbar, self.ttbar & ~keep, 12
+            elif kind[0] == 'DAK8':
+                # DAK8 top tagging is only used in the ttbarCR, remove it from the SR.
+                # Should be 24 left over (2 tagging regions fail/pass) * (3 masks LOW/SIG/HIGH) * (ttbar for 4 years)
+                checked = dropped = self.ttbar & self.SR
+                expected = 24
+            elif kind[0] == 'Xbb':
+                # PNet Xbb mistagging is only used in the SR, remove it from the ttbarCR. Again 24 left over.
+                checked = dropped = self.ttbar & self.CR
+                expected = 24
+            else:
+                checked = dropped = np.zeros_like(self.ttbar)
+                expected = None
+            self._rules[kind] = (np.flatnonzero(checked), np.flatnonzero(dropped), expected)
+        return self._rules[kind]
+
+    def rewrite(self, lines):
+        '''
+        Rewrite a block of nuisance lines, returning them formatted as 2DAlphabet does. Lines of the 
+        same kind and length are stacked into one 2D array so the masks are applied to the whole block.
+        '''
+        out = [None]*len(lines)
+        groups = OrderedDict()
+        for n, line in enumerate(lines):
+            tokens = line.split()
+            groups.setdefault((self.kind(line, tokens[0]), len(tokens)), []).append((n, tokens))
+        for (kind, ntokens), rows in groups.items():
+            checked, dropped, expected = self.rule(kind)
+            # The nuisance names are kept out of the array, the masks act on everything after them
+            names = [tokens[0] for _, tokens in rows]
+            arr = np.array(list(chain.from_iterable(tokens[1:] for _, tokens in rows))).reshape(len(rows), ntokens-1)
+            assert (arr[:, checked] == '1.0').all()
+            arr[:, dropped] = '-'
+            if expected is not None:
+                assert ((arr == '1.0').sum(axis=1) == expected).all()
+            for (n, _), line in zip(rows, _format_rows(names, arr)):
+                out[n] = line
+        return out
+
+def _format_rows(names, values):
+    '''
+    Format nuisance lines as 2DAlphabet does, i.e. every token left-justified in a 20-character 
+    column followed by a space. Values which fit in the column are padded in bulk by widening the 
+    array and replacing the NUL padding of the UCS4 buffer with spaces.
+    '''
+    names = [f'{name:20} ' for name in names]
+    if values.dtype.itemsize // 4 > 20:
+        return [name + ''.join(f'{v:20} ' for v in row) for name, row in zip(names, values.tolist())]
+    codes = values.astype('<U21').view(np.uint32)
+    codes[codes == 0] = ord(' ')
+    text = codes.tobytes().decode('utf-32-le')
+    width = 21*values.shape[1]
+    return [name + text[k*width:(k+1)*width] for k, name in enumerate(names)]
+
+def select_mcstats(region, nom, nom_max=MCSTATS_NOM_MAX):
+    '''
+    Mask of the bins of `region` which get a ttbar MC statistical uncertainty. Same rule as in
+    autoMCstats/generate_autoMCstats.py: SR_pass bins with 0 < nom <= nom_max and all ttbarCR_pass bins.
+    '''
+    if 'pass' not in region:
+        return np.zeros(nom.shape, dtype=bool)
+    if 'SR' in region:
+        return (nom <= nom_max) & (nom > 0.0)
+    return np.ones(nom.shape, dtype=bool)
+
+def automcstats_channels(hists, nom_max=MCSTATS_NOM_MAX, process='ttbar', years=YEARS):
+    '''
+    Derive the channels of the combined card which get an autoMCStats line from the ttbar
+    sum-of-weights in 2DAlphabet's organized_hists.root (`hists`). A channel is kept if any of its
+    bins would have had an explicit mcstats nuisance in any year (see select_mcstats). This selection
+    is independent of combine's autoMCStats event threshold. Returns {channel: number of such bins}.
+    '''
+    import ROOT
+    f = ROOT.TFile.Open(hists, 'READ')
+    if (not f) or f.IsZombie():
+        raise FileNotFoundError(f'ERROR: file {hists} could not be opened...')
+    channels = OrderedDict()
+    for region in MCSTATS_REGIONS:
+        for channel in MCSTATS_CHANNELS:
+            selected = None
+            for year in years:
+                h = f.Get(f'{process}_{year}_{region}_{channel}')
+                if not h:
+                    raise KeyError(f'{process}_{year}_{region}_{channel} not found in {hists}')
+                nom = np.array([[h.GetBinContent(i,j) for j in range(1,h.GetNbinsY()+1)] for i in range(1,h.GetNbinsX()+1)])
+                sel = select_mcstats(region, nom, nom_max)
+                selected = sel if selected is None else (selected | sel)
+            if selected.any():
+                channels[f'{region}_{channel}'] = int(selected.sum())
+    f.Close()
+    return channels
+
+def parse_card(card, out='card_new.txt', debug='DEBUG.txt', blocksize=1024, automcstats=None, channels=None):
+    '''
+    Stream the 2DAlphabet card in `card` to `out`, restricting the mcstats, DAK8 top tagging and 
+    PNet Xbb mistagging nuisances to the regions where they apply. Consecutive nuisance lines are 
+    rewritten in blocks of up to `blocksize` lines. The old/new version of every modified line is 
+    written to `debug`. Both outputs are only put in place once the whole card has been processed, 
+    so a failed assertion never leaves a half-written card behind.
+
+    If a threshold `automcstats` is given, the explicit mcstats nuisances are dropped instead and 
+    an "<channel> autoMCStats <threshold>" line is added for each of `channels` (by default all 
+    SR_pass and ttbarCR_pass channels of the card), so that combine's Barlow-Beeston-lite treatment 
+    is used for the MC statistical uncertainties.
+    '''
+    columns = None
+    pending = []        # lines read before the bin/process header is known
+    header  = None      # index in `pending` of the bin line
+    block   = []        # consecutive nuisance lines waiting to be rewritten
+    ndelim  = 0
+    try:
+        with open(card,'r') as f, open(out+'.tmp','w') as fnew, open(debug+'.tmp','w') as fdebug:
+            def flush():
+                for old, new in zip(block, columns.rewrite(block)):
+                    fnew.write(f'{new}\n')
+                    fdebug.write(f'\n{old}\n{new}\n')
+                block.clear()
+
+            def emit(line):
+                if (automcstats is not None) and ('mcstats' in line):
+                    flush()
+                    fdebug.write(f'\n{line}\n(removed)\n')
+                elif _is_modified(line):
+                    block.append(line)
+                    if len(block) >= blocksize:
+                        flush()
+                else:
+                    flush()
+                    fnew.write(f'{line}\n')
+
+            for line in f:
+                line = line.strip()
+                if columns is not None:
+                    emit(line)
+                    continue
+                pending.append(line)
+                if line == DELIMITER:
+                    ndelim += 1
+                    # The bin and processes information will be on the two lines following the 3rd delineation
+                    if ndelim == 3:
+                        header = len(pending)
+                if (header is not None) and (len(pending) == header + 2):
+                    columns = CardColumns(pending[header], pending[header+1])
+                    fdebug.write(f'{DELIMITER}\n{columns.bins}\n{columns.procs}\n{DELIMITER}\n')
+                    for l in pending:
+                        emit(l)
+                    pending = None
+            if columns is None:
+                raise ValueError(f'Card {card} does not contain a bin/process header')
+            flush()
+            if automcstats is not None:
+                for line in _automcstats_lines(columns, automcstats, channels):
+                    fnew.write(f'{line}\n')
+                    fdebug.write(f'\n(added)\n{line}\n')
+    except:
+        for tmp in [out+'.tmp', debug+'.tmp']:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    os.replace(out+'.tmp', out)
+    os.replace(debug+'.tmp', debug)
+
+def _automcstats_lines(columns, threshold, channels=None):
+    bins = list(dict.fromkeys(columns.bins.split()[1:]))
+    if channels is None:
+        channels = [b for b in bins if any(region in b for region in MCSTATS_REGIONS)]
+    missing = [c for c in channels if c not in bins]
+    if missing:
+        raise ValueError(f'autoMCStats channels {missing} are not in the card')
+    return [f'{channel} autoMCStats {threshold:g}' for channel in channels]
+
+def parse_card_legacy(card):
+    '''Original line-by-line implementation, kept as the reference for validating parse_card()'''
     f = open(card,'r')
     lines = [i.strip() for i in f.readlines()]
     newlines = lines.copy()
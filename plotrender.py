@@ -0,0 +1,127 @@
+'''
+Batch rendering of matplotlib figures.
+
+A plot is described declaratively by plot(): a function which draws the figure and returns it, its
+arguments, the output path without extension and the formats to save. render() then draws every
+figure once, saves it in all its formats, and spreads independent figures over a pool of worker
+processes using the Agg backend.
+
+Every plot is identified by a hash of its drawing function, the source code of the whole module
+defining it (so that the helpers and style globals it uses are covered), the matplotlib rcParams
+at render time (the mplhep/rcParams style set up by the calling script), its arguments and its
+formats. Other modules or files the drawing depends on can be declared with `depends`. The hashes
+of the plots already rendered are kept in a manifest, and a plot whose hash did not change and whose
+outputs all exist is skipped. Changing a drawing function or its arguments therefore only
+re-renders those figures, and changing the script or the global style re-renders all of its figures.
+
+Usage:
+    from plotrender import plot, render
+    plots = [plot(colormesh, f'plots/limit2D_{q}', xx, yy, grids[q], label=q) for q in grids]
+    render(plots, workers=8)
+'''
+import os, json, pickle, hashlib, inspect, time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FORMATS  = ['pdf', 'png']
+SAVEFIG  = {'bbox_inches': 'tight'}
+MANIFEST = 'plots/.render_manifest.json'
+
+def plot(func, stem, *args, formats=FORMATS, savefig={}, depends=[], **kwargs):
+    '''
+    A figure drawn by func(*args, **kwargs), saved to <stem>.<format> for each of `formats`.
+    `depends`: modules or file paths, besides the module of func, which the drawing depends on.
+    '''
+    return {'func': func, 'stem': stem, 'args': args, 'kwargs': kwargs, 'formats': list(formats), 'savefig': dict(SAVEFIG, **savefig), 'depends': list(depends)}
+
+def outputs(p):
+    return [f'{p["stem"]}.{ext}' for ext in p['formats']]
+
+def _source(obj):
+    '''Source code of a module or function, or contents of a file'''
+    if isinstance(obj, str):
+        with open(obj, 'rb') as f:
+            return f.read().decode(errors='replace')
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return ''
+
+def _style():
+    '''The current matplotlib rcParams (without the backend, which render sets itself)'''
+    import matplotlib
+    return repr(sorted((k, v) for k, v in matplotlib.rcParams.items() if k != 'backend'))
+
+def plot_hash(p, style=None):
+    '''Hash of everything which determines the output of a plot'''
+    func = p['func']
+    h = hashlib.sha256()
+    h.update(f'{func.__module__}.{func.__qualname__}\0{_source(func)}'.encode())
+    for dep in [inspect.getmodule(func)] + p.get('depends', []):
+        h.update(f'\0{_source(dep)}'.encode())
+    h.update(f'\0{_style() if style is None else style}'.encode())
+    h.update(pickle.dumps((p['args'], sorted(p['kwargs'].items()), p['formats'], sorted(p['savefig'].items())), protocol=4))
+    return h.hexdigest()
+
+def draw(p):
+    '''Draw one plot and save it in all of its formats'''
+    import matplotlib.pyplot as plt
+    start = time.time()
+    fig = p['func'](*p['args'], **p['kwargs'])
+    os.makedirs(os.path.dirname(p['stem']) or '.', exist_ok=True)
+    for out in outputs(p):
+        fig.savefig(out, **p['savefig'])
+    plt.close(fig)
+    return time.time() - start
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _load_manifest(manifest):
+    if manifest and os.path.exists(manifest):
+        with open(manifest) as f:
+            return json.load(f)
+    return {}
+
+def _write_manifest(manifest, done):
+    os.makedirs(os.path.dirname(manifest) or '.', exist_ok=True)
+    with open(manifest+'.tmp', 'w') as f:
+        json.dump(done, f, indent=1, sort_keys=True)
+    os.replace(manifest+'.tmp', manifest)
+
+def render(plots, workers=os.cpu_count(), manifest=MANIFEST, force=False):
+    '''
+    Render the plots which changed since they were last rendered (all of them with `force`).
+    Returns the number of rendered and skipped plots.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    done = _load_manifest(manifest)
+    style = _style()
+    todo = []
+    for p in plots:
+        key = plot_hash(p, style)
+        if (not force) and (done.get(p['stem']) == key) and all(os.path.exists(out) for out in outputs(p)):
+            continue
+        todo.append((p, key))
+    print(f'Rendering {len(todo)} of {len(plots)} plots ({len(plots)-len(todo)} unchanged)')
+    if workers <= 1 or len(todo) <= 1:
+        for p, key in todo:
+            draw(p)
+            done[p['stem']] = key
+    else:
+        # fork, so that the workers inherit the drawing functions and the style set up by the calling script
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=ctx, initializer=_init_worker) as pool:
+            futures = {pool.submit(draw, p): (p, key) for p, key in todo}
+            for future in as_completed(futures):
+                p, key = futures[future]
+                try:
+                    future.result()
+                    done[p['stem']] = key
+                except Exception as e:
+                    print(f'ERROR: could not render {p["stem"]} ({e!r})')
+    if manifest:
+        _write_manifest(manifest, done)
+    return len(todo), len(plots) - len(todo)
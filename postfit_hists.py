@@ -0,0 +1,97 @@
+'''
+Full 2D postfit histograms, stitched from the LOW/SIG/HIGH channels of a PostFitShapesFromWorkspace
+(or FitDiagnostics) output.
+
+The three channels share the Y binning and follow each other in X, so their bin arrays (see
+PyHist.hist2array) are concatenated along X in NumPy and written into the merged TH2F in one go,
+instead of one SetBinContent/SetBinError call per bin. The input files are opened once per run and
+kept open, so reading all processes and regions of a signal does not reopen the file each time.
+
+Usage (from a script in a subdirectory):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from postfit_hists import get_hists
+    histos = get_hists('1800-125_unblind_fits/postfitshapes_b.root', 'SR_pass', ['data_obs','TotalBkg'])
+'''
+import numpy as np
+import ROOT
+
+from PyHist import hist2array, axis_edges
+
+CHANNELS = ['LOW', 'SIG', 'HIGH']
+# Path of a channel histogram in PostFitShapesFromWorkspace output. For FitDiagnostics output, use
+# e.g. 'shapes_{status}/{region}_{channel}/{process}' with status 'prefit' or 'fit_b'.
+POSTFIT_PATH = '{region}_{channel}_{status}/{process}'
+
+_files = {}
+
+def open_file(file):
+    '''The TFile `file`, opened on first use and kept open for the rest of the run'''
+    f = _files.get(file)
+    if (f is None) or (not f.IsOpen()):
+        f = ROOT.TFile.Open(file)
+        if (not f) or f.IsZombie():
+            raise FileNotFoundError(f"The file '{file}' does not exist or cannot be opened.")
+        _files[file] = f
+    return f
+
+def close_files():
+    for f in _files.values():
+        f.Close()
+    _files.clear()
+
+def merge_low_sig_high(hLow,hSig,hHigh,hName="temp"):
+    '''TH2F with the bins of hLow, hSig and hHigh side by side in X (the under/overflow bins are left empty)'''
+    parts = [hist2array(h, return_errors=True) for h in (hLow, hSig, hHigh)]
+    contents = np.concatenate([c for c, _ in parts], axis=1)
+    errors   = np.concatenate([e for _, e in parts], axis=1)
+    n_y, n_x = contents.shape
+    #low edge of overflow is high edge of last bin
+    bins_x = np.concatenate([axis_edges(hLow.GetXaxis())[:-1], axis_edges(hSig.GetXaxis())[:-1], axis_edges(hHigh.GetXaxis())])
+    bins_y = axis_edges(hLow.GetYaxis()) #assumes Y bins are the same
+    h_res = ROOT.TH2F(hName,"",n_x,bins_x,n_y,bins_y)
+    h_res.Sumw2()
+    shape = (n_y+2, n_x+2)
+    np.ndarray(shape, dtype=np.float32, buffer=h_res.GetArray())[1:-1, 1:-1] = contents
+    np.ndarray(shape, dtype=np.float64, buffer=h_res.GetSumw2().GetArray())[1:-1, 1:-1] = errors**2
+    h_res.ResetStats()
+    return h_res
+
+def merge_low_sig_high_legacy(hLow,hSig,hHigh,hName="temp"):
+    '''Original bin-by-bin implementation, kept for scripts/benchmark_merge_low_sig_high.py'''
+    n_x_low     = hLow.GetNbinsX()
+    n_x_sig     = hSig.GetNbinsX()
+    n_x_high    = hHigh.GetNbinsX()
+    n_x         = n_x_low + n_x_sig + n_x_high
+    n_y         = hLow.GetNbinsY()#assumes Y bins are the same
+    bins_x      = [hLow.GetXaxis().GetBinLowEdge(i) for i in range(1,n_x_low+1)]
+    bins_x     += [hSig.GetXaxis().GetBinLowEdge(i) for i in range(1,n_x_sig+1)]
+    bins_x     += [hHigh.GetXaxis().GetBinLowEdge(i) for i in range(1,n_x_high+2)]
+    bins_x      = np.array(bins_x,dtype='float64')
+    bins_y      = np.array([hLow.GetYaxis().GetBinLowEdge(i) for i in range(1,n_y+2)],dtype='float64')
+    h_res       = ROOT.TH2F(hName,"",n_x,bins_x,n_y,bins_y)
+    for offset, h in [(0, hLow), (n_x_low, hSig), (n_x_low+n_x_sig, hHigh)]:
+        for i in range(1,h.GetNbinsX()+1):
+            for j in range(1,n_y+1):
+                h_res.SetBinContent(i+offset,j,h.GetBinContent(i,j))
+                h_res.SetBinError(i+offset,j,h.GetBinError(i,j))
+    return h_res
+
+def get2DPostfitPlot(file, process, region, prefit=False, path=POSTFIT_PATH):
+    f = open_file(file)
+    fitStatus = "prefit" if prefit else "postfit"
+    hists = []
+    for channel in CHANNELS:
+        name = path.format(region=region, channel=channel, status=fitStatus, process=process)
+        h = f.Get(name)
+        if not h:
+            raise ValueError(f"Histogram '{name}' does not exist in the file '{file}'.")
+        hists.append(h)
+    h2 = merge_low_sig_high(*hists, hName=f"h2_{process}_{region}")
+    h2.SetDirectory(0)
+    return h2
+
+def get_hists(input_file,region,processes,prefit=False,path=POSTFIT_PATH):
+    histos_region_dict = {}
+    for process in processes:
+        histos_region_dict[process] = get2DPostfitPlot(input_file,process,region,prefit,path)
+    return histos_region_dict
@@ -0,0 +1,137 @@
+'''
+Data-driven starting values and bounds of the RPF (transfer function) parameters.
+
+The pass/fail ratio of the initial QCD estimates (data minus the other backgrounds, as returned by
+TwoDAlphabet.InitQCDHists) is computed per bin and every form of _rpf_options is fitted to it by
+weighted least squares, in the x and y coordinates of the ParametricFunction, i.e. the bin centers
+normalized to [0, 1]. The forms are products of an x and a y polynomial, so they are fitted by
+alternating linear least squares with the constant of the y polynomial fixed to one (the product is
+otherwise degenerate in the relative scale of the two polynomials). The constraints of each
+parameter are then NOM = the fitted value, MIN/MAX = NOM -/+ nsigma standard deviations, from the
+covariance of the fit scaled by chi2/ndf if that is above one. A width of at least `floor` times the
+typical size of the coefficients of the polynomial (the mean ratio for the polynomial carrying the
+normalization, one for the other) is kept, so that no parameter is effectively frozen.
+
+The box of each form is finally widened to contain every form nested in it, over the whole box of
+the nested form (see contain_nested), so that the lower-order TFs stay reachable: the F-tests and
+warm starts of tf_scan.py rely on the higher-order TF being able to reproduce them.
+
+Forms without an x/y layout in _rpf_options (2x2) keep their default constraints.
+'''
+import itertools
+import numpy as np
+
+from PyHist import hist2array, axis_edges
+
+def _normalized_centers(edges):
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    return (centers - edges[0]) / (edges[-1] - edges[0])
+
+def ratio(fail, passing):
+    '''(x, y, R, sigma_R) of the bins of two TH2 with positive contents in both, x and y normalized to [0, 1]'''
+    f, ef = hist2array(fail, return_errors=True)
+    p, ep = hist2array(passing, return_errors=True)
+    x = _normalized_centers(axis_edges(fail.GetXaxis()))
+    y = _normalized_centers(axis_edges(fail.GetYaxis()))
+    xx, yy = np.meshgrid(x, y)
+    ok = (f > 0) & (p > 0)
+    R = p[ok] / f[ok]
+    sigma = R * np.sqrt((ep[ok]/p[ok])**2 + (ef[ok]/f[ok])**2)
+    ok_sigma = sigma > 0
+    return xx[ok][ok_sigma], yy[ok][ok_sigma], R[ok_sigma], sigma[ok_sigma]
+
+def _vander(v, indices):
+    return np.vander(v, len(indices), increasing=True)
+
+def fit_form(opt, x, y, R, sigma, iterations=100, tol=1e-10):
+    '''
+    Weighted least-squares fit of the form with layout opt['x'], opt['y'] to the ratio R(x, y).
+    Returns ({index: value}, {index: standard deviation}, chi2/ndf), the constant of the y
+    polynomial of a form with both polynomials being fixed to one (standard deviation zero).
+    '''
+    w = 1. / sigma
+    Vx, Vy = _vander(x, opt['x']), _vander(y, opt['y'])
+    values, errors = {}, {}
+    if (not opt['x']) or (not opt['y']):
+        # A single polynomial: linear least squares
+        V, indices = (Vy, opt['y']) if not opt['x'] else (Vx, opt['x'])
+        coeffs, *_ = np.linalg.lstsq(V * w[:, None], R * w, rcond=None)
+        J = V
+        model = V @ coeffs
+        fitted = list(indices)
+    else:
+        # P(x) * (1 + q_1 y + ...): alternate between the linear problems in P and in q
+        q = np.zeros(len(opt['y'])); q[0] = 1.
+        for _ in range(iterations):
+            Q = Vy @ q
+            p, *_ = np.linalg.lstsq(Vx * (Q * w)[:, None], R * w, rcond=None)
+            P = Vx @ p
+            q_new = q.copy()
+            if len(q) > 1:
+                q_new[1:], *_ = np.linalg.lstsq(Vy[:, 1:] * (P * w)[:, None], (R - P) * w, rcond=None)
+            converged = np.max(np.abs(q_new - q)) < tol
+            q = q_new
+            if converged:
+                break
+        Q, P = Vy @ q, Vx @ p
+        coeffs = np.concatenate([p, q[1:]])
+        J = np.hstack([Vx * Q[:, None], Vy[:, 1:] * P[:, None]])
+        model = P * Q
+        fitted = list(opt['x']) + list(opt['y'][1:])
+        values[opt['y'][0]], errors[opt['y'][0]] = 1., 0.
+    ndf = max(len(R) - len(coeffs), 1)
+    chi2_ndf = np.sum(((R - model) * w)**2) / ndf
+    cov = np.linalg.pinv((J * w[:, None]).T @ (J * w[:, None])) * max(chi2_ndf, 1.)
+    for k, i in enumerate(fitted):
+        values[i], errors[i] = float(coeffs[k]), float(np.sqrt(max(cov[k, k], 0.)))
+    return values, errors, chi2_ndf
+
+def constraints(opt, x, y, R, sigma, nsigma=5., floor=0.1):
+    '''ParametricFunction constraints {index: {"NOM", "MIN", "MAX"}} of a form, None if it has no x/y layout'''
+    if opt.get('x') is None:
+        return None
+    values, errors, chi2_ndf = fit_form(opt, x, y, R, sigma)
+    scale = float(np.mean(R))
+    # Typical size of the coefficients: the normalization is carried by the x polynomial if there is one
+    norm = opt['x'] if opt['x'] else opt['y']
+    out = {}
+    for i in sorted(values):
+        width = max(nsigma * errors[i], floor * (scale if i in norm else 1.))
+        out[i] = {'NOM': values[i], 'MIN': values[i] - width, 'MAX': values[i] + width}
+    return out
+
+def contain_nested(out, nested, map_params):
+    '''
+    Widen in place the boxes of the forms of `out` ({TF name: constraints}) to contain the parameter
+    values map_params(lower, higher, values) of every form `lower` nested in `higher`, for `values`
+    at the NOM and at the corners of the box of `lower`. The lower-order forms are widened first.
+    '''
+    names = sorted((name for name, c in out.items() if c is not None), key=lambda name: len(out[name]))
+    for higher in names:
+        for lower in names:
+            if not nested(lower, higher):
+                continue
+            indices = sorted(out[lower])
+            ranges = [(out[lower][i]['MIN'], out[lower][i]['NOM'], out[lower][i]['MAX']) for i in indices]
+            for values in itertools.product(*ranges):
+                for i, v in map_params(lower, higher, dict(zip(indices, values))).items():
+                    box = out[higher][i]
+                    box['MIN'], box['MAX'] = min(box['MIN'], v), max(box['MAX'], v)
+    return out
+
+def rpf_constraints(qcd_hists, options, nsigma=5., floor=0.1, nested=None, map_params=None):
+    '''
+    {region: {TF name: constraints}} for the SR and ttbarCR TFs of all `options` (_rpf_options),
+    from the InitQCDHists output `qcd_hists`. The constraints are None for forms which are not
+    products of polynomials. With `nested` and `map_params` (_rpf_nested and map_rpf_params), the
+    boxes contain the nested forms, see contain_nested.
+    '''
+    out = {}
+    for region in ['SR', 'ttbarCR']:
+        x, y, R, sigma = ratio(qcd_hists[f'{region}_fail'], qcd_hists[f'{region}_pass'])
+        if len(R) == 0:
+            raise ValueError(f'No bins with positive QCD estimates in both {region}_fail and {region}_pass')
+        out[region] = {name: constraints(opt, x, y, R, sigma, nsigma, floor) for name, opt in options.items()}
+        if nested is not None:
+            contain_nested(out[region], nested, map_params)
+    return out
@@ -0,0 +1,356 @@
+'''
+Run the jointSRttbarCR.py stages (--make, --makeCard, --fit) for many signal mass points in
+parallel on the local machine, instead of submitting one Condor job per mass point.
+
+Each signal is processed in a fresh worker process (with its own ROOT state), and everything the
+worker prints - including the output of the combine commands run by 2DAlphabet - is captured in
+<logdir>/<signal>.log. A JSON summary of the status of every signal/stage is kept up to date in
+the file given by --status while the grid runs.
+
+With --shared, the --make stage builds one workspace per distinct workspace name (see -w) holding
+the signal-independent part of the model once plus the templates of all signals mapped to it,
+and the cards/fits of every signal are then made from that shared area. The workspace name may
+use {sig}, {MT} and {MPHI}. The default, "shared_{MT}_", is one build per Tprime mass: every card
+and fit of a signal loads the whole base.root of its group, so a single build for the full grid
+("-w shared_") makes each of them load the templates of every signal.
+
+Examples:
+    python run_grid.py --signals condor/valid_signals.txt --make --makeCard -j 32
+    python run_grid.py --MTs 1800 1900 --MPs 75 125 --fit --strat 1 --tol 5 --rMin -1 --rMax 2 -j 4
+    python run_grid.py --signals condor/valid_signals.txt --fit --ladder --rMin -1 --rMax 2 -j 32
+    python run_grid.py --signals condor/valid_signals.txt --shared --make --makeCard -j 32
+'''
+import os, sys, json, time, traceback
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+MTs = list(range(800,3100,100))
+MPs = [75,100,125,175,200,250,350,450,500]
+
+STAGES = ['make', 'makeCard', 'fit']
+
+def get_signals(signal_file=None, mts=MTs, mps=MPs):
+    '''Signals to run over, either read from a file (one MT-MPHI per line) or from the MT x MP grid'''
+    if signal_file:
+        with open(signal_file) as f:
+            signals = [line.strip() for line in f if line.strip()]
+        return list(dict.fromkeys(signals))
+    return [f'{mt}-{mp}' for mt in mts for mp in mps]
+
+@contextmanager
+def redirect_output(logfile):
+    '''
+    Redirect stdout/stderr of this process to `logfile` at the file descriptor level, so that the
+    output of subprocesses (combine, text2workspace) is captured as well.
+    '''
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(logfile, 'a') as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+def _child(conn, fn, args):
+    try:
+        out = (True, fn(*args))
+    except Exception as e:
+        out = (False, e)
+    try:
+        conn.send(out)
+    except Exception as e:
+        conn.send((False, RuntimeError(f'could not return the result of {fn.__name__}: {e!r}')))
+    conn.close()
+
+def _run_in_process(fn, args):
+    '''fn(*args) in a new spawned process, raising ChildProcessError if the process died'''
+    ctx = multiprocessing.get_context('spawn')
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(send, fn, args))
+    proc.start()
+    send.close()
+    try:
+        ok, value = recv.recv()
+    except EOFError:
+        proc.join()
+        raise ChildProcessError(f'worker of {fn.__name__} died with exit code {proc.exitcode}')
+    finally:
+        recv.close()
+    proc.join()
+    if not ok:
+        raise value
+    return value
+
+class ProcessPerTask(ThreadPoolExecutor):
+    '''Executor running every task in its own spawned process, at most `max_workers` at a time'''
+    def submit(self, fn, *args):
+        return super().submit(_run_in_process, fn, args)
+
+def spawn_pool(workers, fresh=True):
+    '''
+    Process pool for ROOT workers: spawn rather than fork, so that every worker starts from a clean
+    ROOT state. With `fresh`, every task gets a new process, so that no ROOT/2DAlphabet state is
+    carried over from one task to the next; otherwise the workers are re-used, for cheap tasks.
+    '''
+    if fresh:
+        return ProcessPerTask(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def worker_result(future, failed):
+    '''future.result(), or failed(exception) if the worker itself died (e.g. segfault in ROOT)'''
+    try:
+        return future.result()
+    except Exception as e:
+        return failed(e)
+
+def workspace_name(template, signal):
+    '''Workspace name for a signal, from a template which may use {sig}, {MT} and {MPHI}'''
+    MT, MPHI = signal.split('-')[0], signal.split('-')[-1]
+    return template.format(sig=signal, MT=MT, MPHI=MPHI)
+
+def run_stage(stage, signal, opts):
+    '''Run a single jointSRttbarCR.py stage for a signal'''
+    import jointSRttbarCR as joint
+    workspace = workspace_name(opts['workspace'], signal)
+    if stage == 'make':
+        MT, MPHI = signal.split('-')[0], signal.split('-')[-1]
+        fr = {'TprimeB-MT-MPHI':f'TprimeB-{MT}-{MPHI}'}
+        joint.test_make(workspace, fr=fr, json=opts['json'], cache=opts['cache'], rpf_nsigma=opts['rpfBounds'])
+    elif stage == 'makeCard':
+        joint.makeCard(SRorCR=workspace, signal=signal, SRtf=opts['SRtf'], CRtf=opts['CRtf'], autoMCStats=opts['autoMCStats'])
+    elif stage == 'fit' and (opts['ladder'] is not None):
+        from fit_ladder import get_ladder
+        record = joint.fit_ladder(
+            workspace,
+            signal,
+            SRtf=opts['SRtf'],
+            CRtf=opts['CRtf'],
+            ladder=get_ladder(opts['ladder']),
+            rMin=opts['rMin'],
+            rMax=opts['rMax'],
+            verbosity=opts['verbosity'],
+            autoMCStats=opts['autoMCStats']
+        )
+        if record['rung'] is None:
+            raise RuntimeError(f'No rung of the fit ladder converged: {[a["rung"]+": "+a["status"] for a in record["attempts"]]}')
+        return {'rung': record['rung']}
+    elif stage == 'fit':
+        algo = joint.minimizer_algo(opts['robustFit'], opts['robustHesse'])
+        joint.test_fit(
+            workspace,
+            signal,
+            SRtf=opts['SRtf'],
+            CRtf=opts['CRtf'],
+            defMinStrat=int(opts['strat']),
+            extra=f'{algo} --cminDefaultMinimizerTolerance {opts["tol"]}',
+            rMin=opts['rMin'],
+            rMax=opts['rMax'],
+            verbosity=opts['verbosity'],
+            set_params=opts['setParams'],
+            autoMCStats=opts['autoMCStats']
+        )
+    else:
+        raise ValueError(f'Unknown stage {stage}')
+
+def run_signal(signal, stages, opts, logdir):
+    '''Worker: run the requested stages for one signal, stopping at the first failure'''
+    log = os.path.join(logdir, f'{signal}.log')
+    status = {'signal': signal, 'log': log, 'status': 'ok', 'stages': {}}
+    with redirect_output(log):
+        for stage in stages:
+            print(f'===== {signal}: {stage} =====')
+            start = time.time()
+            try:
+                info = run_stage(stage, signal, opts) or {}
+                status['stages'][stage] = dict({'status': 'ok', 'time': time.time()-start}, **info)
+            except BaseException as e:
+                traceback.print_exc()
+                status['stages'][stage] = {'status': 'failed', 'time': time.time()-start, 'error': repr(e)}
+                status['status'] = 'failed'
+                break
+    return status
+
+def run_shared_make(workspace, signals, opts, logdir):
+    '''Worker: build one shared workspace for a group of signals'''
+    import jointSRttbarCR as joint
+    log = os.path.join(logdir, f'{workspace}make.log')
+    status = {'workspace': workspace, 'signals': signals, 'log': log, 'status': 'ok'}
+    with redirect_output(log):
+        print(f'===== {workspace}: shared make for {len(signals)} signals =====')
+        start = time.time()
+        try:
+            joint.test_make_shared(workspace, signals, json=opts['json'], cache=opts['cache'], rpf_nsigma=opts['rpfBounds'])
+        except BaseException as e:
+            traceback.print_exc()
+            status['status'] = 'failed'
+            status['error'] = repr(e)
+        status['time'] = time.time()-start
+    return status
+
+def write_status(filename, statuses, stages, workers, start, shared={}):
+    '''Atomically (re)write the JSON status summary'''
+    summary = {
+        'stages': stages,
+        'workers': workers,
+        'elapsed': time.time()-start,
+        'shared': shared,
+        'ok': sorted(s['signal'] for s in statuses.values() if s['status'] == 'ok'),
+        'failed': sorted(s['signal'] for s in statuses.values() if s['status'] == 'failed'),
+        'signals': statuses
+    }
+    with open(filename+'.tmp', 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(filename+'.tmp', filename)
+
+def run_grid(signals, stages, opts, workers=os.cpu_count(), logdir='logs/grid', status='grid_status.json', shared=False):
+    os.makedirs(logdir, exist_ok=True)
+    start = time.time()
+    statuses = {}
+    shared_statuses = {}
+    with spawn_pool(workers) as pool:
+        if shared and ('make' in stages):
+            # Build each shared workspace once, before any of its signals are processed
+            groups = {}
+            for sig in signals:
+                groups.setdefault(workspace_name(opts['workspace'], sig), []).append(sig)
+            futures = {pool.submit(run_shared_make, ws, sigs, opts, logdir): ws for ws, sigs in groups.items()}
+            for future in as_completed(futures):
+                ws = futures[future]
+                shared_statuses[ws] = worker_result(future, lambda e: {'workspace': ws, 'signals': groups[ws], 'status': 'failed', 'error': repr(e)})
+                print(f'[shared make] {ws}: {shared_statuses[ws]["status"]}')
+                if shared_statuses[ws]['status'] == 'failed':
+                    for sig in groups[ws]:
+                        statuses[sig] = {'signal': sig, 'log': shared_statuses[ws].get('log'), 'status': 'failed', 'stages': {'make': {'status': 'failed'}}}
+                write_status(status, statuses, stages, workers, start, shared_statuses)
+            stages = [stage for stage in stages if stage != 'make']
+
+        todo = [sig for sig in signals if sig not in statuses]
+        futures = {pool.submit(run_signal, sig, stages, opts, logdir): sig for sig in todo} if stages else {}
+        for future in as_completed(futures):
+            sig = futures[future]
+            statuses[sig] = worker_result(future, lambda e: {'signal': sig, 'log': os.path.join(logdir, f'{sig}.log'), 'status': 'failed', 'stages': {}, 'error': repr(e)})
+            print(f'[{len(statuses)}/{len(signals)}] {sig}: {statuses[sig]["status"]}')
+            write_status(status, statuses, stages, workers, start, shared_statuses)
+        if not stages:
+            # only the shared workspaces were requested
+            for ws, st in shared_statuses.items():
+                for sig in st['signals']:
+                    statuses.setdefault(sig, {'signal': sig, 'log': st.get('log'), 'status': st['status'], 'stages': {'make': {'status': st['status']}}})
+    write_status(status, statuses, stages, workers, start, shared_statuses)
+    return statuses
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--signals', type=str, dest='signals',
+                        action='store', default=None,
+                        help='File with one MT-MPHI signal per line (e.g. condor/valid_signals.txt). Otherwise the MTs x MPs grid is used')
+    parser.add_argument('--MTs', type=int, nargs='+', dest='MTs',
+                        action='store', default=MTs,
+                        help='Tprime masses to run over')
+    parser.add_argument('--MPs', type=int, nargs='+', dest='MPs',
+                        action='store', default=MPs,
+                        help='Phi masses to run over')
+    parser.add_argument('-w', type=str, dest='workspace',
+                        action='store', default=None,
+                        help='Workspace name, "{sig}", "{MT}" and "{MPHI}" are replaced by the signal masses. Default: "{sig}_unblind_", or "shared_{MT}_" (one build per Tprime mass) with --shared')
+    parser.add_argument('--shared', dest='shared',
+                        action='store_true',
+                        help='Build one workspace per distinct workspace name for all of its signals, instead of one per signal')
+    parser.add_argument('--json', type=str, dest='json',
+                        action='store', default='joint_mcstats_onesig.json',
+                        help='path to JSON file for making the initial workspace')
+    parser.add_argument('--cache', dest='cache',
+                        action='store_true',
+                        help='Read the selection files through the local xrootd cache (see xrdcache.py)')
+    parser.add_argument('--SRtf', type=str, dest='SRtf',
+                        action='store', default='0x0',
+                        help='TF parameterization for SR tf')
+    parser.add_argument('--CRtf', type=str, dest='CRtf',
+                        action='store', default='0x0',
+                        help='TF parameterization for CR tf')
+    parser.add_argument('-j', '--workers', type=int, dest='workers',
+                        action='store', default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--logdir', type=str, dest='logdir',
+                        action='store', default='logs/grid',
+                        help='Directory for the per-signal logs')
+    parser.add_argument('--status', type=str, dest='status',
+                        action='store', default='grid_status.json',
+                        help='JSON file for the status summary')
+    # Stages
+    parser.add_argument('--make', dest='make',
+                        action='store_true',
+                        help='Create the 2DAlphabet workspaces')
+    parser.add_argument('--rpfBounds', type=float, dest='rpfBounds',
+                        action='store', default=None,
+                        help='With --make, bound the RPF parameters to +/- this many sigma of a fit to the initial pass/fail ratio, widened to contain the nested TFs (default: fitted starting values with the fixed +/-500 bounds; 0: fixed constraints only)')
+    parser.add_argument('--makeCard', dest='makeCard',
+                        action='store_true',
+                        help='Create and modify the combined SR+CR datacards')
+    parser.add_argument('--fit', dest='fit',
+                        action='store_true',
+                        help='Fit with the given TFs')
+    parser.add_argument('--autoMCStats', type=float, dest='autoMCStats',
+                        action='store', default=None,
+                        help='Replace the explicit ttbar mcstats nuisances by combine autoMCStats lines with this event threshold')
+    # Fit options
+    parser.add_argument('--ladder', type=str, nargs='*', dest='ladder',
+                        action='store', default=None, metavar='RUNG',
+                        help='With --fit, try the rungs of the fit ladder (all, or only those given) until one converges (see fit_ladder.py). The rung which converged is recorded in the status summary')
+    parser.add_argument('--setParams', dest='setParams',
+                        action='store_true',
+                        help='Uses the b-only parameter values in s+b fit')
+    parser.add_argument('--strat', dest='strat',
+                        action='store', default='0',
+                        help='Default minimizer strategy')
+    parser.add_argument('--tol', dest='tol',
+                        action='store', default='0.1',
+                        help='Default minimizer tolerance')
+    parser.add_argument('--robustFit', dest='robustFit',
+                        action='store_true',
+                        help='If passed as argument, uses robustFit algo')
+    parser.add_argument('--robustHesse', dest='robustHesse',
+                        action='store_true',
+                        help='If passed as argument, uses robustHesse algo')
+    parser.add_argument('--rMin', dest='rMin',
+                        action='store', default='-1',
+                        help='Minimum allowed signal strength')
+    parser.add_argument('--rMax', dest='rMax',
+                        action='store', default='10',
+                        help='Maximium allowed signal strength')
+    parser.add_argument('-v', dest='verbosity',
+                        action='store', default='2',
+                        help='Combine verbosity')
+    args = parser.parse_args()
+
+    stages = [stage for stage in STAGES if getattr(args, stage)]
+    if not stages:
+        parser.error('No stage requested, pass at least one of --make, --makeCard, --fit')
+    if args.robustFit and args.robustHesse:
+        parser.error('Cannot use both robustFit and robustHesse algorithms simultaneously')
+    if args.ladder:
+        from fit_ladder import get_ladder
+        try:
+            get_ladder(args.ladder)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.workspace is None:
+        args.workspace = 'shared_{MT}_' if args.shared else '{sig}_unblind_'
+
+    signals = get_signals(args.signals, args.MTs, args.MPs)
+    opts = {k: getattr(args, k) for k in ['workspace','json','cache','rpfBounds','SRtf','CRtf','autoMCStats','ladder','setParams','strat','tol','robustFit','robustHesse','rMin','rMax','verbosity']}
+    print(f'Running {stages} for {len(signals)} signals on {args.workers} workers')
+    statuses = run_grid(signals, stages, opts, workers=args.workers, logdir=args.logdir, status=args.status, shared=args.shared)
+    nfailed = sum(1 for s in statuses.values() if s['status'] == 'failed')
+    print(f'Done: {len(statuses)-nfailed} succeeded, {nfailed} failed. Summary written to {args.status}')
@@ -15,6 +15,10 @@ import matplotlib.ticker as mticker
 import ROOT
 import subprocess
 import pandas as pd
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from limitstore import load_entries
 from collections import OrderedDict
 import argparse
 
@@ -74,22 +78,8 @@ for name in ['raw','scaled']:
     dfs  = {0:None, 1:None, 2:None, 3:None, 4:None, 5:None}
     sigs = OrderedDict([(mx,dfs.copy()) for mx in xs])
 
-    # Now populate the dfs dict with the full dataframes of all the limits 
-    for i in range(len(dfs)):
-        if i == 0:
-            fname = f"limits/limits_Minus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 1:
-            fname = f"limits/limits_Minus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 2:
-            fname = f"limits/limits_Expected_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 3:
-            fname = f"limits/limits_Plus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 4:
-            fname = f"limits/limits_Plus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        else:
-            fname = f"limits/limits_Observed_{'withCR' if args.withCR else 'noCR'}.csv"
-        lim = pd.read_csv(fname)
-        dfs[i] = lim
+    # Now populate the dfs dict with the full dataframes of all the limits, reading only the mT values plotted
+    dfs = load_entries(withCR=args.withCR, scaling='raw', MT=[float(mx) for mx in xs])
 
     # Store the dataframes for the median, +/-1 sigma, +/-2 sigma, and observed limits.
     for mx in xs:
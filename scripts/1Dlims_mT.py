@@ -15,6 +15,11 @@ import matplotlib.ticker as mticker
 import ROOT
 import subprocess
 import pandas as pd
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from limitstore import load_entries
+from plotrender import plot, render
 from collections import OrderedDict
 import argparse
 
@@ -26,6 +31,8 @@ The second method speeds up limit calculation by a factor of almost 200 and prov
 '''
 parser = argparse.ArgumentParser()
 parser.add_argument("--withCR", dest='withCR', action='store_true', help='If passed as an argument, use the limits calculated with the ttbar CR. Otherwise, will use the limits calculated with the CR masked.')
+parser.add_argument("-j", type=int, dest='workers', action='store', default=2, help='Number of processes rendering the plots')
+parser.add_argument("--forcePlots", dest='forcePlots', action='store_true', help='If passed as an argument, re-render the plots even if they did not change since the last run.')
 
 args = parser.parse_args()
 
@@ -61,42 +68,8 @@ def plot_limit_1D(ax, x_axis_vals, yMass, m2, m1, med, p1, p2, obs):
 xs = ['800', '900', '1000', '1200', '1400', '1600', '1800', '2000', '2400', '2800', '2900', '3000']
 ys = ['75', '100', '125', '175', '200', '250', '350', '450', '500']
 
-for name in ['raw','scaled']:
-    if name == 'raw':
-        factor = 1.0
-    else:
-        factor = 0.991 * 0.6732 # T->bqq BR.  Wqq taken from https://arxiv.org/pdf/2201.07861
-
-    print(f'Plotting 1D limits {name}')
-
-    # 0: minus2, 1: minus2, 2: median, 3: plus1, 4: plus2, 5: observed
-    dfs  = {0:None, 1:None, 2:None, 3:None, 4:None, 5:None}
-    sigs = OrderedDict([(my,dfs.copy()) for my in ys])
-
-    # Now populate the dfs dict with the full dataframes of all the limits 
-    for i in range(len(dfs)):
-        if i == 0:
-            fname = f"limits/limits_Minus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 1:
-            fname = f"limits/limits_Minus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 2:
-            fname = f"limits/limits_Expected_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 3:
-            fname = f"limits/limits_Plus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 4:
-            fname = f"limits/limits_Plus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        else:
-            fname = f"limits/limits_Observed_{'withCR' if args.withCR else 'noCR'}.csv"
-        lim = pd.read_csv(fname)
-        dfs[i] = lim 
-
-    # Store the dataframes for the median, +/-1 sigma, +/-2 sigma, and observed limits.
-    for my in ys:
-        for lim in range(len(dfs)):
-            df = dfs[lim]
-            df = df[df['MPhi'] == float(my)]
-            sigs[my][lim] = df.sort_values(by='MTprime')
-
+# Grid of the 1D limits of all mPhi values, `sigs` holding the limit dataframes of each mPhi
+def plot_columns(sigs, name, factor):
     # At this point, all 9 mPhi values have their 5 limits stored in pandas dfs as a function of mTprime.
     hep.cms.text("WiP",loc=0)
     lumiText = "138 $fb^{-1} (13 TeV)$"    
@@ -147,5 +120,31 @@ for name in ['raw','scaled']:
             ax.set_xlabel(r"$m_{T^\prime}$ (GeV)",loc='right')
 
     fig.tight_layout()
-    plt.savefig(f"plots/column_limits_1D_{'withCR' if args.withCR else 'noCR'}_mT_{name}.pdf")
-    plt.savefig(f"plots/column_limits_1D_{'withCR' if args.withCR else 'noCR'}_mT_{name}.png")
+    return fig
+
+plots = []
+for name in ['raw','scaled']:
+    if name == 'raw':
+        factor = 1.0
+    else:
+        factor = 0.991 * 0.6732 # T->bqq BR.  Wqq taken from https://arxiv.org/pdf/2201.07861
+
+    print(f'Plotting 1D limits {name}')
+
+    # 0: minus2, 1: minus2, 2: median, 3: plus1, 4: plus2, 5: observed
+    dfs  = {0:None, 1:None, 2:None, 3:None, 4:None, 5:None}
+    sigs = OrderedDict([(my,dfs.copy()) for my in ys])
+
+    # Now populate the dfs dict with the full dataframes of all the limits, reading only the mPhi values plotted
+    dfs = load_entries(withCR=args.withCR, scaling='raw', MPhi=[float(my) for my in ys])
+
+    # Store the dataframes for the median, +/-1 sigma, +/-2 sigma, and observed limits.
+    for my in ys:
+        for lim in range(len(dfs)):
+            df = dfs[lim]
+            df = df[df['MPhi'] == float(my)]
+            sigs[my][lim] = df.sort_values(by='MTprime')
+
+    plots.append(plot(plot_columns, f"plots/column_limits_1D_{'withCR' if args.withCR else 'noCR'}_mT_{name}", sigs, name, factor, savefig={'bbox_inches': None}))
+
+render(plots, workers=args.workers, force=args.forcePlots)
@@ -10,6 +10,10 @@ import matplotlib.ticker as mticker
 import ROOT
 import subprocess
 import pandas as pd
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from limitstore import load_entries
 from collections import OrderedDict
 import argparse
 
@@ -40,21 +44,8 @@ for name in ['raw','scaled']:
     dfs     = {0:None, 1:None, 2:None, 3:None, 4:None, 5:None}
     new_dfs = {0:None, 1:None, 2:None, 3:None, 4:None, 5:None}
 
-    for i in range(len(dfs)):
-        if i == 0:
-            fname = f"limits/limits_Minus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 1:
-            fname = f"limits/limits_Minus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 2:
-            fname = f"limits/limits_Expected_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 3:
-            fname = f"limits/limits_Plus1_{'withCR' if args.withCR else 'noCR'}.csv"
-        elif i == 4:
-            fname = f"limits/limits_Plus2_{'withCR' if args.withCR else 'noCR'}.csv"
-        else:
-            fname = f"limits/limits_Observed_{'withCR' if args.withCR else 'noCR'}.csv"
-        lim = pd.read_csv(fname)
-        dfs[i] = lim
+    # Only the limits for mPhi=125 are read from the limit store
+    dfs = load_entries(withCR=args.withCR, scaling='raw', MPhi=125.0)
 
     # Loop over all 5 limits 
     for i in range(len(dfs)):
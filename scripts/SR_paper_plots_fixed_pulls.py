@@ -8,8 +8,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import mplhep as hep
 import ROOT as r
+import os, sys
 plt.style.use(hep.style.CMS)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from PyHist import PyHist
+from postfit_hists import get_hists
+from plotrender import plot, render
 import copy
 import matplotlib
 
@@ -86,81 +90,7 @@ hatch_style = {
 }
 
 
-def get_binning_x(hLow,hSig,hHigh):
-    bins = []
-    for i in range(1,hLow.GetNbinsX()+1):
-        bins.append(hLow.GetXaxis().GetBinLowEdge(i))
-    for i in range(1,hSig.GetNbinsX()+1):
-        bins.append(hSig.GetXaxis().GetBinLowEdge(i))
-    for i in range(1,hHigh.GetNbinsX()+2):#low edge of overflow is high edge of last bin
-        bins.append(hHigh.GetXaxis().GetBinLowEdge(i))
-    bins = np.array(bins,dtype='float64')
-    return bins
-
-def get_binning_y(hLow,hSig,hHigh):
-    #histos should have same binning in Y
-    bins = []
-    for i in range(1,hLow.GetNbinsY()+2):
-        bins.append(hLow.GetYaxis().GetBinLowEdge(i))
-    bins = np.array(bins,dtype='float64')
-    return bins
-
-def get2DPostfitPlot(file, process, region, prefit=False):
-    if not r.TFile.Open(file):
-        raise FileNotFoundError(f"The file '{file}' does not exist or cannot be opened.")
-    
-    f = r.TFile.Open(file)
-    fitStatus = "prefit" if prefit else "postfit"
-    
-    hLow = f.Get(f"{region}_LOW_{fitStatus}/{process}")
-    if not hLow:
-        raise ValueError(f"Histogram '{region}_LOW_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    hSig = f.Get(f"{region}_SIG_{fitStatus}/{process}")
-    if not hSig:
-        raise ValueError(f"Histogram '{region}_SIG_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    hHigh = f.Get(f"{region}_HIGH_{fitStatus}/{process}")
-    if not hHigh:
-        raise ValueError(f"Histogram '{region}_HIGH_{fitStatus}/{process}' does not exist in the file '{file}'.")
-    
-    h2 = merge_low_sig_high(hLow, hSig, hHigh, hName=f"h2_{process}_{region}")
-    h2.SetDirectory(0)
-    return h2
-
-
-def merge_low_sig_high(hLow,hSig,hHigh,hName="temp"):
-    n_x_low     = hLow.GetNbinsX()
-    n_x_sig     = hSig.GetNbinsX()
-    n_x_high    = hHigh.GetNbinsX()
-    n_x         = n_x_low + n_x_sig + n_x_high
-    n_y         = hLow.GetNbinsY()#assumes Y bins are the same
-    bins_x      = get_binning_x(hLow,hSig,hHigh)
-    bins_y      = get_binning_y(hLow,hSig,hHigh)
-    h_res       = r.TH2F(hName,"",n_x,bins_x,n_y,bins_y)
-    for i in range(1,n_x_low+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+0,j,hLow.GetBinContent(i,j))
-            h_res.SetBinError(i+0,j,hLow.GetBinError(i,j))
-
-    for i in range(1,n_x_sig+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+n_x_low,j,hSig.GetBinContent(i,j))
-            h_res.SetBinError(i+n_x_low,j,hSig.GetBinError(i,j))
-
-    for i in range(1,n_x_high+1):
-        for j in range(1,n_y+1):
-            h_res.SetBinContent(i+n_x_sig+n_x_low,j,hHigh.GetBinContent(i,j))
-            h_res.SetBinError(i+n_x_sig+n_x_low,j,hHigh.GetBinError(i,j))
-    return h_res
-
-def get_hists(input_file,region,processes,prefit=False):
-    histos_region_dict = {}
-    for process in processes:
-        h2 = get2DPostfitPlot(input_file,process,region,prefit)
-        histos_region_dict[process]=h2
-    return histos_region_dict
-
+# Draws the figure of one projection, `outputFile` being the output path without extension (saved by plotrender.render)
 def ARC_plot(hData,hMC,hTotalBkg,labelsMC,colorsMC,xlabel,outputFile,xRange=[],yRange=[],projectionText="",yRangeLog=[],mx='',my='',combined_sigma=False, prelim=False, log=False):
     # Set up variables
     edges = hData.bin_edges
@@ -385,9 +315,9 @@ def ARC_plot(hData,hMC,hTotalBkg,labelsMC,colorsMC,xlabel,outputFile,xRange=[],y
         fontproperties='Tex Gyre Heros:bold'
     )
     
-    # Reduce whitespace around figure and save
+    # Reduce whitespace around figure
     #plt.subplots_adjust(left=0.1, right=0.95, top=0.95, bottom=0.1)
-    plt.savefig(outputFile, bbox_inches='tight')
+    return fig
 
 
 def plot_projection(histos_dict, region, processes, labels_dict, colors_dict, axis="X",yRange=[],yRangeLog=[1,10**5], prefit=False, mx='', my='',combined_sigma=False, prelim=False, log=False):
@@ -431,8 +361,10 @@ def plot_projection(histos_dict, region, processes, labels_dict, colors_dict, ax
     #h_bkg.divide_by_bin_width()
 
 
-    for ext in ['pdf','png']:
-        ARC_plot(h_data, h_mc, h_bkg, labels_mc, colors_mc,axis_label,f"./plots/{region}_{file_suffix}.{ext}",xRange=x_range,yRange=yRange,projectionText=region.replace("_", " "),yRangeLog=yRangeLog, mx=mx, my=my, combined_sigma=combined_sigma, prelim=prelim, log=log)
+    # Drawn once for both the pdf and png (ARC_plot divides the histograms by the bin widths in place)
+    outputFile = f"./plots/{region}_{file_suffix}"
+    # ARC_plot also runs the PyHist methods, declared so that changes there re-render the plots
+    return plot(ARC_plot, outputFile, h_data, h_mc, h_bkg, labels_mc, colors_mc,axis_label,outputFile,xRange=x_range,yRange=yRange,projectionText=region.replace("_", " "),yRangeLog=yRangeLog, mx=mx, my=my, combined_sigma=combined_sigma, prelim=prelim, log=log, depends=[sys.modules[PyHist.__module__]])
 
 if __name__ == "__main__":
 
@@ -444,6 +376,12 @@ if __name__ == "__main__":
     parser.add_argument('--sig', dest='sig', type=str,
                         default='1100-175', # signal which seems to have highest significance
                         action='store', help='mx-my signal mass to plot')
+    parser.add_argument('-j', type=int, dest='workers',
+                        action='store', default=os.cpu_count(),
+                        help='Number of processes rendering the plots')
+    parser.add_argument('--forcePlots', dest='forcePlots',
+                        action='store_true',
+                        help='Re-render the plots even if they did not change since the last run')
     args = parser.parse_args()
 
     prefit = args.prefit
@@ -499,6 +437,7 @@ if __name__ == "__main__":
             colors_dict[key] = color
             labels_dict[key] = label
 
+    plots = []
     for k, v in {
         'SR_pass':procs_SR_pass,
         'SR_fail':procs_SR_fail
@@ -507,4 +446,5 @@ if __name__ == "__main__":
             for combined_sigma in [True]:
                 for prelim in [True, False]:
                     for log in [True, False]:
-                        plot_projection(histos_dict,k,v,labels_dict,colors_dict,axis=axis, prefit=prefit, mx=mx, my=my, combined_sigma=combined_sigma, prelim=prelim, log=log)
+                        plots.append(plot_projection(histos_dict,k,v,labels_dict,colors_dict,axis=axis, prefit=prefit, mx=mx, my=my, combined_sigma=combined_sigma, prelim=prelim, log=log))
+    render(plots, workers=args.workers, force=args.forcePlots)
@@ -0,0 +1,106 @@
+'''
+Benchmark combine's autoMCStats (Barlow-Beeston-lite) treatment of the ttbar MC statistical
+uncertainties against the explicit per-bin mcstats shape nuisances, on the card of one signal.
+
+Both cards are made from the same 2DAlphabet card (card_original_2DAlphabet.txt, written by
+`jointSRttbarCR.py --makeCard`) with parse_card_SRCR_mcstats.py, then converted with
+text2workspace.py and fitted with FitDiagnostics. For each mode the wall time of both steps, the
+number of nuisances in the card and the number of floating parameters of the b-only fit are printed.
+`prop_bin*` are the parameters combine creates for autoMCStats; if there are none in the autoMCStats
+mode, combine did not apply it to the (RooDataHist) templates of the workspace.
+
+Run from the top-level directory, in a CMSSW environment with combine:
+    python scripts/benchmark_automcstats.py -w 1800-125_unblind_ -s 1800-125 --SRtf 0x0 --CRtf 0x0
+'''
+import os, sys, time, subprocess
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parse_card_SRCR_mcstats import parse_card, automcstats_channels
+
+NUISANCE_TYPES = ['shape', 'lnN', 'param', 'shapeN', 'shape?']
+
+def count_nuisances(card):
+    '''(total, mcstats) number of nuisance lines in a card'''
+    total = mcstats = 0
+    with open(card) as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) > 1 and tokens[1] in NUISANCE_TYPES:
+                total += 1
+                mcstats += 'mcstats' in tokens[0]
+    return total, mcstats
+
+def run(cmd, cwd, log):
+    '''Run a command in `cwd`, logging its output, and return its wall time'''
+    start = time.perf_counter()
+    with open(os.path.join(cwd, log), 'w') as f:
+        subprocess.run(cmd, shell=True, cwd=cwd, stdout=f, stderr=subprocess.STDOUT, check=True)
+    return time.perf_counter() - start
+
+def fit_summary(fitfile):
+    '''Status and floating parameters of the b-only fit'''
+    import ROOT
+    f = ROOT.TFile.Open(fitfile)
+    fit_b = f.Get('fit_b') if f else None
+    if not fit_b:
+        return {'status': -1, 'nfloat': 0, 'nprop': 0, 'nmcstats': 0}
+    names = [p.GetName() for p in fit_b.floatParsFinal()]
+    out = {
+        'status':   fit_b.status(),
+        'nfloat':   len(names),
+        'nprop':    sum(n.startswith('prop_bin') for n in names),
+        'nmcstats': sum('mcstats' in n for n in names),
+    }
+    f.Close()
+    return out
+
+def benchmark(area, threshold, combine_opts):
+    orig = os.path.join(area, 'card_original_2DAlphabet.txt')
+    channels = list(automcstats_channels(os.path.join(os.path.dirname(area), 'organized_hists.root'), ))
+    modes = {
+        'templates': {},
+        'auto':      {'automcstats': threshold, 'channels': channels},
+    }
+    results = {}
+    for mode, opts in modes.items():
+        card = f'card_bench_{mode}.txt'
+        parse_card(orig, out=os.path.join(area, card), debug=os.path.join(area, f'DEBUG_card_bench_{mode}.txt'), **opts)
+        t_ws  = run(f'text2workspace.py {card} -o ws_bench_{mode}.root --channel-masks', area, f'bench_{mode}_t2w.log')
+        t_fit = run(f'combine -M FitDiagnostics -d ws_bench_{mode}.root -n .bench_{mode} {combine_opts}', area, f'bench_{mode}_fit.log')
+        results[mode] = {'t_ws': t_ws, 't_fit': t_fit, 'nuisances': count_nuisances(os.path.join(area, card))}
+        results[mode].update(fit_summary(os.path.join(area, f'fitDiagnostics.bench_{mode}.root')))
+        print(f'{mode}: done')
+
+    print(f'\n{area}, autoMCStats event threshold {threshold:g} in {channels}')
+    print(f'{"":10}{"t2w [s]":>9}{"fit [s]":>9}{"nuis.":>7}{"mcstats":>9}{"float":>7}{"prop_bin":>10}{"status":>8}')
+    for mode, r in results.items():
+        print(f'{mode:10}{r["t_ws"]:9.1f}{r["t_fit"]:9.1f}{r["nuisances"][0]:7}{r["nuisances"][1]:9}{r["nfloat"]:7}{r["nprop"]:10}{r["status"]:8}')
+    if results['auto']['nprop'] == 0:
+        print('WARNING: no prop_bin parameters in the autoMCStats fit, combine did not apply autoMCStats to these templates')
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', type=str, dest='workspace',
+                        action='store', default='jointSRttbarCR',
+                        help='workspace name (as passed to jointSRttbarCR.py)')
+    parser.add_argument('-s', type=str, dest='sigmass',
+                        action='store', default='1800-125',
+                        help='mass of Tprime and Phi cand')
+    parser.add_argument('--SRtf', type=str, dest='SRtf',
+                        action='store', required=True,
+                        help='TF parameterization for SR tf')
+    parser.add_argument('--CRtf', type=str, dest='CRtf',
+                        action='store', required=True,
+                        help='TF parameterization for CR tf')
+    parser.add_argument('--threshold', type=float, dest='threshold',
+                        action='store', default=20.,
+                        help='combine autoMCStats event threshold')
+    parser.add_argument('--combineOpts', type=str, dest='combineOpts',
+                        action='store', default='--rMin -1 --rMax 10 --cminDefaultMinimizerStrategy 0 --cminDefaultMinimizerTolerance 0.1',
+                        help='Options of the FitDiagnostics fits')
+    args = parser.parse_args()
+
+    area = f'{args.workspace}fits/TprimeB-{args.sigmass}-SR{args.SRtf}-CR{args.CRtf}_area'
+    benchmark(area, args.threshold, args.combineOpts)
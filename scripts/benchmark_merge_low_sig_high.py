@@ -0,0 +1,106 @@
+'''
+Benchmark the NumPy stitching of the LOW/SIG/HIGH postfit histograms (postfit_hists.py) against the
+original bin-by-bin merge_low_sig_high, which also reopened the input file twice per histogram.
+
+All processes of all regions found in the input file are stitched with both implementations, and
+the merged contents and errors are checked to be identical. Without an input file, a synthetic one
+with the binning of the analysis (4 regions, 60 processes) is written to a temporary directory.
+
+Run from the top-level directory:
+    python scripts/benchmark_merge_low_sig_high.py -i 1800-125_unblind_fits/postfitshapes_b.root
+'''
+import os, sys, time, tempfile
+import argparse
+import numpy as np
+import ROOT
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import postfit_hists
+from postfit_hists import CHANNELS, get_hists, merge_low_sig_high_legacy
+from PyHist import hist2array
+
+REGIONS = ['SR_fail', 'SR_pass', 'ttbarCR_fail', 'ttbarCR_pass']
+
+def make_file(filename, nprocs=60):
+    '''Synthetic PostFitShapesFromWorkspace output: mphi 60-560 GeV, mT 800-3500 GeV split in LOW/SIG/HIGH'''
+    rng = np.random.default_rng(1)
+    edges_x = {'LOW': [60,80,100], 'SIG': [100,120,140,160,180,200], 'HIGH': [200,220,260,300,560]}
+    edges_y = np.array([800,900,1000,1100,1200,1300,1400,1500,1700,2000,2500,3500], dtype='float64')
+    f = ROOT.TFile.Open(filename, 'RECREATE')
+    for region in REGIONS:
+        for channel in CHANNELS:
+            d = f.mkdir(f'{region}_{channel}_postfit')
+            d.cd()
+            ex = np.array(edges_x[channel], dtype='float64')
+            for p in range(nprocs):
+                h = ROOT.TH2F(f'proc{p}', '', len(ex)-1, ex, len(edges_y)-1, edges_y)
+                h.Sumw2()
+                for i in range(1, len(ex)):
+                    for j in range(1, len(edges_y)):
+                        h.SetBinContent(i, j, rng.exponential(100.))
+                        h.SetBinError(i, j, rng.exponential(5.))
+                h.Write()
+    f.Close()
+
+def processes(filename):
+    '''{region: processes} of all regions of the file'''
+    f = ROOT.TFile.Open(filename)
+    out = {}
+    for region in REGIONS:
+        d = f.Get(f'{region}_LOW_postfit')
+        if d:
+            out[region] = sorted({k.GetName() for k in d.GetListOfKeys()})
+    f.Close()
+    return out
+
+def legacy(filename, region, procs):
+    '''The original get_hists: two TFile.Open and a bin-by-bin merge per histogram'''
+    out = {}
+    for process in procs:
+        if not ROOT.TFile.Open(filename):
+            raise FileNotFoundError(filename)
+        f = ROOT.TFile.Open(filename)
+        hists = [f.Get(f'{region}_{channel}_postfit/{process}') for channel in CHANNELS]
+        h2 = merge_low_sig_high_legacy(*hists, hName=f'legacy_{process}_{region}')
+        h2.SetDirectory(0)
+        out[process] = h2
+    return out
+
+def check(h_old, h_new):
+    a, ea = hist2array(h_old, include_overflow=True, return_errors=True)
+    b, eb = hist2array(h_new, include_overflow=True, return_errors=True)
+    return np.array_equal(a, b) and np.allclose(ea, eb, rtol=1e-12, atol=0.)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, dest='input',
+                        action='store', default=None,
+                        help='PostFitShapesFromWorkspace output (default: a synthetic file)')
+    parser.add_argument('--nprocs', type=int, dest='nprocs',
+                        action='store', default=60,
+                        help='Number of processes per region of the synthetic file')
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.TH1.AddDirectory(False)
+    filename = args.input
+    if filename is None:
+        filename = os.path.join(tempfile.mkdtemp(), 'postfitshapes_synthetic.root')
+        make_file(filename, args.nprocs)
+    procs = processes(filename)
+    nhists = sum(len(p) for p in procs.values())
+
+    start = time.perf_counter()
+    old = {region: legacy(filename, region, p) for region, p in procs.items()}
+    t_old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = {region: get_hists(filename, region, p) for region, p in procs.items()}
+    t_new = time.perf_counter() - start
+    postfit_hists.close_files()
+
+    bad = [(region, p) for region in procs for p in procs[region] if not check(old[region][p], new[region][p])]
+    print(f'{filename}: {nhists} histograms in {len(procs)} regions')
+    print(f'bin-by-bin: {t_old:.3f} s')
+    print(f'numpy:      {t_new:.3f} s ({t_old/t_new:.1f}x)')
+    print('Outputs identical' if not bad else f'ERROR: {len(bad)} histograms differ, e.g. {bad[:3]}')
@@ -0,0 +1,103 @@
+'''
+Benchmark the vectorized card rewriter against the original line-by-line implementation on a
+synthetic 2DAlphabet card, checking that both produce byte-identical outputs.
+
+The synthetic card has 48 ttbar columns (ttbarCR/SR fail/pass, LOW/SIG/HIGH, 4 years) and by
+default 2000 mcstats nuisances, split evenly between the SR and ttbarCR pass regions. Pass `--full`
+to also add the W/Z+jets, signal and QCD columns of the real card (204 columns in total).
+
+Run from the top-level directory:
+    python scripts/benchmark_parse_card.py --nuisances 2000 --repeat 5
+'''
+import os, sys, time, filecmp, tempfile
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parse_card_SRCR_mcstats import parse_card, parse_card_legacy, DELIMITER
+
+regions  = ['ttbarCR_fail','ttbarCR_pass','SR_fail','SR_pass']
+channels = ['LOW','SIG','HIGH']
+years    = ['16','16APV','17','18']
+
+def fmt(tokens):
+    return ' '.join(f'{t:20}' for t in tokens)
+
+def make_card(filename, nuisances, full=False):
+    bins  = [f'{r}_{c}' for r in regions for c in channels]
+    procs = ['ttbar']
+    if full:
+        procs += ['ZJets', 'WJets', 'TprimeB-1800-125']
+    cols  = [(b, f'{p}_{y}') for b in bins for p in procs for y in years]
+    if full:
+        cols += [(b, f'Background_{b}') for b in bins]
+    # Only ttbar carries the region-specific nuisances
+    ones  = ['1.0' if 'ttbar_' in c[1] else '-' for c in cols]
+    lines = [
+        f'imax {len(bins)}',
+        'jmax *',
+        'kmax *',
+        DELIMITER,
+        'shapes * * base.root w:$PROCESS_$CHANNEL w:$PROCESS_$CHANNEL_$SYSTEMATIC',
+        DELIMITER,
+        fmt(['bin'] + bins),
+        fmt(['observation'] + ['-1']*len(bins)),
+        DELIMITER,
+        fmt(['bin'] + [c[0] for c in cols]),
+        fmt(['process'] + [c[1] for c in cols]),
+        fmt(['process'] + [str(i+1) for i in range(len(cols))]),
+        fmt(['rate'] + ['-1']*len(cols)),
+        DELIMITER,
+        fmt(['lumi_correlated', 'lnN'] + ['1.013']*len(cols)),
+        fmt(['DAK8Top_tag', 'shape'] + ones),
+        fmt(['PNetXbb_mistag', 'shape'] + ones),
+    ]
+    nx = 10
+    for n in range(nuisances):
+        region = 'SR_pass' if n % 2 == 0 else 'ttbarCR_pass'
+        k = n // 2
+        lines.append(fmt([f'{region}_mcstats_{k//nx+1}_{k%nx+1}', 'shape'] + ones))
+    with open(filename,'w') as f:
+        for line in lines:
+            f.write(f'{line}\n')
+    return len(cols)
+
+def timeit(func, card, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(card)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times)/len(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nuisances', type=int, default=2000, help='Number of synthetic mcstats nuisances')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing repetitions')
+    parser.add_argument('--full', action='store_true', help='Include the non-ttbar columns of the real card')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            ncols = make_card('card_original_2DAlphabet.txt', args.nuisances, args.full)
+            print(f'Synthetic card: {ncols} columns, {args.nuisances} mcstats nuisances')
+
+            parse_card_legacy('card_original_2DAlphabet.txt')
+            os.replace('card_new.txt', 'card_legacy.txt')
+            os.replace('DEBUG.txt', 'DEBUG_legacy.txt')
+            parse_card('card_original_2DAlphabet.txt')
+            for new, ref in [('card_new.txt','card_legacy.txt'), ('DEBUG.txt','DEBUG_legacy.txt')]:
+                if not filecmp.cmp(new, ref, shallow=False):
+                    raise RuntimeError(f'{new} differs from the output of the original implementation')
+            print('Outputs are byte-identical to the original implementation')
+
+            best_old, mean_old = timeit(parse_card_legacy, 'card_original_2DAlphabet.txt', args.repeat)
+            best_new, mean_new = timeit(parse_card, 'card_original_2DAlphabet.txt', args.repeat)
+        finally:
+            os.chdir(cwd)
+
+    print(f'{"":12}{"best [s]":>12}{"mean [s]":>12}')
+    print(f'{"original":12}{best_old:12.4f}{mean_old:12.4f}')
+    print(f'{"vectorized":12}{best_new:12.4f}{mean_new:12.4f}')
+    print(f'Speedup (best): {best_old/best_new:.1f}x')
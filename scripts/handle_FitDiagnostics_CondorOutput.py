@@ -1,42 +1,150 @@
 '''
-Moves the FitDiagnostics Condor output files to their respective directories.
+Moves the FitDiagnostics Condor output files to their respective directories, after creating the
+postfit workspace which is used as a snapshot for the limit toys.
+
+The signals are harvested in parallel, each worker validating the fit result of one signal,
+writing its postfit workspace and moving its files to <signal>_unblind_fits/. The outcome of every
+signal is recorded in a JSON manifest (default harvest_manifest.json), which is rewritten after each
+signal. A rerun skips the signals already harvested, unless new Condor output for them is present,
+and picks up partially harvested signals from wherever their files are.
+
+    python scripts/handle_FitDiagnostics_CondorOutput.py -j 16
 '''
-import glob, os, ROOT
-from TwoDAlphabet.helpers import execute_cmd
+import glob, os, sys, json, time, traceback
+from concurrent.futures import as_completed
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from output_router import OutputRouter
+from fit_ladder import fit_status as check_fit
+from run_grid import spawn_pool, worker_result
 
-failed = open('FAILED_FitDiagnostics.txt','w')
+def _names(signal):
+    return {
+        'card':     f'card_{signal}.txt',
+        'fit':      f'fitDiagnosticsTest_{signal}.root',
+        'w':        f'higgsCombineTest.FitDiagnostics.mH120.{signal}.root',
+        'snapshot': f'initialFitWorkspace_{signal}.root',
+        'rung':     f'fit_rung_{signal}.txt',
+    }
 
-# Create the postfit workspace which will be used as a snapshot for the limit toys. 
-def make_postfit_workspace(fd):
-    signal = fd.split('.root')[0].split('_')[-1]
-    print(f'Making postfit workspace for signal {signal}...')
-    w_f = ROOT.TFile.Open(f'higgsCombineTest.FitDiagnostics.mH120.{signal}.root','READ')
+def _locate(name, workspace):
+    '''Path of a file still in the current directory, or already moved to the workspace'''
+    for path in [name, os.path.join(workspace, name)]:
+        if os.path.exists(path):
+            return path
+    return None
+
+# Create the postfit workspace which will be used as a snapshot for the limit toys.
+def make_postfit_workspace(wfile, fitfile, out):
+    import ROOT
+    w_f = ROOT.TFile.Open(wfile,'READ')
     w = w_f.Get('w')
-    fr_f = ROOT.TFile.Open(f'fitDiagnosticsTest_{signal}.root')
+    fr_f = ROOT.TFile.Open(fitfile)
     fr = fr_f.Get('fit_b')
-    if (fr == None):
-        print(f'Fit result "fit_b" does not exist in fit result file {fr_f}')
-        failed.write(f'{signal}\n')
-    else:
-        myargs = ROOT.RooArgSet(fr.floatParsFinal())
-        w.saveSnapshot('initialFit',myargs,True)
-        fout = ROOT.TFile(f'initialFitWorkspace_{signal}.root', "recreate")
-        fout.WriteTObject(w, 'w')
-        fout.Close()
-
-
-cards = glob.glob('card_*.txt')
-roots = glob.glob('fitDiagnosticsTest_*.root')
-
-for rootfile in roots:
-    signal = rootfile.split('.root')[0].split('_')[-1]
-    # check if the signal has cards as well 
-    if f'card_{signal}.txt' not in cards: 
-        print(f'ERROR: signal {signal} has a fitDiagnostics file but not a card...')
-        failed.write(f'{signal}\n')
-    else:
-        make_postfit_workspace(rootfile)
+    myargs = ROOT.RooArgSet(fr.floatParsFinal())
+    w.saveSnapshot('initialFit',myargs,True)
+    # Written under a temporary name, so that an interrupted job never leaves a truncated workspace
+    tmp = out.replace('.root', '.tmp.root')
+    fout = ROOT.TFile(tmp, "recreate")
+    fout.WriteTObject(w, 'w')
+    fout.Close()
+    fr_f.Close()
+    w_f.Close()
+    os.replace(tmp, out)
+
+def harvest(signal, dry_run=False, force=False):
+    '''Worker: validate, snapshot and move the outputs of one signal. Returns its manifest entry. With `force` the snapshot is always remade.'''
+    start = time.time()
+    workspace = f'{signal}_unblind_fits'
+    names = _names(signal)
+    entry = {'status': 'failed', 'workspace': workspace}
+    try:
+        paths = {k: _locate(n, workspace) for k, n in names.items()}
+        missing = [names[k] for k in ['card', 'fit', 'w'] if paths[k] is None]
+        if missing:
+            entry['error'] = f'missing {missing}'
+            return signal, entry
+        entry.update(check_fit(paths['fit']))
+        # Rung of the fit ladder which converged (only written by jobs submitted with a ladder)
+        if paths['rung'] is not None:
+            with open(paths['rung']) as f:
+                entry['rung'] = f.read().strip()
+        if entry['fit_b_status'] is None:
+            entry['error'] = f'fit result "fit_b" does not exist in {paths["fit"]}'
+            return signal, entry
+        # The snapshot is remade if it is missing or older than the fit result, or with force
+        if force or (paths['snapshot'] is None) or (os.path.getmtime(paths['snapshot']) < os.path.getmtime(paths['fit'])):
+            print(f'Making postfit workspace for signal {signal}...')
+            if dry_run:
+                paths.pop('snapshot')
+            else:
+                make_postfit_workspace(paths['w'], paths['fit'], names['snapshot'])
+                paths['snapshot'] = names['snapshot']
         # Move all the files to the proper workspace
-        workspace = f'{signal}_unblind_fits/'
-        for outputfile in [f'card_{signal}.txt', f'fitDiagnosticsTest_{signal}.root', f'initialFitWorkspace_{signal}.root',f'higgsCombineTest.FitDiagnostics.mH120.{signal}.root']:
-            execute_cmd(f'mv {outputfile} {workspace}')
\ No newline at end of file
+        router = OutputRouter(dry_run=dry_run)
+        for path in paths.values():
+            if (path is not None) and (os.path.dirname(path) == ''):
+                router.add(path, workspace+'/')
+        router.run()
+        if router.failed or router.missing:
+            entry['error'] = f'could not move {router.failed + router.missing}'
+            return signal, entry
+        entry['status'] = 'harvested'
+        entry['files'] = [os.path.join(workspace, names[k]) for k, path in paths.items() if path is not None]
+    except Exception as e:
+        traceback.print_exc()
+        entry['error'] = repr(e)
+    finally:
+        entry['time'] = time.time() - start
+    return signal, entry
+
+def load_manifest(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)['signals']
+
+def write_manifest(filename, manifest):
+    '''Atomically (re)write the JSON manifest'''
+    summary = {
+        'harvested': sorted(s for s, e in manifest.items() if e['status'] == 'harvested'),
+        'failed':    sorted(s for s, e in manifest.items() if e['status'] != 'harvested'),
+        'signals':   manifest
+    }
+    with open(filename+'.tmp', 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(filename+'.tmp', filename)
+
+def todo(manifest, force=False):
+    '''Signals with Condor output in the current directory, plus those not (completely) harvested before'''
+    new = [rootfile.split('.root')[0].split('_')[-1] for rootfile in glob.glob('fitDiagnosticsTest_*.root')]
+    retry = [s for s, e in manifest.items() if force or e['status'] != 'harvested']
+    return sorted(set(new + retry))
+
+def run(signals, manifest, manifest_file, workers=os.cpu_count(), dry_run=False, force=False):
+    with spawn_pool(workers) as pool:
+        futures = {pool.submit(harvest, sig, dry_run, force): sig for sig in signals}
+        for n, future in enumerate(as_completed(futures)):
+            sig = futures[future]
+            _, entry = worker_result(future, lambda e: (sig, {'status': 'failed', 'error': repr(e)}))
+            manifest[sig] = entry
+            print(f'[{n+1}/{len(signals)}] {sig}: {entry["status"]}{" ("+entry["error"]+")" if "error" in entry else ""}')
+            if not dry_run:
+                write_manifest(manifest_file, manifest)
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", type=int, dest='workers', action='store', default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument("--manifest", type=str, dest='manifest', action='store', default='harvest_manifest.json', help='JSON manifest of the harvested and failed signals')
+    parser.add_argument("--force", dest='force', action='store_true', help='If passed as an argument, also redo the signals already harvested according to the manifest, remaking their postfit workspaces.')
+    parser.add_argument("--dry-run", dest='dry_run', action='store_true', help='If passed as an argument, only print the file moves without doing them.')
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    signals = todo(manifest, args.force)
+    print(f'Harvesting {len(signals)} signals on {args.workers} workers ({len(manifest)} in the manifest)')
+    manifest = run(signals, manifest, args.manifest, workers=args.workers, dry_run=args.dry_run, force=args.force)
+    nfailed = sum(1 for sig in signals if manifest[sig]['status'] != 'harvested')
+    print(f'Done: {len(signals)-nfailed} harvested, {nfailed} failed.' + ('' if args.dry_run else f' Manifest written to {args.manifest}'))
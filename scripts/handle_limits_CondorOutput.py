@@ -1,10 +1,12 @@
 '''
 Moves the FitDiagnostics Condor output files to their respective directories.
 '''
-import glob, os, ROOT
-from TwoDAlphabet.helpers import execute_cmd
+import glob, os, sys, ROOT
 import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from output_router import OutputRouter
+
 
 '''
 IMPORTANT - the limits have been calculated in two ways (using the postfit workspace):
@@ -14,10 +16,12 @@ The second method speeds up limit calculation by a factor of almost 200 and prov
 '''
 parser = argparse.ArgumentParser()
 parser.add_argument("--withCR", dest='withCR', action='store_true', help='If passed as an argument, use the limits calculated with the ttbar CR. Otherwise, will use the limits calculated with the CR masked.')
+parser.add_argument("--dry-run", dest='dry_run', action='store_true', help='If passed as an argument, only print the file moves without doing them.')
 args = parser.parse_args()
 
 # Just hard-code this to look only for jobs without CR
 limits = glob.glob('higgsCombine_*_noCR_workspace.AsymptoticLimits.mH120.root')
+router = OutputRouter(dry_run=args.dry_run)
 
 for rootfile in limits:
     signal = rootfile.split('_')[1]
@@ -27,7 +31,10 @@ for rootfile in limits:
     limit = f.Get('limit')
     if limit.GetEntries() != 6:
         print(f'ERROR: AsymptoticLimit calculation for signal {signal} failed. Redo.')
-        execute_cmd(f'mv {rootfile} FAILED_{rootfile}')
+        router.add(rootfile, f'FAILED_{rootfile}')
     else:
-        execute_cmd(f'mv {rootfile} {signal}_unblind_fits/')
+        router.add(rootfile, f'{signal}_unblind_fits/')
     f.Close()
+
+router.run()
+router.summary()
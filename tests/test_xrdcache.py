@@ -0,0 +1,141 @@
+'''
+Tests of the local read-through cache (xrdcache.py), with a file:// directory standing in for EOS.
+
+    python -m pytest tests
+'''
+import os, sys, multiprocessing
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xrdcache import FileCache
+
+def write(path, size, mtime=None):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+@pytest.fixture
+def remote(tmp_path):
+    d = tmp_path / 'remote'
+    d.mkdir()
+    return d
+
+def cache(tmp_path, max_bytes=10**6):
+    return FileCache(cache_dir=str(tmp_path / 'cache'), max_bytes=max_bytes, ttl=0)
+
+def objects(c):
+    return sorted(os.listdir(c.objects))
+
+def test_fetch(tmp_path, remote):
+    write(remote / 'THselection_ttbar_18.root', 100)
+    c = cache(tmp_path)
+    url = f'file://{remote}/THselection_ttbar_18.root'
+    path = c.fetch(url)
+    assert path.startswith(c.objects)
+    with open(path, 'rb') as a, open(remote / 'THselection_ttbar_18.root', 'rb') as b:
+        assert a.read() == b.read()
+    # An unchanged file is not downloaded again
+    c._download = lambda url, dest: pytest.fail(f'{url} downloaded again')
+    assert c.fetch(url) == path
+    assert len(objects(c)) == 1
+
+def test_local_path_unchanged(tmp_path, remote):
+    write(remote / 'local.root', 10)
+    assert cache(tmp_path).fetch(str(remote / 'local.root')) == str(remote / 'local.root')
+
+def test_missing(tmp_path, remote):
+    with pytest.raises(FileNotFoundError):
+        cache(tmp_path).fetch(f'file://{remote}/missing.root')
+
+@pytest.mark.parametrize('change', ['size', 'mtime'])
+def test_invalidation(tmp_path, remote, change):
+    f = remote / 'THselection_QCD_18.root'
+    write(f, 100, mtime=1_600_000_000)
+    c = cache(tmp_path)
+    url = f'file://{f}'
+    old = c.fetch(url)
+    if change == 'size':
+        write(f, 200, mtime=1_600_000_000)
+    else:
+        write(f, 100, mtime=1_600_000_100)
+    new = c.fetch(url)
+    assert new != old
+    with open(new, 'rb') as a:
+        assert a.read() == f.read_bytes()
+
+def test_ttl(tmp_path, remote):
+    f = remote / 'THselection_QCD_18.root'
+    write(f, 100, mtime=1_600_000_000)
+    c = FileCache(cache_dir=str(tmp_path / 'cache'), ttl=3600)
+    old = c.fetch(f'file://{f}')
+    # Within the TTL, the remote is not checked again
+    write(f, 200, mtime=1_600_000_100)
+    assert c.fetch(f'file://{f}') == old
+
+def test_lru_eviction(tmp_path, remote):
+    for name in 'abc':
+        write(remote / f'{name}.root', 400)
+    c = cache(tmp_path, max_bytes=1000)
+    a = c.fetch(f'file://{remote}/a.root')
+    b = c.fetch(f'file://{remote}/b.root')
+    # a is now more recently used than b
+    assert c.fetch(f'file://{remote}/a.root') == a
+    cc = c.fetch(f'file://{remote}/c.root')
+    assert os.path.exists(a) and os.path.exists(cc)
+    assert not os.path.exists(b)
+
+def test_view(tmp_path, remote):
+    for name in ['a.root', 'b.root']:
+        write(remote / name, 400)
+    c = cache(tmp_path, max_bytes=1000)
+    viewdir = c.view(f'file://{remote}', ['a.root', 'b.root', 'missing.root'])
+    assert sorted(os.listdir(viewdir)) == ['a.root', 'b.root']
+    for name in ['a.root', 'b.root']:
+        with open(os.path.join(viewdir, name), 'rb') as a:
+            assert a.read() == (remote / name).read_bytes()
+
+def test_view_pinned(tmp_path, remote):
+    for name in 'abc':
+        write(remote / f'{name}.root', 400)
+    c = cache(tmp_path, max_bytes=1000)
+    viewdir = c.view(f'file://{remote}', ['a.root', 'b.root'])
+    # c.root needs room, but the objects linked from the view are not evicted
+    c.fetch(f'file://{remote}/c.root')
+    for name in ['a.root', 'b.root']:
+        assert os.path.exists(os.path.join(viewdir, name))
+
+def hold_view(cache_dir, base, ready, done):
+    FileCache(cache_dir=cache_dir, max_bytes=1000, ttl=0).view(base, ['a.root', 'b.root'])
+    ready.set()
+    done.wait(30)
+
+def test_view_pinned_across_processes(tmp_path, remote):
+    for name in 'abcd':
+        write(remote / f'{name}.root', 400)
+    ctx = multiprocessing.get_context('fork')
+    ready, done = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=hold_view, args=(str(tmp_path / 'cache'), f'file://{remote}', ready, done))
+    holder.start()
+    try:
+        assert ready.wait(30)
+        # A second cache on the same directory, as in another worker, evicts to make room for c.root
+        c = cache(tmp_path, max_bytes=1000)
+        c.fetch(f'file://{remote}/c.root')
+        viewdir = c.view(f'file://{remote}', [])
+        for name in ['a.root', 'b.root']:
+            assert os.path.exists(os.path.join(viewdir, name))
+    finally:
+        done.set()
+        holder.join()
+    # Once the holder has ended, its lease is dropped and its objects can be evicted again
+    c.fetch(f'file://{remote}/d.root')
+    assert os.listdir(c.pins) == []
+    assert not all(os.path.exists(os.path.join(viewdir, name)) for name in ['a.root', 'b.root'])
+
+def test_view_exceeds_cap(tmp_path, remote):
+    for name in 'abc':
+        write(remote / f'{name}.root', 400)
+    c = cache(tmp_path, max_bytes=1000)
+    with pytest.raises(IOError):
+        c.view(f'file://{remote}', ['a.root', 'b.root', 'c.root'])
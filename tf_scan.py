@@ -0,0 +1,271 @@
+'''
+Scan the transfer functions of one signal: fit every (SRtf, CRtf) pair of _rpf_options in parallel
+and rank them with F-tests, instead of running `jointSRttbarCR.py --makeCard --fit` by hand for
+each pair.
+
+The workspace (made once with `jointSRttbarCR.py --make`, which registers all TFs) is shared by all
+pairs. For each pair, a worker process builds its card (skipped if unchanged, see build_card), runs
+the b-only FitDiagnostics fit and the saturated goodness-of-fit test on data, and harvests the fit
+status, NLL and number of TF parameters. Every pair is then F-tested (TwoDAlphabet's FstatCalc)
+against each pair nested in it, i.e. with both TFs of lower or equal order. A pair is accepted if
+its fit converged and it is a significant improvement (p < alpha) over every converged pair nested
+in it. The pairs are ranked with the accepted ones first, by decreasing number of parameters (the
+highest justified order), then by goodness of fit.
+
+The output of every pair is captured in <logdir>/<signal>_SR<SRtf>-CR<CRtf>.log, and the results
+and ranking are written to tf_scan_<signal>.json.
+
+    python tf_scan.py -w 1800-125_unblind_ -s 1800-125 -j 16
+    python tf_scan.py -w 1800-125_unblind_ -s 1800-125 --SRtfs 0x0 1x0 1x1 --CRtfs 0x0 1x0 -j 6
+'''
+import os, json, time, traceback
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from run_grid import redirect_output, spawn_pool, worker_result
+
+REGIONS = ['SR_fail', 'SR_pass', 'ttbarCR_fail', 'ttbarCR_pass']
+
+def area_name(signal, SRtf, CRtf):
+    return f'TprimeB-{signal}-SR{SRtf}-CR{CRtf}_area'
+
+def nparams(SRtf, CRtf):
+    '''Number of TF parameters of a pair'''
+    from jointSRttbarCR import _rpf_options
+    return len(_rpf_options[SRtf]['constraints']) + len(_rpf_options[CRtf]['constraints'])
+
+def pair_nested(lower, higher):
+    '''Whether the TF pair (SRtf, CRtf) `lower` is a special case of the pair `higher`'''
+    from jointSRttbarCR import _rpf_nested
+    same_or_nested = lambda a, b: (a == b) or _rpf_nested(a, b)
+    return (lower != higher) and same_or_nested(lower[0], higher[0]) and same_or_nested(lower[1], higher[1])
+
+def nbins(workspace):
+    '''Number of bins of the fit, over all regions'''
+    from TwoDAlphabet.twoDalphabet import TwoDAlphabet
+    working_area = f'{workspace}fits'
+    twoD = TwoDAlphabet(working_area, f'{working_area}/runConfig.json', loadPrevious=True)
+    binning, _ = twoD.GetBinningFor('SR_fail')
+    return len(REGIONS) * (len(binning.xbinList)-1) * (len(binning.ybinList)-1)
+
+def read_fit(fitfile):
+    '''Status, covariance quality, NLL and number of floating TF parameters of the b-only fit'''
+    import ROOT
+    f = ROOT.TFile.Open(fitfile)
+    fit_b = f.Get('fit_b') if (f and not f.IsZombie()) else None
+    if not fit_b:
+        return {'status': None, 'covQual': None, 'nll': None, 'nrpf': None}
+    out = {
+        'status':  fit_b.status(),
+        'covQual': fit_b.covQual(),
+        'nll':     fit_b.minNll(),
+        'nrpf':    sum('_rpf_' in p.GetName() for p in fit_b.floatParsFinal()),
+    }
+    f.Close()
+    return out
+
+def read_gof(gofile):
+    '''Saturated test statistic on data'''
+    import ROOT
+    f = ROOT.TFile.Open(gofile)
+    tree = f.Get('limit') if (f and not f.IsZombie()) else None
+    if (not tree) or (tree.GetEntries() == 0):
+        return None
+    tree.GetEntry(0)
+    out = tree.limit
+    f.Close()
+    return out
+
+def fit_pair(workspace, signal, SRtf, CRtf, opts, logdir, seed=None):
+    '''Worker: card, b-only fit and saturated GoF of one TF pair, warm-started from the fit of the pair `seed`'''
+    import jointSRttbarCR as joint
+    from TwoDAlphabet.helpers import cd, execute_cmd
+    from workspace_cache import compiled_workspace
+    area = f'{workspace}fits/{area_name(signal, SRtf, CRtf)}'
+    log = os.path.join(logdir, f'{signal}_SR{SRtf}-CR{CRtf}.log')
+    result = {'SRtf': SRtf, 'CRtf': CRtf, 'area': area, 'log': log, 'nparams': nparams(SRtf, CRtf), 'seed': seed, 'error': None}
+    start = time.time()
+    with redirect_output(log):
+        try:
+            algo = joint.minimizer_algo(opts['robustFit'], opts['robustHesse'])
+            fit_opts = f'--cminDefaultMinimizerStrategy {opts["strat"]} --cminDefaultMinimizerTolerance {opts["tol"]}'
+            joint.test_fit(
+                workspace, signal, SRtf=SRtf, CRtf=CRtf,
+                defMinStrat=int(opts['strat']),
+                extra=f'{algo} --cminDefaultMinimizerTolerance {opts["tol"]}',
+                rMin=opts['rMin'], rMax=opts['rMax'], verbosity=opts['verbosity'],
+                autoMCStats=opts['autoMCStats'],
+                warm_start=seed
+            )
+            result.update(read_fit(f'{area}/fitDiagnosticsTest.root'))
+            # b-only saturated GoF on data, the input of the F-tests
+            compiled = compiled_workspace(area)
+            with cd(area):
+                execute_cmd(f'combine -M GoodnessOfFit -d {compiled} --algo saturated -n .tfscan --setParameters r=0 --freezeParameters r {fit_opts}')
+            result['gof'] = read_gof(f'{area}/higgsCombine.tfscan.GoodnessOfFit.mH120.root')
+        except BaseException as e:
+            traceback.print_exc()
+            result['error'] = repr(e)
+    result['time'] = time.time() - start
+    return result
+
+def converged(r):
+    return (r.get('error') is None) and (r.get('status') == 0) and (r.get('gof') is not None)
+
+def ftests(results, n):
+    '''F-test of every converged pair against every converged pair nested in it'''
+    import ROOT
+    from TwoDAlphabet.ftest import FstatCalc
+    gof = lambda r: f'{r["area"]}/higgsCombine.tfscan.GoodnessOfFit.mH120.root'
+    out = []
+    ok = [r for r in results if converged(r)]
+    for hi in ok:
+        for lo in ok:
+            if not pair_nested((lo['SRtf'], lo['CRtf']), (hi['SRtf'], hi['CRtf'])):
+                continue
+            p1, p2 = lo['nparams'], hi['nparams']
+            F = FstatCalc(gof(lo), gof(hi), p1, p2, n)
+            F = F[0] if len(F) else 0.
+            out.append({
+                'lower': f'{lo["SRtf"]}-{lo["CRtf"]}', 'higher': f'{hi["SRtf"]}-{hi["CRtf"]}',
+                'p1': p1, 'p2': p2, 'n': n, 'F': F,
+                'pvalue': ROOT.Math.fdistribution_cdf_c(F, p2-p1, n-p2) if F > 0 else 1.
+            })
+    return out
+
+def rank(results, tests, alpha=0.05):
+    '''Results sorted by preference, each with its verdict'''
+    for r in results:
+        pair = f'{r["SRtf"]}-{r["CRtf"]}'
+        r['pair'] = pair
+        if not converged(r):
+            r['verdict'] = 'failed'
+            continue
+        worse = [t['lower'] for t in tests if (t['higher'] == pair) and (t['pvalue'] >= alpha)]
+        r['verdict'] = 'accepted' if not worse else f'not significant over {",".join(worse)}'
+        r['chi2_ndf'] = r['gof'] / max(r['n'] - r['nparams'], 1)
+    order = lambda r: (r['verdict'] != 'accepted', r['verdict'] == 'failed', -r['nparams'], r.get('gof') or float('inf'))
+    return sorted(results, key=order)
+
+def print_table(ranked):
+    print(f'{"rank":>4} {"SR":>4} {"CR":>4} {"npar":>5} {"status":>7} {"NLL":>14} {"GoF":>10} {"chi2/ndf":>9}  verdict')
+    for i, r in enumerate(ranked):
+        nll = f'{r["nll"]:14.3f}' if r.get('nll') is not None else f'{"-":>14}'
+        gof = f'{r["gof"]:10.2f}' if r.get('gof') is not None else f'{"-":>10}'
+        chi2 = f'{r["chi2_ndf"]:9.3f}' if 'chi2_ndf' in r else f'{"-":>9}'
+        status = r.get('status') if r.get('status') is not None else '-'
+        print(f'{i+1:>4} {r["SRtf"]:>4} {r["CRtf"]:>4} {r["nparams"]:>5} {status:>7} {nll} {gof} {chi2}  {r["verdict"]}')
+
+def seed_for(pair, done):
+    '''
+    The converged pair with the most parameters nested in `pair`, None if there is none. Ties are
+    broken by the TF names, so that the seed does not depend on the order in which the fits finished.
+    '''
+    candidates = [r for p, r in done.items() if pair_nested(p, pair) and converged(r)]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda r: (r['nparams'], r['SRtf'], r['CRtf']))
+    return (best['SRtf'], best['CRtf'])
+
+def tf_scan(workspace, signal, SRtfs, CRtfs, opts, workers=os.cpu_count(), logdir='logs/tf_scan', alpha=0.05, n=None, out=None, warm_start=False):
+    os.makedirs(logdir, exist_ok=True)
+    n = n or nbins(workspace)
+    pairs = [(SRtf, CRtf) for SRtf in SRtfs for CRtf in CRtfs]
+    print(f'Fitting {len(pairs)} TF pairs for {signal} on {workers} workers ({n} bins)')
+    done = {}
+    with spawn_pool(workers) as pool:
+        pending, running = list(pairs), {}
+        while pending or running:
+            # With warm starts, a pair is only fitted once all pairs nested in it are done
+            ready = [p for p in pending if (not warm_start) or all(q in done for q in pairs if pair_nested(q, p))]
+            for p in ready:
+                pending.remove(p)
+                seed = seed_for(p, done) if warm_start else None
+                running[pool.submit(fit_pair, workspace, signal, *p, opts, logdir, seed)] = p
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                SRtf, CRtf = p = running.pop(future)
+                r = worker_result(future, lambda e: {'SRtf': SRtf, 'CRtf': CRtf, 'area': f'{workspace}fits/{area_name(signal, SRtf, CRtf)}', 'nparams': nparams(SRtf, CRtf), 'error': repr(e)})
+                r['n'] = n
+                done[p] = r
+                seed = f' (from SR{r["seed"][0]}-CR{r["seed"][1]})' if r.get('seed') else ''
+                print(f'[{len(done)}/{len(pairs)}] SR{SRtf}-CR{CRtf}{seed}: {"ok" if converged(r) else "failed"}')
+    results = [done[p] for p in pairs]
+    tests = ftests(results, n)
+    ranked = rank(results, tests, alpha)
+    print_table(ranked)
+    out = out or f'tf_scan_{signal}.json'
+    with open(out+'.tmp', 'w') as f:
+        json.dump({'signal': signal, 'workspace': workspace, 'alpha': alpha, 'nbins': n, 'ranking': ranked, 'ftests': tests}, f, indent=2)
+    os.replace(out+'.tmp', out)
+    print(f'Results written to {out}')
+    return ranked, tests
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    from jointSRttbarCR import _rpf_options
+    parser = ArgumentParser()
+    parser.add_argument('-w', type=str, dest='workspace',
+                        action='store', default='jointSRttbarCR',
+                        help='workspace name')
+    parser.add_argument('-s', type=str, dest='sigmass',
+                        action='store', default='1800-125',
+                        help='mass of Tprime and Phi cand')
+    parser.add_argument('--SRtfs', type=str, nargs='+', dest='SRtfs',
+                        action='store', default=list(_rpf_options),
+                        help='SR TFs to scan (default: all)')
+    parser.add_argument('--CRtfs', type=str, nargs='+', dest='CRtfs',
+                        action='store', default=list(_rpf_options),
+                        help='ttbarCR TFs to scan (default: all)')
+    parser.add_argument('-j', type=int, dest='workers',
+                        action='store', default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--alpha', type=float, dest='alpha',
+                        action='store', default=0.05,
+                        help='F-test significance level')
+    parser.add_argument('--warmStart', dest='warmStart',
+                        action='store_true',
+                        help='Fit the pairs in order of increasing TF order, starting each fit from the converged fit of the largest pair nested in it')
+    parser.add_argument('--nbins', type=int, dest='nbins',
+                        action='store', default=None,
+                        help='Number of bins of the fit for the F-tests (default: from the workspace binning)')
+    parser.add_argument('--logdir', type=str, dest='logdir',
+                        action='store', default='logs/tf_scan',
+                        help='Directory for the per-pair logs')
+    parser.add_argument('-o', type=str, dest='out',
+                        action='store', default=None,
+                        help='Output JSON (default: tf_scan_<signal>.json)')
+    parser.add_argument('--autoMCStats', type=float, dest='autoMCStats',
+                        action='store', default=None,
+                        help='Replace the explicit ttbar mcstats nuisances by combine autoMCStats lines with this event threshold')
+    # Fit options
+    parser.add_argument('--strat', dest='strat',
+                        action='store', default='0',
+                        help='Default minimizer strategy')
+    parser.add_argument('--tol', dest='tol',
+                        action='store', default='0.1',
+                        help='Default minimizer tolerance')
+    parser.add_argument('--robustFit', dest='robustFit',
+                        action='store_true',
+                        help='If passed as argument, uses robustFit algo')
+    parser.add_argument('--robustHesse', dest='robustHesse',
+                        action='store_true',
+                        help='If passed as argument, uses robustHesse algo')
+    parser.add_argument('--rMin', dest='rMin',
+                        action='store', default='-1',
+                        help='Minimum allowed signal strength')
+    parser.add_argument('--rMax', dest='rMax',
+                        action='store', default='10',
+                        help='Maximium allowed signal strength')
+    parser.add_argument('-v', dest='verbosity',
+                        action='store', default='2',
+                        help='Combine verbosity')
+    args = parser.parse_args()
+
+    for tf in args.SRtfs + args.CRtfs:
+        if tf not in _rpf_options:
+            parser.error(f'Unknown TF {tf}, choose from {list(_rpf_options)}')
+    if args.robustFit and args.robustHesse:
+        parser.error('Cannot use both robustFit and robustHesse algorithms simultaneously')
+
+    opts = {k: getattr(args, k) for k in ['autoMCStats','strat','tol','robustFit','robustHesse','rMin','rMax','verbosity']}
+    tf_scan(args.workspace, args.sigmass, args.SRtfs, args.CRtfs, opts, workers=args.workers, logdir=args.logdir, alpha=args.alpha, n=args.nbins, out=args.out, warm_start=args.warmStart)
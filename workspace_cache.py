@@ -0,0 +1,75 @@
+'''
+Compiled (text2workspace) workspaces of the cards, cached per area, so that text2workspace runs at
+most once per card instead of once per combine call on card.txt.
+
+The workspace of a card is written to <area>/workspace_<key>.root, where the key is a hash of the
+card, of the shape files it reads (size and modification time, since base.root is too large to hash)
+and of the text2workspace options, by default the channel masks (mask_<channel> parameters) used to
+blind or mask regions. It is remade only if one of them changed, and <area>/workspaces.json keeps
+the workspace currently valid for each set of options (the outdated one is removed). The workspace
+is built under a lock on the area and put in place atomically, so concurrent stages wait for each
+other instead of compiling the same card twice.
+
+    from workspace_cache import compiled_workspace
+    ws = compiled_workspace('1800-125_unblind_fits/TprimeB-1800-125-SR0x0-CR0x0_area')
+    # then, in the area: combine -M AsymptoticLimits -d {ws} ...
+'''
+import os, json, fcntl, hashlib
+
+# Default text2workspace options, as used by 2DAlphabet for the fits
+T2W_OPTIONS = '--channel-masks'
+
+def _shape_files(card, area):
+    '''Files read by the `shapes` lines of the card, relative to the area'''
+    files = set()
+    with open(card) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 4 and fields[0] == 'shapes':
+                files.add(os.path.normpath(os.path.join(area, fields[3])))
+    return sorted(files)
+
+def workspace_key(area, card='card.txt', options=T2W_OPTIONS):
+    '''Hash of everything the compiled workspace of the card depends on, and those inputs'''
+    card_path = os.path.join(area, card)
+    with open(card_path, 'rb') as f:
+        card_hash = hashlib.sha256(f.read()).hexdigest()
+    shapes = []
+    for path in _shape_files(card_path, area):
+        st = os.stat(path)
+        shapes.append([path, st.st_size, st.st_mtime_ns])
+    inputs = {'card': card, 'card_hash': card_hash, 'shapes': shapes, 'options': options}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest(), inputs
+
+def compiled_workspace(area, card='card.txt', options=T2W_OPTIONS, force=False):
+    '''
+    File name (relative to the area) of the text2workspace output of the card of the area with the
+    given options, which is only made if the cached one is missing or outdated.
+    '''
+    from TwoDAlphabet.helpers import cd, execute_cmd
+    key, inputs = workspace_key(area, card, options)
+    out = f'workspace_{key[:16]}.root'
+    index_file = os.path.join(area, 'workspaces.json')
+    with open(os.path.join(area, '.workspace.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = {}
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+        entry = index.get(f'{card} {options}')
+        if (not force) and entry and (entry['key'] == key) and os.path.exists(os.path.join(area, out)):
+            print(f'Using the compiled workspace {area}/{out}')
+            return out
+        print(f'Compiling {area}/{card} into {out}')
+        tmp = out.replace('.root', '.tmp.root')
+        with cd(area):
+            execute_cmd(f'text2workspace.py {card} -o {tmp} {options}')
+        os.replace(os.path.join(area, tmp), os.path.join(area, out))
+        # The workspace of an older version of the card is not needed anymore
+        if entry and (entry['file'] != out) and os.path.exists(os.path.join(area, entry['file'])):
+            os.remove(os.path.join(area, entry['file']))
+        index[f'{card} {options}'] = {'key': key, 'file': out, 'inputs': inputs}
+        with open(index_file+'.tmp', 'w') as f:
+            json.dump(index, f, indent=4)
+        os.replace(index_file+'.tmp', index_file)
+    return out
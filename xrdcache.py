@@ -0,0 +1,305 @@
+'''
+Local read-through cache for the selection files stored on EOS.
+
+Every remote file (root://... or file://...) is fetched once into a local cache directory and
+re-used as long as the remote file has not changed. Cache entries are content-addressed by the
+remote file identity (URL, size and modification time), so a file which is rewritten on EOS gets a
+new entry, while an unchanged one is only checked with a cheap `xrdfs stat`. The total size of the
+cache is capped, evicting the least recently used entries first. The files linked from a view (see
+FileCache.view) are pinned for the lifetime of the process which made it, so that they are never
+evicted while 2DAlphabet may still read them. The pins are kept on disk, one lease file per
+process (pins/<host>-<pid>.json), so that they hold for all processes sharing the cache. Leases of
+processes which no longer run are dropped; those of other hosts are always honored.
+
+The cache location and size can be configured through the environment:
+    TPRIME_CACHE_DIR     cache directory (default: ~/.cache/tprime_xrd)
+    TPRIME_CACHE_MAX_GB  maximum cache size in GB (default: 50)
+    TPRIME_CACHE_TTL     seconds during which a validated entry is not re-checked against the remote (default: 600)
+
+Usage:
+    from xrdcache import open_root, fetch
+    f = open_root('root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection/THselection_ttbar_18.root')
+'''
+import os, json, time, shutil, hashlib, fcntl, socket, subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+CACHE_DIR = os.environ.get('TPRIME_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'tprime_xrd'))
+MAX_BYTES = int(float(os.environ.get('TPRIME_CACHE_MAX_GB', 50)) * 1024**3)
+TTL       = float(os.environ.get('TPRIME_CACHE_TTL', 600))
+
+EOS_SELECTION = 'root://cmseos.fnal.gov//store/user/ammitra/topHBoostedAllHad/selection'
+
+def _sha(*parts):
+    return hashlib.sha256('\0'.join(str(p) for p in parts).encode()).hexdigest()
+
+def _touch(path):
+    '''Mark a cache entry as used. Only the access time is updated, the modification time of a cached file stays fixed.'''
+    os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+
+def is_remote(url):
+    return url.startswith('root://') or url.startswith('file://')
+
+def _alive(lease):
+    '''Whether the process holding a lease file <host>-<pid>.json still runs. Processes of other hosts cannot be checked.'''
+    host, pid = os.path.basename(lease)[:-len('.json')].rsplit('-', 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _xrd_split(url):
+    '''root://host//path -> (root://host, /path)'''
+    u = urlparse(url)
+    return f'{u.scheme}://{u.netloc}', '/' + u.path.lstrip('/')
+
+class FileCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, ttl=TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+        self.objects   = os.path.join(cache_dir, 'objects')
+        self.refs      = os.path.join(cache_dir, 'refs')
+        self.pins      = os.path.join(cache_dir, 'pins')
+        for d in [self.objects, self.refs, self.pins]:
+            os.makedirs(d, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _lease(self):
+        return os.path.join(self.pins, f'{socket.gethostname()}-{os.getpid()}.json')
+
+    def pin(self, obj):
+        '''
+        Protect the cached object `obj` from eviction for the lifetime of this process. Returns False
+        if it was evicted before it could be pinned.
+        '''
+        with self._locked():
+            if not os.path.exists(obj):
+                return False
+            lease = self._lease()
+            pinned = set(self._read_ref(lease) or [])
+            if obj not in pinned:
+                self._write_ref(lease, sorted(pinned | {obj}))
+            return True
+
+    def pinned(self):
+        '''Objects pinned by running processes, dropping the leases of those which ended. Call with the lock held.'''
+        out = set()
+        for name in os.listdir(self.pins):
+            if not name.endswith('.json'):
+                continue
+            lease = os.path.join(self.pins, name)
+            if not _alive(lease):
+                os.remove(lease)
+                continue
+            out.update(self._read_ref(lease) or [])
+        return out
+
+    def stat(self, url):
+        '''(size, mtime) of a remote file. Raises FileNotFoundError if it does not exist.'''
+        if url.startswith('file://'):
+            st = os.stat(urlparse(url).path)
+            return st.st_size, int(st.st_mtime)
+        host, path = _xrd_split(url)
+        res = subprocess.run(['xrdfs', host, 'stat', path], capture_output=True, text=True)
+        if res.returncode != 0:
+            raise FileNotFoundError(f'ERROR: file {url} not found... ({res.stderr.strip()})')
+        info = dict(line.split(':', 1) for line in res.stdout.splitlines() if ':' in line)
+        size  = int(info['Size'].strip())
+        mtime = datetime.strptime(info['MTime'].strip(), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        return size, int(mtime.timestamp())
+
+    def _download(self, url, dest):
+        if url.startswith('file://'):
+            shutil.copyfile(urlparse(url).path, dest)
+        else:
+            res = subprocess.run(['xrdcp', '-f', '-s', url, dest], capture_output=True, text=True)
+            if res.returncode != 0:
+                raise FileNotFoundError(f'ERROR: could not copy {url}... ({res.stderr.strip()})')
+
+    def _read_ref(self, ref):
+        try:
+            with open(ref) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_ref(self, ref, entry):
+        tmp = f'{ref}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, ref)
+
+    def fetch(self, url):
+        '''Local path to an up-to-date copy of `url`. Plain local paths are returned unchanged.'''
+        if not is_remote(url):
+            return url
+        ref = os.path.join(self.refs, _sha(url) + '.json')
+        entry = self._read_ref(ref)
+        # Recently validated entries are used without asking the remote again
+        if entry and (time.time() - entry['checked'] < self.ttl):
+            obj = os.path.join(self.objects, entry['key'])
+            if os.path.exists(obj) and os.path.getsize(obj) == entry['size']:
+                _touch(obj)
+                return obj
+        size, mtime = self.stat(url)
+        key = _sha(url, size, mtime) + os.path.splitext(urlparse(url).path)[1]
+        obj = os.path.join(self.objects, key)
+        if not (os.path.exists(obj) and os.path.getsize(obj) == size):
+            print(f'Caching {url}')
+            tmp = f'{obj}.{os.getpid()}.tmp'
+            try:
+                self._download(url, tmp)
+                if os.path.getsize(tmp) != size:
+                    raise IOError(f'ERROR: size mismatch when copying {url}')
+                os.replace(tmp, obj)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.evict(keep=obj)
+        else:
+            _touch(obj)
+        self._write_ref(ref, {'url': url, 'key': key, 'size': size, 'mtime': mtime, 'checked': time.time()})
+        return obj
+
+    def evict(self, keep=None):
+        '''Remove the least recently used entries until the cache is below its size cap, except `keep` and the pinned ones'''
+        with self._locked():
+            pinned = self.pinned()
+            entries = []
+            for name in os.listdir(self.objects):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(self.objects, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+            total = sum(e[1] for e in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if (path == keep) or (path in pinned):
+                    continue
+                os.remove(path)
+                total -= size
+
+    def view(self, base, names):
+        '''
+        Directory in which each of `names` (files under the remote directory `base`) is a symlink
+        to its cached copy. Names which do not exist remotely are skipped. Used to point 2DAlphabet's
+        `path` at the cache. The linked files are pinned, and a view which does not fit in the size cap
+        of the cache raises an IOError.
+        '''
+        viewdir = os.path.join(self.cache_dir, 'views', _sha(base)[:16])
+        os.makedirs(viewdir, exist_ok=True)
+        total = 0
+        for name in names:
+            try:
+                obj = self.fetch(f'{base}/{name}')
+                # Another process may evict the new object before it is pinned: fetch it again
+                while not self.pin(obj):
+                    obj = self.fetch(f'{base}/{name}')
+            except FileNotFoundError:
+                print(f'WARNING: {base}/{name} does not exist, not cached')
+                continue
+            total += os.path.getsize(obj)
+            if total > self.max_bytes:
+                raise IOError(f'ERROR: the files of {base} need more than the cache size of {self.max_bytes/1024**3:.1f} GB, increase TPRIME_CACHE_MAX_GB')
+            link = os.path.join(viewdir, name)
+            tmp  = f'{link}.{os.getpid()}.tmp'
+            os.symlink(obj, tmp)
+            os.replace(tmp, link)
+        return viewdir
+
+def file_id(path):
+    '''
+    Identity of a local file, for keys of caches derived from it: for an object of the cache, its
+    key (made from the remote URL, size and modification time) and size, so that it does not change
+    when the same remote file is fetched again. Otherwise the path, size and modification time.
+    '''
+    st = os.stat(path)
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(get_cache().objects):
+        return [os.path.basename(path), st.st_size]
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = FileCache()
+    return _cache
+
+def fetch(url):
+    return get_cache().fetch(url)
+
+def open_root(url, mode='READ'):
+    '''ROOT.TFile.Open through the cache'''
+    import ROOT
+    path = fetch(url)
+    f = ROOT.TFile.Open(path, mode)
+    if (not f) or f.IsZombie():
+        raise FileNotFoundError(f'ERROR: file {url} could not be opened...')
+    return f
+
+def selection_url(name, base=EOS_SELECTION):
+    return f'{base}/{name}'
+
+def config_files(config):
+    '''
+    Names of the files below GLOBAL/path which a 2DAlphabet config needs, following the 2DAlphabet
+    substitution of $process/$syst (by their ALIAS if given) in FILE, FILE_UP and FILE_DOWN.
+    '''
+    glob_opts = config['GLOBAL']
+    signames = glob_opts.get('SIGNAME', [])
+    if isinstance(signames, str):
+        signames = [signames]
+    processes = {}
+    for proc, opts in config['PROCESSES'].items():
+        for name in ([proc.replace('SIGNAME', s) for s in signames] if 'SIGNAME' in proc else [proc]):
+            processes[name] = opts
+    names = []
+    for proc, opts in processes.items():
+        pname = opts.get('ALIAS', proc)
+        templates = []
+        if opts.get('LOC', '').startswith('path/'):
+            templates.append(opts['LOC'])
+        for syst in opts.get('SYSTEMATICS', []):
+            sopts = config['SYSTEMATICS'].get(syst, {})
+            for var in ['UP', 'DOWN']:
+                if sopts.get(var, '').startswith('path/'):
+                    templates.append((sopts[var], sopts.get('ALIAS', syst)))
+        for t in templates:
+            loc, sname = t if isinstance(t, tuple) else (t, '')
+            key = loc.split('/', 1)[1].split(':')[0]
+            name = glob_opts[key].replace('$process', pname).replace('$syst', sname)
+            names.append(name)
+    return list(dict.fromkeys(names))
+
+def cache_config(json_file, findreplace={}):
+    '''
+    Fetch all remote files used by a 2DAlphabet JSON config into the cache. Returns a findreplace
+    dictionary which points the config's `path` at a local view of the cached files.
+    '''
+    with open(json_file) as f:
+        text = f.read()
+    for k, v in findreplace.items():
+        text = text.replace(k, v)
+    config = json.loads(text)
+    base = config['GLOBAL']['path']
+    if not is_remote(base):
+        return {}
+    return {base: get_cache().view(base, config_files(config))}